@@ -1,6 +1,9 @@
 from django.contrib import admin
+from django.db.models import Avg, Max
+from django.urls import reverse
+from django.utils.html import format_html
 
-from .models import Blueprint, IndustryJob, Location, Owner, Request
+from .models import Blueprint, IndustryJob, Location, Owner, Request, SyncRun
 
 # Register your models here.
 
@@ -86,11 +89,98 @@ class LocationAdmin(admin.ModelAdmin):
 
 @admin.register(Owner)
 class OwnerAdmin(admin.ModelAdmin):
-    list_display = ("character", "_type", "corporation", "is_active")
+    list_display = (
+        "character",
+        "_type",
+        "corporation",
+        "is_active",
+        "_sync_failures",
+        "_avg_sync_duration",
+        "_max_sync_duration",
+        "_sync_runs",
+    )
+
+    def get_queryset(self, request):
+        return (
+            super()
+            .get_queryset(request)
+            .annotate(
+                avg_sync_duration=Avg("sync_runs__duration"),
+                max_sync_duration=Max("sync_runs__duration"),
+            )
+            .prefetch_related("sync_states")
+        )
 
     def _type(self, obj):
         return "Corporate" if obj.corporation else "Personal"
 
+    def _sync_failures(self, obj):
+        return ", ".join(
+            f"{sync_state.get_section_display()}: {sync_state.get_last_error_display()} "
+            f"({sync_state.consecutive_failures}x)"
+            for sync_state in obj.sync_states.all()
+            if sync_state.consecutive_failures
+        )
+
+    _sync_failures.short_description = "sync failures"
+
+    def _avg_sync_duration(self, obj):
+        return (
+            round(obj.avg_sync_duration, 1)
+            if obj.avg_sync_duration is not None
+            else None
+        )
+
+    _avg_sync_duration.short_description = "avg sync duration (s)"
+    _avg_sync_duration.admin_order_field = "avg_sync_duration"
+
+    def _max_sync_duration(self, obj):
+        return (
+            round(obj.max_sync_duration, 1)
+            if obj.max_sync_duration is not None
+            else None
+        )
+
+    _max_sync_duration.short_description = "max sync duration (s)"
+    _max_sync_duration.admin_order_field = "max_sync_duration"
+
+    def _sync_runs(self, obj):
+        url = (
+            reverse("admin:blueprints_syncrun_changelist")
+            + f"?owner__id__exact={obj.pk}"
+        )
+        return format_html('<a href="{}">Sync runs</a>', url)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(SyncRun)
+class SyncRunAdmin(admin.ModelAdmin):
+    list_display = (
+        "started_at",
+        "owner",
+        "section",
+        "duration",
+        "esi_calls",
+        "esi_bytes",
+        "db_queries",
+        "rows_created",
+        "rows_updated",
+        "rows_deleted",
+        "error",
+    )
+    list_filter = ("section", "error", ("owner", admin.RelatedOnlyFieldListFilter))
+    list_select_related = (
+        "owner__character__character",
+        "owner__corporation",
+    )
+    ordering = ("-started_at",)
+    date_hierarchy = "started_at"
+
     def has_add_permission(self, request):
         return False
 
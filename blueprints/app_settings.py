@@ -17,6 +17,20 @@ BLUEPRINTS_ESI_ERROR_LIMIT_THRESHOLD = clean_setting(
     "BLUEPRINTS_ESI_ERROR_LIMIT_THRESHOLD", 25
 )
 
+# Seconds the ESI status is cached and shared between workers
+BLUEPRINTS_ESI_STATUS_CACHE_SECONDS = clean_setting(
+    "BLUEPRINTS_ESI_STATUS_CACHE_SECONDS", 60
+)
+
+# Max number of pages of an ESI endpoint fetched concurrently
+BLUEPRINTS_ESI_PAGE_WORKERS = clean_setting("BLUEPRINTS_ESI_PAGE_WORKERS", 4)
+
+# Max number of owners synced concurrently by one batch sync task.
+# Further limited by the remaining ESI error limit above its threshold
+BLUEPRINTS_BATCH_SYNC_WORKERS = clean_setting(
+    "BLUEPRINTS_BATCH_SYNC_WORKERS", 20, min_value=1
+)
+
 BLUEPRINTS_ADMIN_NOTIFICATIONS_ENABLED = clean_setting(
     "BLUEPRINTS_ADMIN_NOTIFICATIONS_ENABLED", True
 )
@@ -35,3 +49,73 @@ BLUEPRINTS_LIST_ICON_OUTPUT_SIZE = clean_setting("BLUEPRINTS_LIST_ICON_OUTPUT_SI
 # Hours after a existing location (e.g. structure) becomes stale and gets updated
 # e.g. for name changes of structures
 BLUEPRINTS_LOCATION_STALE_HOURS = clean_setting("BLUEPRINTS_LOCATION_STALE_HOURS", 24)
+
+# Minutes a structure is not fetched again with a token that was denied access to it.
+# Doubles with every further denial up to BLUEPRINTS_STRUCTURE_DENIED_MAX_HOURS
+BLUEPRINTS_STRUCTURE_DENIED_BASE_MINUTES = clean_setting(
+    "BLUEPRINTS_STRUCTURE_DENIED_BASE_MINUTES", 60
+)
+BLUEPRINTS_STRUCTURE_DENIED_MAX_HOURS = clean_setting(
+    "BLUEPRINTS_STRUCTURE_DENIED_MAX_HOURS", 168
+)
+
+# Max number of structures updated from ESI by one task
+BLUEPRINTS_STRUCTURE_BATCH_SIZE = clean_setting("BLUEPRINTS_STRUCTURE_BATCH_SIZE", 50)
+
+# Max number of structures of a batch fetched concurrently from ESI
+BLUEPRINTS_STRUCTURE_WORKERS = clean_setting("BLUEPRINTS_STRUCTURE_WORKERS", 4)
+
+# Seconds across which the updates of all owners are spread by the update_all tasks.
+# Owners whose ESI cache expires within this window are queued to run after expiry
+BLUEPRINTS_UPDATE_SPREAD_SECONDS = clean_setting(
+    "BLUEPRINTS_UPDATE_SPREAD_SECONDS", 900
+)
+
+# Max number of owners synced together by one task queued by the update_all tasks.
+# Heavy owners are always synced by a task of their own
+BLUEPRINTS_UPDATE_BATCH_SIZE = clean_setting(
+    "BLUEPRINTS_UPDATE_BATCH_SIZE", 10, min_value=1
+)
+
+# Minutes scheduled syncs of an owner are skipped after a failed sync.
+# Doubles with every further failure up to BLUEPRINTS_OWNER_BACKOFF_MAX_HOURS
+BLUEPRINTS_OWNER_BACKOFF_BASE_MINUTES = clean_setting(
+    "BLUEPRINTS_OWNER_BACKOFF_BASE_MINUTES", 30
+)
+BLUEPRINTS_OWNER_BACKOFF_MAX_HOURS = clean_setting(
+    "BLUEPRINTS_OWNER_BACKOFF_MAX_HOURS", 24
+)
+
+# Syncs of owners, whose last sync of a section took at least this many seconds
+# or fetched at least this many bytes from ESI, are routed as heavy syncs
+BLUEPRINTS_HEAVY_SYNC_DURATION_SECONDS = clean_setting(
+    "BLUEPRINTS_HEAVY_SYNC_DURATION_SECONDS", 120
+)
+BLUEPRINTS_HEAVY_SYNC_ESI_BYTES = clean_setting(
+    "BLUEPRINTS_HEAVY_SYNC_ESI_BYTES", 10_000_000
+)
+
+# Priority of heavy syncs, so syncs of small owners are not delayed by them
+BLUEPRINTS_HEAVY_SYNC_PRIORITY = clean_setting(
+    "BLUEPRINTS_HEAVY_SYNC_PRIORITY", 8, min_value=0, max_value=9
+)
+
+# Name of a separate celery queue for heavy syncs. Uses the default queue if not set
+BLUEPRINTS_HEAVY_SYNC_QUEUE = clean_setting(
+    "BLUEPRINTS_HEAVY_SYNC_QUEUE", None, required_type=str
+)
+
+# Days the metrics of sync runs are kept, e.g. for finding slow owners
+BLUEPRINTS_SYNC_RUNS_KEEP_DAYS = clean_setting("BLUEPRINTS_SYNC_RUNS_KEEP_DAYS", 30)
+
+# Max number of objects created, updated or deleted per query during bulk syncs
+BLUEPRINTS_BULK_METHODS_BATCH_SIZE = clean_setting(
+    "BLUEPRINTS_BULK_METHODS_BATCH_SIZE", 500
+)
+
+# Max number of rows written per chunk when syncing blueprints or locations.
+# Each chunk is committed with a checkpoint,
+# so an interrupted sync resumes after the last committed chunk
+BLUEPRINTS_SYNC_CHUNK_SIZE = clean_setting(
+    "BLUEPRINTS_SYNC_CHUNK_SIZE", 5000, min_value=1
+)
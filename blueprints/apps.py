@@ -7,3 +7,6 @@ class BlueprintsConfig(AppConfig):
     name = "blueprints"
     label = "blueprints"
     verbose_name = f"Blueprints v{__version__}"
+
+    def ready(self):
+        from . import signals  # noqa: F401
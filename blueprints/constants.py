@@ -11,6 +11,9 @@ EVE_CATEGORY_ID_FIGHTER = 87
 EVE_CATEGORY_ID_STRUCTURE = 65
 EVE_TYPE_ID_SOLAR_SYSTEM = 5
 
+# Max number of IDs ESI accepts for bulk endpoints like /universe/names/
+ESI_MAX_IDS_PER_REQUEST = 1000
+
 EVE_LOCATION_FLAGS = [
     "AssetSafety",
     "AutoFit",
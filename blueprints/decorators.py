@@ -1,11 +1,20 @@
+import datetime as dt
 from functools import wraps
+from time import perf_counter
+from typing import Iterable
 
+from bravado.exception import HTTPForbidden, HTTPServerError
+
+from django.utils.timezone import now
 from esi.errors import TokenError
 
 from allianceauth.services.hooks import get_extension_logger
 from app_utils.logging import LoggerAddTag
 
 from . import __title__
+from .app_settings import BLUEPRINTS_SYNC_RUNS_KEEP_DAYS
+from .helpers import EsiStatusException
+from .helpers.sync_metrics import SyncMetrics, collect_sync_metrics
 
 logger = LoggerAddTag(get_extension_logger(__name__), __title__)
 
@@ -13,6 +22,7 @@ logger = LoggerAddTag(get_extension_logger(__name__), __title__)
 def fetch_token_for_owner(scopes):
     """returns valid token for owner.
     Needs to be attached on an Owner method !!
+    A token already resolved for the owner can be passed as `token` keyword.
 
     Args:
     -scopes: Provide the required scopes.
@@ -20,10 +30,11 @@ def fetch_token_for_owner(scopes):
 
     def decorator(func):
         @wraps(func)
-        def _wrapped_view(owner, *args, **kwargs):
-            token, error = owner.token(scopes)
-            if error:
-                raise TokenError
+        def _wrapped_view(owner, *args, token=None, **kwargs):
+            if token is None:
+                token, error = owner.token(scopes)
+                if error:
+                    raise TokenError
             logger.debug(
                 "%s: Using token %s for `%s`",
                 token.character_name,
@@ -35,3 +46,137 @@ def fetch_token_for_owner(scopes):
         return _wrapped_view
 
     return decorator
+
+
+def with_token_context(func):
+    """resolves tokens and checks permissions only once
+    during the call of the decorated Owner method
+    """
+
+    @wraps(func)
+    def _wrapped_view(owner, *args, **kwargs):
+        with owner.token_context():
+            return func(owner, *args, **kwargs)
+
+    return _wrapped_view
+
+
+def record_sync_run(section: str):
+    """records the metrics of each call of the decorated Owner method
+    as SyncRun of the given section.
+
+    Also records failures of the section, which are not caused by ESI being
+    unavailable, and resets them after a successful sync of the same section.
+
+    Args:
+    - section: section synced by the method
+    """
+
+    def decorator(func):
+        @wraps(func)
+        def _wrapped_view(owner, *args, **kwargs):
+            if not owner.is_active:
+                return func(owner, *args, **kwargs)
+
+            started_at = now()
+            start = perf_counter()
+            result = None
+            error = owner.ERROR_NONE
+            metrics = SyncMetrics()
+            try:
+                with collect_sync_metrics(metrics):
+                    result = func(owner, *args, **kwargs)
+            except TokenError:
+                error = owner.token(owner.esi_scopes())[1] or owner.ERROR_TOKEN_INVALID
+                raise
+            except HTTPForbidden:
+                # e.g. the character is missing roles in the corporation
+                error = owner.ERROR_INSUFFICIENT_PERMISSIONS
+                raise
+            except (EsiStatusException, HTTPServerError, OSError):
+                error = owner.ERROR_ESI_UNAVAILABLE
+                raise
+            except Exception:
+                error = owner.ERROR_UNKNOWN
+                raise
+            finally:
+                _finish_sync_run(
+                    owner=owner,
+                    section=section,
+                    started_at=started_at,
+                    duration=perf_counter() - start,
+                    metrics=metrics,
+                    result=result,
+                    error=error,
+                )
+            return result
+
+        return _wrapped_view
+
+    return decorator
+
+
+def record_failed_sync_runs(owner, sections: Iterable[str], error: int):
+    """records sync runs of sections, which failed before their sync started,
+    e.g. because no valid token was found for the owner
+
+    Args:
+    - owner: owner of the sections
+    - sections: sections, which could not be synced
+    - error: error code of the owner
+    """
+    started_at = now()
+    for section in sections:
+        _finish_sync_run(
+            owner=owner,
+            section=section,
+            started_at=started_at,
+            duration=0,
+            metrics=SyncMetrics(),
+            result=None,
+            error=error,
+        )
+
+
+def _finish_sync_run(owner, section, started_at, duration, metrics, result, error):
+    """records failures or resets them after a successful sync
+    and saves the sync run
+    """
+    if error == owner.ERROR_NONE:
+        sync_state = owner.sync_state(section)
+        if sync_state.consecutive_failures:
+            sync_state.reset_failures()
+    elif error != owner.ERROR_ESI_UNAVAILABLE:
+        owner.record_sync_failure([section], error)
+    _save_sync_run(
+        owner=owner,
+        section=section,
+        started_at=started_at,
+        duration=duration,
+        metrics=metrics,
+        result=result,
+        error=error,
+    )
+
+
+def _save_sync_run(owner, section, started_at, duration, metrics, result, error):
+    """saves a sync run and removes runs older than the retention period"""
+    from .managers import SyncResult
+
+    result = result if isinstance(result, SyncResult) else SyncResult()
+    owner.sync_runs.create(
+        section=section,
+        started_at=started_at,
+        duration=duration,
+        esi_calls=metrics.esi_calls,
+        esi_bytes=metrics.esi_bytes,
+        db_queries=metrics.db_queries,
+        rows_created=result.created,
+        rows_updated=result.updated,
+        rows_deleted=result.deleted,
+        error=error,
+    )
+    owner.sync_runs.filter(
+        section=section,
+        started_at__lt=now() - dt.timedelta(days=BLUEPRINTS_SYNC_RUNS_KEEP_DAYS),
+    ).delete()
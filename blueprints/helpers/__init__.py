@@ -0,0 +1,328 @@
+import hashlib
+import json
+import random
+from contextlib import contextmanager
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+from time import sleep, time
+from typing import List, Optional
+
+import requests
+
+from django.core.cache import cache
+
+from allianceauth.services.hooks import get_extension_logger
+from app_utils.logging import LoggerAddTag
+
+from .. import __title__, __version__
+from ..app_settings import (
+    BLUEPRINTS_ESI_ERROR_LIMIT_THRESHOLD,
+    BLUEPRINTS_ESI_STATUS_CACHE_SECONDS,
+)
+
+logger = LoggerAddTag(get_extension_logger(__name__), __title__)
+
+ESI_STATUS_CACHE_KEY = "BLUEPRINTS_ESI_STATUS"
+ESI_ERROR_BUDGET_CACHE_KEY = "BLUEPRINTS_ESI_ERROR_BUDGET_RESERVED"
+ESI_ERROR_BUDGET_CACHE_TIMEOUT = 300
+
+_requests_session = None
+
+
+class EsiStatusException(Exception):
+    """EsiStatus base exception"""
+
+    def __init__(self, message):
+        super().__init__()
+        self.message = message
+
+
+class EsiOffline(EsiStatusException):
+    """ESI is offline"""
+
+    def __init__(self):
+        super().__init__("ESI appears to be offline")
+
+
+class EsiErrorLimitExceeded(EsiStatusException):
+    """ESI error limit exceeded"""
+
+    def __init__(self, retry_in: float) -> None:
+        retry_in = float(retry_in)
+        super().__init__("The ESI error limit has been exceeded.")
+        self.retry_in = retry_in  # seconds until next error window
+
+
+class EsiStatus:
+    """Current status of ESI (immutable)"""
+
+    MAX_JITTER = 20
+
+    def __init__(
+        self,
+        is_online: bool,
+        error_limit_remain: int = None,
+        error_limit_reset: int = None,
+    ) -> None:
+        self._is_online = bool(is_online)
+        if error_limit_remain is None or error_limit_reset is None:
+            self._error_limit_remain = None
+            self._error_limit_reset = None
+        else:
+            self._error_limit_remain = int(error_limit_remain)
+            self._error_limit_reset = int(error_limit_reset)
+
+    @property
+    def is_online(self) -> bool:
+        return self._is_online
+
+    @property
+    def error_limit_remain(self) -> Optional[int]:
+        return self._error_limit_remain
+
+    @property
+    def error_limit_reset(self) -> Optional[int]:
+        return self._error_limit_reset
+
+    @property
+    def is_error_limit_exceeded(self) -> bool:
+        """return True if remain is below the threshold, else False.
+
+        Will also return False if remain/reset are not defined
+        """
+        return bool(
+            self.error_limit_remain
+            and self.error_limit_reset
+            and self.error_limit_remain <= BLUEPRINTS_ESI_ERROR_LIMIT_THRESHOLD
+        )
+
+    def error_limit_reset_w_jitter(self, max_jitter: int = None) -> int:
+        """seconds to retry in order to reach next error window incl. jitter"""
+        if self.error_limit_reset is None:
+            return 0
+        else:
+            if not max_jitter or max_jitter < 1:
+                max_jitter = self.MAX_JITTER
+
+            return self.error_limit_reset + int(random.uniform(1, max_jitter))
+
+    def raise_for_status(self):
+        """will raise an exception derived from EsiStatusException
+        if and only if conditions are met."""
+        if not self.is_online:
+            raise EsiOffline()
+
+        if self.is_error_limit_exceeded:
+            raise EsiErrorLimitExceeded(retry_in=self.error_limit_reset_w_jitter())
+
+
+def esi_status() -> EsiStatus:
+    """returns the current ESI online and error status
+
+    The status is shared between all workers through the cache
+    and only fetched from ESI again after it has expired.
+    """
+    cached = cache.get(ESI_STATUS_CACHE_KEY)
+    if cached:
+        is_online, error_limit_remain, error_limit_reset_at = cached
+        if error_limit_reset_at is None:
+            return EsiStatus(is_online=is_online)
+        return EsiStatus(
+            is_online=is_online,
+            error_limit_remain=error_limit_remain,
+            error_limit_reset=max(0, int(error_limit_reset_at - time())),
+        )
+
+    status = fetch_esi_status()
+    _cache_esi_status(status)
+    return status
+
+
+@contextmanager
+def reserve_esi_error_budget(slots: int = 1):
+    """reserves slots of the ESI error budget shared by all workers
+    for the duration of an error-prone ESI request.
+
+    Will raise EsiErrorLimitExceeded with the countdown to the next error window
+    when the slots would exceed the remaining budget above the threshold.
+    The slots are released again once the request is done,
+    since any errors are then reported in the error limit headers.
+
+    Args:
+    - slots: number of error-prone requests to reserve slots for
+    """
+    status = esi_status()
+    status.raise_for_status()
+    reserved = _change_reserved_error_budget(slots)
+    if (
+        status.error_limit_remain is not None
+        and reserved > status.error_limit_remain - BLUEPRINTS_ESI_ERROR_LIMIT_THRESHOLD
+    ):
+        _change_reserved_error_budget(-slots)
+        raise EsiErrorLimitExceeded(retry_in=status.error_limit_reset_w_jitter())
+
+    try:
+        yield
+    finally:
+        _change_reserved_error_budget(-slots)
+
+
+def _change_reserved_error_budget(delta: int) -> int:
+    """atomically changes the number of reserved slots and returns the new number"""
+    cache.add(ESI_ERROR_BUDGET_CACHE_KEY, 0, timeout=ESI_ERROR_BUDGET_CACHE_TIMEOUT)
+    try:
+        return cache.incr(ESI_ERROR_BUDGET_CACHE_KEY, delta)
+    except ValueError:
+        # reservations have expired in the meantime
+        cache.add(
+            ESI_ERROR_BUDGET_CACHE_KEY,
+            max(0, delta),
+            timeout=ESI_ERROR_BUDGET_CACHE_TIMEOUT,
+        )
+        return max(0, delta)
+
+
+def update_esi_status_from_headers(headers: dict) -> Optional[EsiStatus]:
+    """updates the cached ESI status from the error limit headers of an ESI response
+
+    Returns the new status or None if the headers have no error limit
+    """
+    try:
+        error_limit_remain = int(_get_header(headers, "X-Esi-Error-Limit-Remain"))
+        error_limit_reset = int(_get_header(headers, "X-Esi-Error-Limit-Reset"))
+    except (TypeError, ValueError):
+        return None
+    status = EsiStatus(
+        is_online=True,
+        error_limit_remain=error_limit_remain,
+        error_limit_reset=error_limit_reset,
+    )
+    _cache_esi_status(status)
+    return status
+
+
+def _cache_esi_status(status: EsiStatus):
+    """stores the ESI status in the cache until it expires or its error window ends"""
+    timeout = BLUEPRINTS_ESI_STATUS_CACHE_SECONDS
+    if status.error_limit_reset is None:
+        error_limit_reset_at = None
+    else:
+        error_limit_reset_at = time() + status.error_limit_reset
+        timeout = max(1, min(timeout, status.error_limit_reset))
+    cache.set(
+        ESI_STATUS_CACHE_KEY,
+        (status.is_online, status.error_limit_remain, error_limit_reset_at),
+        timeout=timeout,
+    )
+
+
+def _get_header(headers: dict, name: str) -> Optional[str]:
+    """returns the value of a HTTP header independent of the case of its name"""
+    name = name.lower()
+    for key, value in headers.items():
+        if key.lower() == name:
+            return value
+    return None
+
+
+def _session() -> requests.Session:
+    """returns the requests session of this process for calling ESI directly"""
+    global _requests_session
+
+    if not _requests_session:
+        _requests_session = requests.Session()
+        _requests_session.headers.update({"User-Agent": f"{__title__};{__version__}"})
+
+    return _requests_session
+
+
+def fetch_esi_status() -> EsiStatus:
+    """returns the current ESI online and error status from ESI"""
+    max_retries = 3
+    retries = 0
+    while True:
+        try:
+            r = _session().get(
+                "https://esi.evetech.net/latest/status/", timeout=(5, 30)
+            )
+        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError):
+            logger.warning("Network error when trying to call ESI", exc_info=True)
+            return EsiStatus(
+                is_online=False, error_limit_remain=None, error_limit_reset=None
+            )
+        if r.status_code not in {
+            502,  # HTTPBadGateway
+            503,  # HTTPServiceUnavailable
+            504,  # HTTPGatewayTimeout
+        }:
+            break
+        else:
+            retries += 1
+            if retries > max_retries:
+                break
+            else:
+                logger.warning(
+                    "HTTP status code %s - Retry %s/%s",
+                    r.status_code,
+                    retries,
+                    max_retries,
+                )
+                wait_secs = 0.1 * (random.uniform(2, 4) ** (retries - 1))
+                sleep(wait_secs)
+
+    if not r.ok:
+        is_online = False
+    else:
+        try:
+            is_online = False if r.json().get("vip") else True
+        except ValueError:
+            is_online = False
+
+    try:
+        remain = int(r.headers.get("X-Esi-Error-Limit-Remain"))
+        reset = int(r.headers.get("X-Esi-Error-Limit-Reset"))
+    except TypeError:
+        logger.warning("Failed to parse HTTP headers: %s", r.headers, exc_info=True)
+        return EsiStatus(is_online=is_online)
+    else:
+        logger.debug(
+            "ESI status: is_online: %s, error_limit_remain = %s, error_limit_reset = %s",
+            is_online,
+            remain,
+            reset,
+        )
+        return EsiStatus(
+            is_online=is_online, error_limit_remain=remain, error_limit_reset=reset
+        )
+
+
+def hash_payload(payload: List[dict], sort_key: str) -> str:
+    """returns a stable hash of a list of objects from ESI independent of their order
+
+    Args:
+    - payload: objects from ESI
+    - sort_key: key of the ID field, which is used for ordering the objects
+    """
+    data = json.dumps(
+        sorted(payload, key=lambda obj: obj[sort_key]), sort_keys=True, default=str
+    )
+    return hashlib.md5(data.encode("utf-8")).hexdigest()
+
+
+def hash_index(index: dict) -> str:
+    """returns a stable hash of an index of objects from ESI by their IDs
+
+    The index is hashed entry by entry, so no serialized copy of it is created.
+    """
+    digest = hashlib.md5()
+    for key in sorted(index):
+        digest.update(json.dumps([key, index[key]], default=str).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def parse_expires(headers: dict) -> Optional[datetime]:
+    """returns the expiry of an ESI response from its headers or None if unknown"""
+    try:
+        return parsedate_to_datetime(_get_header(headers, "Expires"))
+    except (KeyError, TypeError, ValueError):
+        return None
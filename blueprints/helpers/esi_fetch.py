@@ -4,14 +4,26 @@
     - Automatic page retry on 502, 503, 504 up to max retries with exponential backoff
     - Automatic retrieval of all pages
     - Automatic retrieval of variants for all requested languages
+    - Optional conditional requests with ETags
+    - Concurrent retrieval of pages
+    - Optional streaming of pages
 
     This file borrowed from: https://gitlab.com/ErikKalkoken/aa-structures/
 """
 
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from time import sleep
+from typing import Iterator, Optional
 
-from bravado.exception import HTTPBadGateway, HTTPGatewayTimeout, HTTPServiceUnavailable
+from bravado.exception import (
+    HTTPBadGateway,
+    HTTPGatewayTimeout,
+    HTTPNotModified,
+    HTTPServiceUnavailable,
+)
 
 from django.conf import settings
 from esi.clients import esi_client_factory
@@ -20,7 +32,13 @@ from esi.models import Token
 from app_utils.logging import LoggerAddTag
 
 from .. import __title__
-from ..app_settings import BLUEPRINTS_ESI_TIMEOUT_ENABLED
+from ..app_settings import (
+    BLUEPRINTS_ESI_ERROR_LIMIT_THRESHOLD,
+    BLUEPRINTS_ESI_PAGE_WORKERS,
+    BLUEPRINTS_ESI_TIMEOUT_ENABLED,
+)
+from . import _get_header, update_esi_status_from_headers
+from .sync_metrics import propagate_sync_metrics, record_esi_call
 
 logger = LoggerAddTag(logging.getLogger(__name__), __title__)
 
@@ -29,6 +47,56 @@ ESI_RETRY_SLEEP_SECS = 1
 
 _my_esi_client = None
 
+# limits concurrent requests to ESI, e.g. across processes
+_esi_request_slots = None
+
+# limits pages fetched concurrently by the current thread
+_page_workers = threading.local()
+
+
+def limit_concurrent_esi_requests(slots) -> None:
+    """limits concurrent requests to ESI from this process
+
+    Args:
+    - slots: semaphore to acquire for each request, e.g. shared between processes.
+      None removes the limit.
+    """
+    global _esi_request_slots
+    _esi_request_slots = slots
+
+
+@contextmanager
+def esi_request_slot():
+    """holds a slot for one request to ESI while within the context, if limited
+
+    Also used for ESI requests not made with esi_fetch,
+    e.g. by django-eveuniverse, so they count against the same limit.
+    Must not be nested, since a slot is held for the whole context.
+    """
+    slots = _esi_request_slots
+    if slots is None:
+        yield
+    else:
+        with slots:
+            yield
+
+
+@contextmanager
+def limit_page_workers(max_workers: Optional[int]):
+    """limits the number of pages fetched concurrently
+    by this thread while within the context,
+    e.g. when the caller is already one of several concurrent syncs
+
+    Args:
+    - max_workers: max number of pages fetched concurrently. None removes the limit.
+    """
+    previous = getattr(_page_workers, "max_workers", None)
+    _page_workers.max_workers = max_workers
+    try:
+        yield
+    finally:
+        _page_workers.max_workers = previous
+
 
 def esi_fetch(
     esi_path: str,
@@ -37,6 +105,9 @@ def esi_fetch(
     token: Token = None,
     esi_client: object = None,
     logger_tag: str = None,
+    etags: dict = None,
+    response_headers: dict = None,
+    max_workers: int = None,
 ) -> dict:
     """returns an response object from ESI, will retry on some HTTP errors.
     will automatically return all pages if requested
@@ -50,6 +121,12 @@ def esi_fetch(
     - esi_client: esi client object from django-esi to be used for request
     instead of default esi client from this module
     - logger_tag: every log message will start with this text in brackets
+    - etags: ETags of the last response by page. When given, pages are requested
+    conditionally and the dict is updated with the ETags of the new response.
+    Returns None if no page has been modified since.
+    - response_headers: when given, is updated with the headers of the first page
+    - max_workers: max number of pages fetched concurrently,
+    defaults to ``BLUEPRINTS_ESI_PAGE_WORKERS``
     """
     _, request_object = _fetch_main(
         esi_path=esi_path,
@@ -59,10 +136,42 @@ def esi_fetch(
         esi_client=esi_client,
         token=token,
         logger_tag=logger_tag,
+        etags=etags,
+        response_headers=response_headers,
+        max_workers=max_workers,
     ).popitem()
     return request_object
 
 
+def esi_fetch_pages(
+    esi_path: str,
+    args: dict = None,
+    token: Token = None,
+    esi_client: object = None,
+    logger_tag: str = None,
+    etags: dict = None,
+    response_headers: dict = None,
+    max_workers: int = None,
+) -> Optional[Iterator[list]]:
+    """returns an iterator over the response objects of all pages from ESI in order.
+    Only a few pages are held in memory at the same time.
+
+    Args are the same as for ``esi_fetch``. When etags are given, the dict is updated
+    once all pages have been consumed. Returns None if no page has been modified since.
+    """
+    return _fetch_pages(
+        esi_path=esi_path,
+        args=dict(args) if args else {},
+        has_pages=True,
+        esi_client=esi_client,
+        token=token,
+        logger_tag=logger_tag,
+        etags=etags,
+        response_headers=response_headers,
+        max_workers=max_workers,
+    )
+
+
 def esi_fetch_with_localization(
     esi_path: str,
     languages: set,
@@ -108,6 +217,9 @@ def _fetch_main(
     esi_client: object,
     token: Token,
     logger_tag: str,
+    etags: dict = None,
+    response_headers: dict = None,
+    max_workers: int = None,
 ) -> dict:
     """returns dict of response objects from ESI with localization"""
 
@@ -131,6 +243,9 @@ def _fetch_main(
             esi_client=esi_client,
             token=token,
             logger_tag=logger_tag,
+            etags=etags,
+            response_headers=response_headers,
+            max_workers=max_workers,
         )
 
     return response_objects
@@ -143,33 +258,178 @@ def _fetch_with_paging(
     esi_client: object = None,
     token: Token = None,
     logger_tag: str = None,
+    etags: dict = None,
+    response_headers: dict = None,
+    max_workers: int = None,
 ) -> dict:
-    """fetches esi objects incl. all pages if requested and returns them"""
-    response_object, pages = _fetch_with_retries(
+    """fetches esi objects incl. all pages if requested and returns them
+
+    Returns None if etags are given and none of the pages has been modified.
+    """
+    page_objects = _fetch_pages(
         esi_path=esi_path,
         args=args,
         has_pages=has_pages,
         esi_client=esi_client,
         token=token,
         logger_tag=logger_tag,
+        etags=etags,
+        response_headers=response_headers,
+        max_workers=max_workers,
     )
-    if has_pages:
-        for page in range(2, pages + 1):
-            response_object_page, _ = _fetch_with_retries(
-                esi_path=esi_path,
-                args=args,
-                has_pages=has_pages,
-                page=page,
-                pages=pages,
-                esi_client=esi_client,
-                token=token,
-                logger_tag=logger_tag,
-            )
-            response_object += response_object_page
+    if page_objects is None:
+        return None
+
+    if not has_pages:
+        return list(page_objects)[0]
+
+    response_object = []
+    for response_object_page in page_objects:
+        response_object += response_object_page
 
     return response_object
 
 
+def _fetch_pages(
+    esi_path: str,
+    args: dict,
+    has_pages: bool = False,
+    esi_client: object = None,
+    token: Token = None,
+    logger_tag: str = None,
+    etags: dict = None,
+    response_headers: dict = None,
+    max_workers: int = None,
+) -> Optional[Iterator[list]]:
+    """fetches esi objects page by page and returns an iterator over them
+
+    Pages after the first are fetched concurrently by up to max_workers threads,
+    and only one batch of pages is held in memory at any time.
+
+    When etags are given, pages are requested conditionally until the first
+    modified page is found. Returns None if none of the pages has been modified.
+    """
+    use_etags = etags is not None
+    previous_etags = dict(etags) if use_etags else {}
+    response_object, pages, headers = _fetch_with_retries(
+        esi_path=esi_path,
+        args=args,
+        has_pages=has_pages,
+        esi_client=esi_client,
+        token=token,
+        logger_tag=logger_tag,
+        etag=previous_etags.get("1"),
+        use_etag=use_etags,
+    )
+    if response_headers is not None:
+        response_headers.update(headers)
+    # not all 304 responses report the number of pages
+    pages = (pages or len(previous_etags) or 1) if has_pages else 1
+    workers = _max_workers_within_error_limit(headers, max_workers, logger_tag)
+
+    def fetch_page(page: int, conditional: bool = False) -> tuple:
+        # args already contains the access token from the first page,
+        # so the threads do not need to touch the token in the database
+        response_object_page, _, headers_page = _fetch_with_retries(
+            esi_path=esi_path,
+            args=dict(args),
+            has_pages=has_pages,
+            page=page,
+            pages=pages,
+            esi_client=esi_client,
+            logger_tag=logger_tag,
+            etag=previous_etags.get(str(page)) if conditional else None,
+            use_etag=use_etags,
+        )
+        return response_object_page, headers_page
+
+    def is_unchanged(page: int, headers_page: dict) -> bool:
+        # cached responses from django-esi come back as 200 with the old ETag
+        etag = _get_header(headers_page, "ETag")
+        return bool(etag) and etag == previous_etags.get(str(page))
+
+    # objects of pages that have already been fetched and need not be fetched again
+    fetched_pages = {}
+    if not use_etags or not is_unchanged(1, headers):
+        fetched_pages[1] = (response_object, headers)
+    elif len(previous_etags) == pages:
+        next_page = 2
+        while not fetched_pages and next_page <= pages:
+            batch = range(next_page, min(next_page + workers, pages + 1))
+            results = _map_pages(
+                lambda page: fetch_page(page, conditional=True), batch, workers
+            )
+            for page, result in zip(batch, results):
+                if not is_unchanged(page, result[1]):
+                    fetched_pages[page] = result
+            next_page += workers
+
+        if not fetched_pages:
+            return None
+
+    def iter_pages():
+        new_etags = {}
+        for first_page in range(1, pages + 1, workers):
+            batch = range(first_page, min(first_page + workers, pages + 1))
+            missing_pages = [page for page in batch if page not in fetched_pages]
+            for page, result in zip(
+                missing_pages, _map_pages(fetch_page, missing_pages, workers)
+            ):
+                fetched_pages[page] = result
+            for page in batch:
+                response_object_page, headers_page = fetched_pages.pop(page)
+                etag_page = _get_header(headers_page, "ETag")
+                if etag_page:
+                    new_etags[str(page)] = etag_page
+                yield response_object_page
+
+        if use_etags:
+            etags.clear()
+            etags.update(new_etags)
+
+    return iter_pages()
+
+
+def _max_workers_within_error_limit(
+    headers: dict, max_workers: int = None, logger_tag: str = None
+) -> int:
+    """returns the number of workers for fetching pages concurrently,
+    which falls back to 1 when the ESI error limit is close to the threshold
+    """
+    if max_workers is None:
+        max_workers = BLUEPRINTS_ESI_PAGE_WORKERS
+    limit = getattr(_page_workers, "max_workers", None)
+    if limit is not None:
+        max_workers = min(max_workers, limit)
+    try:
+        error_limit_remain = int(_get_header(headers, "X-Esi-Error-Limit-Remain"))
+    except (KeyError, TypeError, ValueError):
+        return max_workers
+
+    if max_workers > 1 and (
+        error_limit_remain - max_workers < BLUEPRINTS_ESI_ERROR_LIMIT_THRESHOLD
+    ):
+        add_prefix = _make_logger_prefix(logger_tag)
+        logger.warning(
+            add_prefix(
+                "ESI error limit is close to threshold. Fetching pages sequentially"
+            )
+        )
+        return 1
+
+    return max_workers
+
+
+def _map_pages(fetch_page, pages, max_workers: int) -> list:
+    """returns the results of fetch_page for all pages in order"""
+    pages = list(pages)
+    if max_workers > 1 and len(pages) > 1:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(pages))) as executor:
+            return list(executor.map(propagate_sync_metrics(fetch_page), pages))
+
+    return [fetch_page(page) for page in pages]
+
+
 def _esi_client() -> object:
     """returns the singular esi client used in this module"""
     global _my_esi_client
@@ -190,8 +450,10 @@ def _fetch_with_retries(
     esi_client: object = None,
     token: Token = None,
     logger_tag: str = None,
+    etag: str = None,
+    use_etag: bool = False,
 ) -> tuple:
-    """Returns response object and pages from ESI, retries on 502s"""
+    """Returns response object, pages and response headers from ESI, retries on 502s"""
 
     esi_category, esi_method_name, log_message_base = _prepare_esi_request(
         esi_path=esi_path,
@@ -202,15 +464,16 @@ def _fetch_with_retries(
         esi_client=esi_client,
         token=token,
     )
-    response_object, pages = _execute_esi_request(
+    return _execute_esi_request(
         esi_category=esi_category,
         esi_method_name=esi_method_name,
         args=args,
         has_pages=has_pages,
         logger_tag=logger_tag,
         log_message_base=log_message_base,
+        etag=etag,
+        use_etag=use_etag,
     )
-    return response_object, pages
 
 
 def _prepare_esi_request(
@@ -263,15 +526,22 @@ def _execute_esi_request(
     has_pages: bool,
     logger_tag: str,
     log_message_base: str,
+    etag: str = None,
+    use_etag: bool = False,
 ):
     """make request to ESI
 
-    returns request object and total number of pages to retrieve
+    returns request object, total number of pages to retrieve and response headers.
+    The request object is None if the response was not modified since the given ETag
     """
     add_prefix = _make_logger_prefix(logger_tag)
     logger.info(add_prefix(log_message_base))
     response_object = None
     pages = 0
+    headers = {}
+    request_args = dict(args)
+    if etag:
+        request_args["_request_options"] = {"headers": {"If-None-Match": etag}}
     for retry_count in range(ESI_MAX_RETRIES + 1):
         if retry_count > 0:
             logger.warn(
@@ -282,30 +552,46 @@ def _execute_esi_request(
                 )
             )
         try:
-            operation = getattr(esi_category, esi_method_name)(**args)
-            result_args = {"timeout": (5, 30)} if BLUEPRINTS_ESI_TIMEOUT_ENABLED else {}
-            if has_pages:
-                if hasattr(operation, "request_config"):
-                    operation.request_config.also_return_response = True
-                    response_object, response = operation.result(**result_args)
-                elif hasattr(operation, "also_return_response"):
-                    operation.also_return_response = True
-                    response_object, response = operation.result(**result_args)
+            with esi_request_slot():
+                operation = getattr(esi_category, esi_method_name)(**request_args)
+                result_args = (
+                    {"timeout": (5, 30)} if BLUEPRINTS_ESI_TIMEOUT_ENABLED else {}
+                )
+                if has_pages or use_etag:
+                    if hasattr(operation, "request_config"):
+                        operation.request_config.also_return_response = True
+                        response_object, response = operation.result(**result_args)
+                    elif hasattr(operation, "also_return_response"):
+                        operation.also_return_response = True
+                        response_object, response = operation.result(**result_args)
+                    else:
+                        logger.warning(
+                            "django-esi API is not fully compatible. "
+                            "Falling back to fetching first page only from ESI"
+                        )
+                        response_object = operation.result(**result_args)
+                        response = None
+
+                    headers = response.headers if response else {}
+                    record_esi_call(_response_size(response))
+                    if has_pages and _get_header(headers, "X-Pages"):
+                        pages = int(_get_header(headers, "X-Pages"))
+                    else:
+                        pages = 0
                 else:
-                    logger.warning(
-                        "django-esi API is not fully compatible. "
-                        "Falling back to fetching first page only from ESI"
-                    )
                     response_object = operation.result(**result_args)
-                    response = None
-
-                if response and "x-pages" in response.headers:
-                    pages = int(response.headers["x-pages"])
-                else:
+                    record_esi_call()
                     pages = 0
-            else:
-                response_object = operation.result(**result_args)
-                pages = 0
+            break
+
+        except HTTPNotModified as ex:
+            logger.info(add_prefix("{} - Not modified".format(log_message_base)))
+            record_esi_call()
+            headers = ex.response.headers if ex.response else {}
+            if not _get_header(headers, "ETag"):
+                headers = {**headers, "ETag": etag}
+            if has_pages and _get_header(headers, "X-Pages"):
+                pages = int(_get_header(headers, "X-Pages"))
             break
 
         except (HTTPBadGateway, HTTPGatewayTimeout, HTTPServiceUnavailable) as ex:
@@ -326,7 +612,22 @@ def _execute_esi_request(
             else:
                 raise ex
 
-    return response_object, pages
+    if headers:
+        update_esi_status_from_headers(headers)
+    return response_object, pages, headers
+
+
+def _response_size(response) -> int:
+    """returns the size of the body of a response in bytes"""
+    if not response:
+        return 0
+    try:
+        return len(response.raw_bytes)
+    except (AttributeError, TypeError):
+        try:
+            return int(response.headers.get("Content-Length", 0))
+        except (AttributeError, TypeError, ValueError):
+            return 0
 
 
 def _make_logger_prefix(tag: str = None):
@@ -0,0 +1,84 @@
+"""Collects metrics of a sync run, e.g. the number of ESI requests and DB queries
+
+Metrics are collected for the current thread and can be propagated
+to worker threads, e.g. when fetching pages from ESI concurrently.
+"""
+
+import threading
+from contextlib import contextmanager
+from functools import wraps
+from typing import Iterator, Optional
+
+from django.db import connection
+
+_local = threading.local()
+
+
+class SyncMetrics:
+    """Metrics collected during one sync run"""
+
+    def __init__(self) -> None:
+        self.esi_calls = 0
+        self.esi_bytes = 0
+        self.db_queries = 0
+        self._lock = threading.Lock()
+
+    def add_esi_call(self, num_bytes: int = 0):
+        with self._lock:
+            self.esi_calls += 1
+            self.esi_bytes += num_bytes
+
+    def __call__(self, execute, sql, params, many, context):
+        """counts DB queries when used as execute wrapper of a DB connection"""
+        self.db_queries += 1
+        return execute(sql, params, many, context)
+
+
+def current_sync_metrics() -> Optional[SyncMetrics]:
+    """returns the metrics collected for the current thread or None"""
+    return getattr(_local, "metrics", None)
+
+
+@contextmanager
+def collect_sync_metrics(metrics: SyncMetrics = None) -> Iterator[SyncMetrics]:
+    """collects metrics of the current thread within the context
+
+    Args:
+    - metrics: metrics to add to, new metrics if not given
+    """
+    if metrics is None:
+        metrics = SyncMetrics()
+    previous = current_sync_metrics()
+    _local.metrics = metrics
+    try:
+        with connection.execute_wrapper(metrics):
+            yield metrics
+    finally:
+        _local.metrics = previous
+
+
+def record_esi_call(num_bytes: int = 0):
+    """records an ESI request for the metrics of the current thread, if any"""
+    metrics = current_sync_metrics()
+    if metrics:
+        metrics.add_esi_call(num_bytes)
+
+
+def propagate_sync_metrics(func):
+    """returns func, which records to the metrics of the current thread
+    when called from another thread
+    """
+    metrics = current_sync_metrics()
+    if not metrics:
+        return func
+
+    @wraps(func)
+    def _wrapped(*args, **kwargs):
+        previous = current_sync_metrics()
+        _local.metrics = metrics
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _local.metrics = previous
+
+    return _wrapped
@@ -0,0 +1,211 @@
+import logging
+import multiprocessing
+from functools import partial
+from time import time
+from typing import List, NamedTuple, Optional
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from app_utils.logging import LoggerAddTag
+
+from ... import __title__
+from ...helpers.esi_fetch import limit_concurrent_esi_requests
+from ...models import Owner, OwnerSyncState
+
+logger = LoggerAddTag(logging.getLogger(__name__), __title__)
+
+DEFAULT_PROCESSES = 4
+DEFAULT_ESI_CONCURRENCY = 8
+
+
+class _OwnerSyncOutcome(NamedTuple):
+    """Outcome of syncing one owner"""
+
+    owner_pk: int
+    owner_name: str
+    duration: float
+    results: Optional[dict] = None
+    error: str = ""
+
+
+def _init_worker(esi_slots) -> None:
+    """initializes a worker process of the pool"""
+    # required when processes are spawned instead of forked
+    django.setup()
+    limit_concurrent_esi_requests(esi_slots)
+
+
+def _sync_owner(
+    owner_pk: int, sections: List[str] = None, force_update: bool = False
+) -> _OwnerSyncOutcome:
+    """syncs an owner and returns the outcome"""
+    started = time()
+    owner_name = f"Owner #{owner_pk}"
+    try:
+        owner = Owner.objects.get(pk=owner_pk)
+        owner_name = str(owner) or owner_name
+        # the command runs without workers, so nothing is left to background tasks
+        results = owner.sync_esi(
+            sections=sections, force_update=force_update, update_async=False
+        )
+    except Exception as ex:
+        logger.exception("%s: Failed to sync owner", owner_name)
+        return _OwnerSyncOutcome(
+            owner_pk=owner_pk,
+            owner_name=owner_name,
+            duration=time() - started,
+            error=f"{type(ex).__name__}: {ex}",
+        )
+    return _OwnerSyncOutcome(
+        owner_pk=owner_pk,
+        owner_name=owner_name,
+        duration=time() - started,
+        results={str(section): result for section, result in results.items()}
+        if results is not None
+        else None,
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        "Syncs all or selected owners directly from ESI with a pool of processes, "
+        "e.g. for a first import or on installations running syncs from cron"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "owner_pks",
+            nargs="*",
+            type=int,
+            help="primary keys of the owners to sync, all active owners if not given",
+        )
+        parser.add_argument(
+            "--section",
+            action="append",
+            dest="sections",
+            choices=OwnerSyncState.Section.values,
+            help="section to sync, can be given multiple times, all if not given",
+        )
+        parser.add_argument(
+            "--processes",
+            type=int,
+            default=DEFAULT_PROCESSES,
+            help="number of owners synced in parallel processes",
+        )
+        parser.add_argument(
+            "--esi-concurrency",
+            type=int,
+            default=DEFAULT_ESI_CONCURRENCY,
+            help="max number of concurrent ESI requests of all processes",
+        )
+        parser.add_argument(
+            "--force-update",
+            action="store_true",
+            help="update sections even if their ESI payload is unchanged",
+        )
+
+    def handle(self, *args, **options):
+        if options["processes"] < 1 or options["esi_concurrency"] < 1:
+            raise CommandError("processes and ESI concurrency must be at least 1")
+        owner_pks = self._owner_pks(options["owner_pks"])
+        if not owner_pks:
+            self.stdout.write("No owners to sync.")
+            return
+
+        self.stdout.write(
+            f"Syncing {len(owner_pks)} owners with {options['processes']} processes "
+            f"and up to {options['esi_concurrency']} concurrent ESI requests..."
+        )
+        started = time()
+        sync_owner = partial(
+            _sync_owner,
+            sections=options["sections"],
+            force_update=options["force_update"],
+        )
+        failed = 0
+        for outcome in self._run(
+            sync_owner, owner_pks, options["processes"], options["esi_concurrency"]
+        ):
+            if outcome.error:
+                failed += 1
+                self.stdout.write(
+                    self.style.ERROR(
+                        f"{outcome.owner_name}: failed after "
+                        f"{outcome.duration:.1f}s - {outcome.error}"
+                    )
+                )
+            else:
+                self.stdout.write(
+                    f"{outcome.owner_name}: synced in {outcome.duration:.1f}s - "
+                    + self._format_results(outcome.results)
+                )
+
+        duration = time() - started
+        if failed:
+            raise CommandError(
+                f"Failed to sync {failed} of {len(owner_pks)} owners "
+                f"in {duration:.1f}s."
+            )
+        self.stdout.write(
+            self.style.SUCCESS(f"Synced {len(owner_pks)} owners in {duration:.1f}s.")
+        )
+
+    @staticmethod
+    def _owner_pks(owner_pks: List[int]) -> List[int]:
+        """returns primary keys of all active owners or of the selected ones"""
+        if not owner_pks:
+            return list(
+                Owner.objects.filter(is_active=True)
+                .order_by("pk")
+                .values_list("pk", flat=True)
+            )
+        unknown_pks = set(owner_pks) - set(
+            Owner.objects.filter(pk__in=owner_pks).values_list("pk", flat=True)
+        )
+        if unknown_pks:
+            raise CommandError(
+                "Unknown owners: " + ", ".join(str(pk) for pk in sorted(unknown_pks))
+            )
+        return sorted(set(owner_pks))
+
+    @staticmethod
+    def _run(sync_owner, owner_pks: List[int], processes: int, esi_concurrency: int):
+        """syncs owners in a pool of processes and yields their outcomes
+        as soon as they are done
+        """
+        context = multiprocessing.get_context()
+        esi_slots = context.BoundedSemaphore(esi_concurrency)
+        if processes == 1:
+            limit_concurrent_esi_requests(esi_slots)
+            try:
+                yield from map(sync_owner, owner_pks)
+            finally:
+                limit_concurrent_esi_requests(None)
+            return
+
+        # forked processes must not share the connections of this process
+        connections.close_all()
+        with context.Pool(
+            processes=min(processes, len(owner_pks)),
+            initializer=_init_worker,
+            initargs=(esi_slots,),
+        ) as pool:
+            yield from pool.imap_unordered(sync_owner, owner_pks)
+
+    @staticmethod
+    def _format_results(results: Optional[dict]) -> str:
+        """returns row counts of synced sections as text"""
+        if results is None:
+            return "skipped, because it is already being synced"
+        texts = []
+        for section, result in results.items():
+            if result is None:
+                texts.append(f"{section}: not modified")
+            else:
+                texts.append(
+                    f"{section}: {result.created} created, {result.updated} updated, "
+                    f"{result.deleted} deleted, {result.unchanged} unchanged"
+                )
+        return "; ".join(texts) if texts else "nothing to sync"
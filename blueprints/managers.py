@@ -1,29 +1,225 @@
 import datetime as dt
-from typing import Tuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from time import time
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
 
-from bravado.exception import HTTPForbidden, HTTPUnauthorized
+from bravado.exception import HTTPForbidden, HTTPNotFound, HTTPUnauthorized
 
 from django.contrib.auth.models import User
-from django.db import models
+from django.core.cache import cache
+from django.db import models, transaction
 from django.db.models import Case, F, Q, Value, When
 from django.utils.timezone import now
+from esi.errors import TokenError
 from esi.models import Token
 from eveuniverse.models import EveEntity, EveSolarSystem, EveType
 
 from allianceauth.eveonline.models import EveAllianceInfo, EveCorporationInfo
 from allianceauth.services.hooks import get_extension_logger
+from app_utils.helpers import chunks
 from app_utils.logging import LoggerAddTag
 
 from . import __title__
-from .app_settings import BLUEPRINTS_LOCATION_STALE_HOURS
+from .app_settings import (
+    BLUEPRINTS_BULK_METHODS_BATCH_SIZE,
+    BLUEPRINTS_LOCATION_STALE_HOURS,
+    BLUEPRINTS_STRUCTURE_BATCH_SIZE,
+    BLUEPRINTS_STRUCTURE_DENIED_BASE_MINUTES,
+    BLUEPRINTS_STRUCTURE_DENIED_MAX_HOURS,
+    BLUEPRINTS_STRUCTURE_WORKERS,
+)
 from .constants import EVE_TYPE_ID_SOLAR_SYSTEM
-from .helpers import fetch_esi_status
+from .helpers import (
+    EsiStatusException,
+    reserve_esi_error_budget,
+    update_esi_status_from_headers,
+)
+from .helpers.esi_fetch import esi_request_slot
 from .providers import esi
 
 logger = LoggerAddTag(get_extension_logger(__name__), __title__)
 
 
-class BlueprintQuerySet(models.QuerySet):
+class SyncResult(NamedTuple):
+    """Counts of rows changed by a bulk sync"""
+
+    created: int = 0
+    updated: int = 0
+    deleted: int = 0
+    unchanged: int = 0
+
+
+class BulkSyncQuerySetMixin:
+    """Adds syncing rows with a fresh set of objects in bulk to a queryset"""
+
+    def bulk_sync(
+        self, objs: Iterable[models.Model], fields: List[str], batch_size: int = None
+    ) -> SyncResult:
+        """syncs all rows of this queryset with the given objects in bulk.
+
+        Objects are matched to existing rows by primary key.
+        New objects are created, changed rows are updated for the changed fields only
+        and rows without a matching object are deleted.
+        All changes are applied within one transaction.
+
+        Args:
+        - objs: unsaved model objects representing the new state
+        - fields: names of the fields to compare and update
+        - batch_size: max number of objects per query
+
+        Returns:
+        counts of created, updated, deleted and unchanged rows
+        """
+        if not batch_size:
+            batch_size = BLUEPRINTS_BULK_METHODS_BATCH_SIZE
+        existing = self.in_bulk()
+        objs_to_create, objs_to_update, changed_fields, unchanged = self._diff_objs(
+            objs, existing, fields
+        )
+        obsolete_pks = list(existing.keys())
+        with transaction.atomic():
+            # obsolete rows are deleted first, so they can not collide
+            # with unique constraints of new rows
+            for start in range(0, len(obsolete_pks), batch_size):
+                self.filter(pk__in=obsolete_pks[start : start + batch_size]).delete()
+            self._apply_diff(objs_to_create, objs_to_update, changed_fields, batch_size)
+
+        return SyncResult(
+            created=len(objs_to_create),
+            updated=len(objs_to_update),
+            deleted=len(obsolete_pks),
+            unchanged=unchanged,
+        )
+
+    def bulk_upsert(
+        self, objs: Iterable[models.Model], fields: List[str], batch_size: int = None
+    ) -> SyncResult:
+        """creates or updates rows of this queryset with the given objects in bulk.
+
+        Same as bulk_sync, except that rows without a matching object are kept.
+        Allows syncing a large set of objects in several chunks.
+
+        Args:
+        - objs: unsaved model objects representing the new state
+        - fields: names of the fields to compare and update
+        - batch_size: max number of objects per query
+
+        Returns:
+        counts of created, updated and unchanged rows
+        """
+        if not batch_size:
+            batch_size = BLUEPRINTS_BULK_METHODS_BATCH_SIZE
+        objs = list(objs)
+        existing = self.in_bulk([obj.pk for obj in objs])
+        objs_to_create, objs_to_update, changed_fields, unchanged = self._diff_objs(
+            objs, existing, fields
+        )
+        with transaction.atomic():
+            self._apply_diff(objs_to_create, objs_to_update, changed_fields, batch_size)
+
+        return SyncResult(
+            created=len(objs_to_create),
+            updated=len(objs_to_update),
+            unchanged=unchanged,
+        )
+
+    def delete_in_batches(self, batch_size: int = None) -> int:
+        """deletes all rows of this queryset in batches, each committed on its own.
+
+        Args:
+        - batch_size: max number of rows deleted per query
+
+        Returns:
+        count of deleted rows
+        """
+        if not batch_size:
+            batch_size = BLUEPRINTS_BULK_METHODS_BATCH_SIZE
+        pks = list(self.values_list("pk", flat=True))
+        deleted = 0
+        for start in range(0, len(pks), batch_size):
+            # rows are filtered again, in case they have changed in the meantime
+            deleted += (
+                self.filter(pk__in=pks[start : start + batch_size])
+                .delete()[1]
+                .get(self.model._meta.label, 0)
+            )
+        return deleted
+
+    def _diff_objs(
+        self, objs: Iterable[models.Model], existing: dict, fields: List[str]
+    ) -> Tuple[list, list, set, int]:
+        """compares objects with existing rows by primary key.
+
+        Matched rows are removed from existing,
+        so only rows without a matching object remain.
+
+        Returns:
+        objects to create, rows to update, changed fields and count of unchanged rows
+        """
+        attnames = {
+            field: self.model._meta.get_field(field).attname for field in fields
+        }
+        seen_pks = set()
+        objs_to_create = []
+        objs_to_update = []
+        changed_fields = set()
+        unchanged = 0
+        for obj in objs:
+            if obj.pk in seen_pks:
+                continue
+            seen_pks.add(obj.pk)
+            original = existing.pop(obj.pk, None)
+            if original is None:
+                objs_to_create.append(obj)
+                continue
+            has_changed = False
+            for field, attname in attnames.items():
+                value = getattr(obj, attname)
+                if getattr(original, attname) != value:
+                    setattr(original, attname, value)
+                    changed_fields.add(field)
+                    has_changed = True
+            if has_changed:
+                objs_to_update.append(original)
+            else:
+                unchanged += 1
+
+        return objs_to_create, objs_to_update, changed_fields, unchanged
+
+    def _apply_diff(
+        self,
+        objs_to_create: list,
+        objs_to_update: list,
+        changed_fields: set,
+        batch_size: int,
+    ):
+        if objs_to_create:
+            self.model.objects.bulk_create(objs_to_create, batch_size=batch_size)
+        if objs_to_update:
+            self.model.objects.bulk_update(
+                objs_to_update, fields=sorted(changed_fields), batch_size=batch_size
+            )
+
+
+class BlueprintQuerySet(BulkSyncQuerySetMixin, models.QuerySet):
+    def current(self) -> models.QuerySet:
+        """filters to blueprints of the generation currently published by their owner
+
+        Excludes new blueprints of a sync in progress
+        and blueprints not yet deleted since a previous sync.
+        """
+        return self.filter(
+            generation__lte=F("owner__blueprints_generation"),
+            last_generation__gte=F("owner__blueprints_generation"),
+        )
+
+    def retired(self) -> models.QuerySet:
+        """filters to blueprints no longer part of the generation
+        currently published by their owner
+        """
+        return self.filter(last_generation__lt=F("owner__blueprints_generation"))
+
     def annotate_is_bpo(self) -> models.QuerySet:
         return self.annotate(
             is_bpo=Case(
@@ -84,6 +280,7 @@ class BlueprintManager(models.Manager):
                 Q(owner__corporation__corporation_id__in=corporation_ids)
                 | Q(owner__pk__in=personal_owner_ids)
             )
+            .current()
             .select_related(
                 "eve_type",
                 "location",
@@ -109,6 +306,30 @@ class BlueprintManager(models.Manager):
         return blueprints_query
 
 
+class IndustryJobQuerySet(BulkSyncQuerySetMixin, models.QuerySet):
+    pass
+
+
+class IndustryJobManager(models.Manager):
+    def get_queryset(self) -> models.QuerySet:
+        return IndustryJobQuerySet(self.model, using=self._db)
+
+
+class OwnerSyncStateQuerySet(models.QuerySet):
+    def reset_failures(self) -> int:
+        """resets the failures of these sync states"""
+        from .models import Owner
+
+        return self.update(
+            last_error=Owner.ERROR_NONE, consecutive_failures=0, last_failure_at=None
+        )
+
+
+class OwnerSyncStateManager(models.Manager):
+    def get_queryset(self) -> models.QuerySet:
+        return OwnerSyncStateQuerySet(self.model, using=self._db)
+
+
 class LocationQuerySet(models.QuerySet):
     def annotate_name_plus(self) -> models.QuerySet:
         return self.annotate(
@@ -137,10 +358,27 @@ class LocationManager(models.Manager):
     """
 
     _UPDATE_EMPTY_GRACE_MINUTES = 5
+    _STRUCTURE_TOKEN_ATTEMPTS = 3
+    _STRUCTURE_SCOPES = ["esi-universe.read_structures.v1"]
 
     def get_queryset(self) -> models.QuerySet:
         return LocationQuerySet(self.model, using=self._db)
 
+    def outdated(self) -> models.QuerySet:
+        """returns locations due for an update from ESI,
+        because they are stale or still empty after the grace period
+        """
+        empty_threshold = now() - dt.timedelta(minutes=self._UPDATE_EMPTY_GRACE_MINUTES)
+        stale_threshold = now() - dt.timedelta(hours=BLUEPRINTS_LOCATION_STALE_HOURS)
+        return self.filter(
+            Q(updated_at__lt=stale_threshold)
+            | Q(
+                eve_type__isnull=True,
+                eve_solar_system__isnull=True,
+                updated_at__lt=empty_threshold,
+            )
+        )
+
     def get_or_create_esi(self, id: int, token: Token) -> Tuple[models.Model, bool]:
         """gets or creates location object with data fetched from ESI
 
@@ -180,6 +418,131 @@ class LocationManager(models.Manager):
 
         return location, created
 
+    def bulk_update_or_create_containers(
+        self, containers: Dict[int, Tuple[Optional[int], Optional[int]]]
+    ) -> SyncResult:
+        """creates or updates the locations of containers from assets in bulk
+
+        Args:
+        - containers: parent location ID and eve type ID by ID of each container
+
+        Returns counts of created and updated locations
+        """
+        existing_ids = set(
+            self.filter(id__in=containers.keys()).values_list("id", flat=True)
+        )
+        updated_at = now()
+        objs = [
+            self.model(
+                id=id,
+                parent_id=parent_id,
+                eve_type_id=eve_type_id,
+                updated_at=updated_at,
+            )
+            for id, (parent_id, eve_type_id) in containers.items()
+        ]
+        with transaction.atomic():
+            # parents can be new containers themselves, so all containers
+            # are created without parent first and linked afterwards
+            self.bulk_create(
+                [
+                    self.model(id=obj.id, eve_type_id=obj.eve_type_id)
+                    for obj in objs
+                    if obj.id not in existing_ids
+                ],
+                batch_size=BLUEPRINTS_BULK_METHODS_BATCH_SIZE,
+                ignore_conflicts=True,
+            )
+            self.bulk_update(
+                objs,
+                fields=["parent", "eve_type", "updated_at"],
+                batch_size=BLUEPRINTS_BULK_METHODS_BATCH_SIZE,
+            )
+        return SyncResult(
+            created=len(containers) - len(existing_ids), updated=len(existing_ids)
+        )
+
+    def bulk_get_or_create_esi(
+        self, ids: Iterable[int], token: Token
+    ) -> Dict[int, models.Model]:
+        """gets or creates location objects for many IDs at once
+        with data fetched from ESI synchronous
+
+        Same as bulk_get_or_create_esi_async(), except that structures
+        are updated from ESI right away, e.g. when there is no task queue.
+
+        Returns location objects by ID
+        """
+        return self._bulk_get_or_create_esi(ids=ids, token=token, update_async=False)
+
+    def bulk_get_or_create_esi_async(
+        self, ids: Iterable[int], token: Token
+    ) -> Dict[int, models.Model]:
+        """gets or creates location objects for many IDs at once
+        with data fetched from ESI asynchronous
+
+        The freshness of all locations is decided with one query,
+        missing locations are created in bulk
+        and each structure is queued for an update from ESI at most once.
+
+        Returns location objects by ID
+        """
+        return self._bulk_get_or_create_esi(ids=ids, token=token, update_async=True)
+
+    def _bulk_get_or_create_esi(
+        self, ids: Iterable[int], token: Token, update_async: bool = True
+    ) -> Dict[int, models.Model]:
+        ids = set(map(int, ids))
+        if not ids:
+            return {}
+
+        empty_threshold = now() - dt.timedelta(minutes=self._UPDATE_EMPTY_GRACE_MINUTES)
+        stale_threshold = now() - dt.timedelta(hours=BLUEPRINTS_LOCATION_STALE_HOURS)
+        locations = self.in_bulk(ids)
+        ids_to_update = {
+            id
+            for id, location in locations.items()
+            if location.updated_at < stale_threshold
+            or (
+                location.updated_at < empty_threshold
+                and location.eve_type_id is None
+                and location.eve_solar_system_id is None
+            )
+        }
+        missing_ids = ids.difference(locations.keys())
+        if missing_ids:
+            new_locations = [self.model(id=id) for id in missing_ids]
+            self.bulk_create(
+                new_locations,
+                batch_size=BLUEPRINTS_BULK_METHODS_BATCH_SIZE,
+                ignore_conflicts=True,
+            )
+            locations.update({obj.id: obj for obj in new_locations})
+            ids_to_update |= missing_ids
+
+        structure_ids = []
+        for id in sorted(ids_to_update):
+            if self.model.is_structure_id(id):
+                structure_ids.append(id)
+            elif self.model.is_solar_system_id(id) or self.model.is_station_id(id):
+                locations[id], _ = self._update_or_create_esi(
+                    id=id, token=token, update_async=True
+                )
+            elif id in missing_ids:
+                logger.warning(
+                    "%s: Creating empty location for ID not matching any known pattern",
+                    id,
+                )
+
+        if structure_ids:
+            if update_async:
+                self._structures_update_esi_async(ids=structure_ids, token=token)
+            else:
+                self.structures_update_or_create_esi(ids=structure_ids, token=token)
+                locations.update(self.in_bulk(structure_ids))
+
+        return locations
+
     def update_or_create_esi_async(
         self, id: int, token: Token
     ) -> Tuple[models.Model, bool]:
@@ -200,8 +563,12 @@ class LocationManager(models.Manager):
     ) -> Tuple[models.Model, bool]:
         id = int(id)
         if self.model.is_solar_system_id(id):
-            eve_solar_system, _ = EveSolarSystem.objects.get_or_create_esi(id=id)
-            eve_type, _ = EveType.objects.get_or_create_esi(id=EVE_TYPE_ID_SOLAR_SYSTEM)
+            with esi_request_slot():
+                eve_solar_system, _ = EveSolarSystem.objects.get_or_create_esi(id=id)
+            with esi_request_slot():
+                eve_type, _ = EveType.objects.get_or_create_esi(
+                    id=EVE_TYPE_ID_SOLAR_SYSTEM
+                )
             location, created = self.update_or_create(
                 id=id,
                 defaults={
@@ -212,9 +579,10 @@ class LocationManager(models.Manager):
             )
         elif self.model.is_station_id(id):
             logger.info("%s: Fetching station from ESI", id)
-            station = esi.client.Universe.get_universe_stations_station_id(
-                station_id=id
-            ).results()
+            with esi_request_slot():
+                station = esi.client.Universe.get_universe_stations_station_id(
+                    station_id=id
+                ).results()
             location, created = self._station_update_or_create_dict(
                 id=id, station=station
             )
@@ -240,19 +608,24 @@ class LocationManager(models.Manager):
         self, id: int, station: dict
     ) -> Tuple[models.Model, bool]:
         if station.get("system_id"):
-            eve_solar_system, _ = EveSolarSystem.objects.get_or_create_esi(
-                id=station.get("system_id")
-            )
+            with esi_request_slot():
+                eve_solar_system, _ = EveSolarSystem.objects.get_or_create_esi(
+                    id=station.get("system_id")
+                )
         else:
             eve_solar_system = None
 
         if station.get("type_id"):
-            eve_type, _ = EveType.objects.get_or_create_esi(id=station.get("type_id"))
+            with esi_request_slot():
+                eve_type, _ = EveType.objects.get_or_create_esi(
+                    id=station.get("type_id")
+                )
         else:
             eve_type = None
 
         if station.get("owner"):
-            owner, _ = EveEntity.objects.get_or_create_esi(id=station.get("owner"))
+            with esi_request_slot():
+                owner, _ = EveEntity.objects.get_or_create_esi(id=station.get("owner"))
         else:
             owner = None
 
@@ -267,56 +640,298 @@ class LocationManager(models.Manager):
         )
 
     def _structure_update_or_create_esi_async(self, id: int, token: Token):
-        from .tasks import DEFAULT_TASK_PRIORITY
-        from .tasks import update_structure_esi as task_update_structure_esi
-
         id = int(id)
         location, created = self.get_or_create(id=id)
-        task_update_structure_esi.apply_async(
-            kwargs={"id": id, "token_pk": token.pk},
-            priority=DEFAULT_TASK_PRIORITY,
-        )
+        self._structures_update_esi_async(ids=[id], token=token)
         return location, created
 
+    def _structures_update_esi_async(self, ids: Iterable[int], token: Token):
+        """queues updates from ESI for existing structures in batches"""
+        from .tasks import DEFAULT_TASK_PRIORITY
+        from .tasks import update_structures_esi as task_update_structures_esi
+
+        for chunk in chunks(sorted(map(int, ids)), BLUEPRINTS_STRUCTURE_BATCH_SIZE):
+            task_update_structures_esi.apply_async(
+                kwargs={"ids": chunk, "token_pk": token.pk},
+                priority=DEFAULT_TASK_PRIORITY,
+            )
+
     def structure_update_or_create_esi(self, id: int, token: Token):
-        """Update or creates structure from ESI"""
-        fetch_esi_status().raise_for_status()
+        """Update or creates structure from ESI
+
+        Tokens known to be denied access to the structure are skipped
+        and the tokens of other owners are tried instead.
+        """
+        id = int(id)
+        structures = dict()
+        self._fetch_structures_esi(ids=[id], token=token, structures=structures)
+        if id in structures:
+            return self._structure_update_or_create_dict(
+                id=id, structure=structures[id]
+            )
+
+        return self.get_or_create(id=id)
+
+    def structures_update_or_create_esi(
+        self, ids: Iterable[int], token: Token
+    ) -> SyncResult:
+        """Updates or creates many structures from ESI at once
+
+        Structures are fetched concurrently, their solar systems, types and owners
+        are resolved in bulk and all locations are written in one transaction.
+        Structures no token has access to are created empty.
+
+        Returns counts of created and updated locations
+        """
+        ids = set(map(int, ids))
+        structures = dict()
         try:
-            structure = esi.client.Universe.get_universe_structures_structure_id(
-                structure_id=id, token=token.valid_access_token()
-            ).results()
-        except (HTTPUnauthorized, HTTPForbidden) as http_error:
-            logger.warn(
-                "%s: No access to structure #%s: %s",
-                token.character_name,
-                id,
-                http_error,
+            self._fetch_structures_esi(ids=ids, token=token, structures=structures)
+        except EsiStatusException:
+            # keep the structures fetched before ESI became unavailable
+            self._bulk_update_or_create_structures(structures=structures)
+            raise
+
+        return self._bulk_update_or_create_structures(
+            structures=structures, empty_ids=ids.difference(structures.keys())
+        )
+
+    def _fetch_structures_esi(
+        self, ids: Iterable[int], token: Token, structures: dict
+    ) -> None:
+        """fetches structures from ESI concurrently into the given dict
+
+        Structures the given token is denied access to
+        are fetched with the tokens of other owners.
+        Tokens of other owners are only used while their access token is valid,
+        so they are not refreshed just to try them.
+        """
+        remaining_ids = sorted(set(ids))
+        attempts = 0
+        for candidate in self._structure_tokens(token):
+            ids_to_fetch = [
+                id
+                for id in remaining_ids
+                if not self.is_structure_access_denied(id, candidate.character_id)
+            ]
+            if not ids_to_fetch:
+                continue
+
+            if candidate is token:
+                try:
+                    access_token = candidate.valid_access_token()
+                except TokenError as ex:
+                    logger.warning(
+                        "%s: Can not use token to fetch structures: %s",
+                        candidate.character_name,
+                        ex,
+                    )
+                    continue
+            elif candidate.expired:
+                continue
+            else:
+                access_token = candidate.access_token
+
+            attempts += 1
+            fetch_structure = partial(
+                self._fetch_structure_esi, token=candidate, access_token=access_token
             )
-            location, created = self.get_or_create(id=id)
-        else:
-            location, created = self._structure_update_or_create_dict(
-                id=id, structure=structure
+            max_workers = min(BLUEPRINTS_STRUCTURE_WORKERS, len(ids_to_fetch))
+            denied_ids = set()
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                for id, (structure, is_denied) in zip(
+                    ids_to_fetch, executor.map(fetch_structure, ids_to_fetch)
+                ):
+                    if structure is not None:
+                        structures[id] = structure
+                    elif is_denied:
+                        denied_ids.add(id)
+
+            # structures not found do not exist for any other token either
+            fetched_ids = set(ids_to_fetch)
+            remaining_ids = [
+                id
+                for id in remaining_ids
+                if id in denied_ids or (id not in fetched_ids and id not in structures)
+            ]
+            if not remaining_ids or attempts >= self._STRUCTURE_TOKEN_ATTEMPTS:
+                break
+
+    def _structure_tokens(self, token: Token) -> Iterable[Token]:
+        """yields the given token followed by the tokens of other owners
+        for fetching structures
+        """
+        from .models import Owner
+
+        yield token
+        character_ids = (
+            Owner.objects.filter(is_active=True, character__isnull=False)
+            .exclude(character__character__character_id=token.character_id)
+            .values_list("character__character__character_id", flat=True)
+            .distinct()
+        )
+        tried_character_ids = {token.character_id}
+        for other_token in Token.objects.filter(
+            character_id__in=list(character_ids)
+        ).require_scopes(self._STRUCTURE_SCOPES):
+            if other_token.character_id not in tried_character_ids:
+                tried_character_ids.add(other_token.character_id)
+                yield other_token
+
+    def _fetch_structure_esi(
+        self, id: int, token: Token, access_token: str
+    ) -> Tuple[Optional[dict], bool]:
+        """fetches a structure from ESI with a token
+
+        Is thread safe as it does not query the database.
+        Returns the structure or None if the token has no access to it
+        or it does not exist and whether access was denied
+        """
+        with reserve_esi_error_budget(), esi_request_slot():
+            try:
+                operation = esi.client.Universe.get_universe_structures_structure_id(
+                    structure_id=id, token=access_token
+                )
+                operation.request_config.also_return_response = True
+                structure, response = operation.results()
+            except (HTTPUnauthorized, HTTPForbidden) as http_error:
+                if http_error.response is not None:
+                    update_esi_status_from_headers(http_error.response.headers)
+                logger.warn(
+                    "%s: No access to structure #%s: %s",
+                    token.character_name,
+                    id,
+                    http_error,
+                )
+                self._record_structure_access_denied(id, token.character_id)
+                return None, True
+            except HTTPNotFound as http_error:
+                logger.warning("Structure #%s not found: %s", id, http_error)
+                return None, False
+
+        update_esi_status_from_headers(response.headers)
+        cache.delete(self._structure_denied_cache_key(id, token.character_id))
+        return structure, False
+
+    def _bulk_update_or_create_structures(
+        self, structures: Dict[int, dict], empty_ids: Iterable[int] = None
+    ) -> SyncResult:
+        """writes structures and empty locations to the database in one transaction"""
+        from .resolvers import EveTypeResolver
+
+        solar_system_ids = {
+            obj["solar_system_id"]
+            for obj in structures.values()
+            if obj.get("solar_system_id")
+        }
+        eve_solar_systems = {}
+        if solar_system_ids:
+            with esi_request_slot():
+                eve_solar_systems = EveSolarSystem.objects.bulk_get_or_create_esi(
+                    ids=solar_system_ids
+                ).in_bulk()
+        eve_type_resolver = EveTypeResolver()
+        eve_type_resolver.resolve(
+            obj["type_id"] for obj in structures.values() if obj.get("type_id")
+        )
+        owner_ids = {
+            obj["owner_id"] for obj in structures.values() if obj.get("owner_id")
+        }
+        if owner_ids:
+            with esi_request_slot():
+                EveEntity.objects.bulk_create_esi(owner_ids)
+        owners = EveEntity.objects.in_bulk(owner_ids)
+
+        updated_at = now()
+        locations = [
+            self.model(
+                id=id,
+                name=obj.get("name", ""),
+                eve_solar_system=eve_solar_systems.get(obj.get("solar_system_id")),
+                eve_type=(
+                    eve_type_resolver.get(obj["type_id"])
+                    if obj.get("type_id")
+                    else None
+                ),
+                owner=owners.get(obj.get("owner_id")),
+                updated_at=updated_at,
             )
-        return location, created
+            for id, obj in structures.items()
+        ]
+        empty_ids = set(empty_ids or [])
+        with transaction.atomic():
+            existing_ids = set(
+                self.filter(id__in=empty_ids.union(structures.keys())).values_list(
+                    "id", flat=True
+                )
+            )
+            new_locations = [obj for obj in locations if obj.id not in existing_ids]
+            new_locations += [
+                self.model(id=id) for id in empty_ids.difference(existing_ids)
+            ]
+            self.bulk_create(
+                new_locations,
+                batch_size=BLUEPRINTS_BULK_METHODS_BATCH_SIZE,
+                ignore_conflicts=True,
+            )
+            existing_locations = [obj for obj in locations if obj.id in existing_ids]
+            self.bulk_update(
+                existing_locations,
+                fields=["name", "eve_solar_system", "eve_type", "owner", "updated_at"],
+                batch_size=BLUEPRINTS_BULK_METHODS_BATCH_SIZE,
+            )
+
+        return SyncResult(created=len(new_locations), updated=len(existing_locations))
+
+    def is_structure_access_denied(self, id: int, character_id: int) -> bool:
+        """returns True if the character was recently denied access to a structure"""
+        denial = cache.get(self._structure_denied_cache_key(id, character_id))
+        return bool(denial and denial[1] > time())
+
+    def _record_structure_access_denied(self, id: int, character_id: int):
+        """remembers that a character has no access to a structure.
+
+        The time until the next attempt doubles with every further denial.
+        """
+        key = self._structure_denied_cache_key(id, character_id)
+        denial = cache.get(key)
+        denials = denial[0] + 1 if denial else 1
+        duration = min(
+            BLUEPRINTS_STRUCTURE_DENIED_BASE_MINUTES * 60 * 2 ** (denials - 1),
+            BLUEPRINTS_STRUCTURE_DENIED_MAX_HOURS * 3600,
+        )
+        # kept longer than the denial to remember the count for the next one
+        cache.set(key, (denials, time() + duration), timeout=int(duration * 2))
+
+    @staticmethod
+    def _structure_denied_cache_key(id: int, character_id: int) -> str:
+        return f"BLUEPRINTS_STRUCTURE_DENIED_{id}_{character_id}"
 
     def _structure_update_or_create_dict(
         self, id: int, structure: dict
     ) -> Tuple[models.Model, bool]:
         """creates a new Location object from a structure dict"""
         if structure.get("solar_system_id"):
-            eve_solar_system, _ = EveSolarSystem.objects.get_or_create_esi(
-                id=structure.get("solar_system_id")
-            )
+            with esi_request_slot():
+                eve_solar_system, _ = EveSolarSystem.objects.get_or_create_esi(
+                    id=structure.get("solar_system_id")
+                )
         else:
             eve_solar_system = None
 
         if structure.get("type_id"):
-            eve_type, _ = EveType.objects.get_or_create_esi(id=structure.get("type_id"))
+            with esi_request_slot():
+                eve_type, _ = EveType.objects.get_or_create_esi(
+                    id=structure.get("type_id")
+                )
         else:
             eve_type = None
 
         if structure.get("owner_id"):
-            owner, _ = EveEntity.objects.get_or_create_esi(id=structure.get("owner_id"))
+            with esi_request_slot():
+                owner, _ = EveEntity.objects.get_or_create_esi(
+                    id=structure.get("owner_id")
+                )
         else:
             owner = None
 
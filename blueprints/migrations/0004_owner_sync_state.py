@@ -0,0 +1,66 @@
+# Generated by Django 3.1.14 on 2026-10-18 14:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("blueprints", "0003_query_optimizations"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="OwnerSyncState",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "section",
+                    models.CharField(
+                        choices=[
+                            ("blueprints", "Blueprints"),
+                            ("industry_jobs", "Industry Jobs"),
+                            ("locations", "Locations"),
+                        ],
+                        max_length=16,
+                    ),
+                ),
+                (
+                    "content_hash",
+                    models.CharField(
+                        blank=True,
+                        default="",
+                        help_text="Hash of the ESI payload from the last completed sync",
+                        max_length=32,
+                    ),
+                ),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "owner",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="sync_states",
+                        to="blueprints.owner",
+                    ),
+                ),
+            ],
+            options={
+                "default_permissions": (),
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="ownersyncstate",
+            constraint=models.UniqueConstraint(
+                fields=("owner", "section"), name="functional_pk_ownersyncstate"
+            ),
+        ),
+    ]
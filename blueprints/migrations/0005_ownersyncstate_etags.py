@@ -0,0 +1,22 @@
+# Generated by Django 3.1.14 on 2026-10-18 14:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("blueprints", "0004_owner_sync_state"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="ownersyncstate",
+            name="etags",
+            field=models.JSONField(
+                blank=True,
+                default=dict,
+                help_text="ETags by page of the ESI responses from the last completed sync",
+            ),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.1.14 on 2026-10-18 14:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("blueprints", "0005_ownersyncstate_etags"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="ownersyncstate",
+            name="expires_at",
+            field=models.DateTimeField(
+                blank=True,
+                default=None,
+                help_text="When the ESI cache for this section expires after the last sync",
+                null=True,
+            ),
+        ),
+    ]
@@ -0,0 +1,93 @@
+# Generated by Django 3.1.14 on 2026-10-18 14:53
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("blueprints", "0006_ownersyncstate_expires_at"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SyncRun",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "section",
+                    models.CharField(
+                        choices=[
+                            ("blueprints", "Blueprints"),
+                            ("industry_jobs", "Industry Jobs"),
+                            ("locations", "Locations"),
+                        ],
+                        db_index=True,
+                        max_length=16,
+                    ),
+                ),
+                ("started_at", models.DateTimeField(db_index=True)),
+                (
+                    "duration",
+                    models.FloatField(help_text="Wall time of the sync in seconds"),
+                ),
+                (
+                    "esi_calls",
+                    models.PositiveIntegerField(
+                        default=0, help_text="Number of requests to ESI"
+                    ),
+                ),
+                (
+                    "esi_bytes",
+                    models.PositiveBigIntegerField(
+                        default=0, help_text="Total size of the ESI responses in bytes"
+                    ),
+                ),
+                (
+                    "db_queries",
+                    models.PositiveIntegerField(
+                        default=0, help_text="Number of database queries"
+                    ),
+                ),
+                ("rows_created", models.PositiveIntegerField(default=0)),
+                ("rows_updated", models.PositiveIntegerField(default=0)),
+                ("rows_deleted", models.PositiveIntegerField(default=0)),
+                (
+                    "error",
+                    models.PositiveSmallIntegerField(
+                        choices=[
+                            (0, "No error"),
+                            (1, "Invalid token"),
+                            (2, "Expired token"),
+                            (3, "Insufficient permissions"),
+                            (4, "No character set for fetching data from ESI"),
+                            (5, "ESI API is currently unavailable"),
+                            (6, "Operaton mode does not match with current setting"),
+                            (99, "Unknown error"),
+                        ],
+                        default=0,
+                    ),
+                ),
+                (
+                    "owner",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="sync_runs",
+                        to="blueprints.owner",
+                    ),
+                ),
+            ],
+            options={
+                "default_permissions": (),
+            },
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 3.1.14 on 2026-10-18 14:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("blueprints", "0007_sync_run"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="owner",
+            name="consecutive_failures",
+            field=models.PositiveIntegerField(
+                default=0,
+                help_text="number of syncs that failed in a row since the last successful sync",
+            ),
+        ),
+        migrations.AddField(
+            model_name="owner",
+            name="last_error",
+            field=models.PositiveSmallIntegerField(
+                choices=[
+                    (0, "No error"),
+                    (1, "Invalid token"),
+                    (2, "Expired token"),
+                    (3, "Insufficient permissions"),
+                    (4, "No character set for fetching data from ESI"),
+                    (5, "ESI API is currently unavailable"),
+                    (6, "Operaton mode does not match with current setting"),
+                    (99, "Unknown error"),
+                ],
+                default=0,
+                help_text="error of the last failed sync",
+            ),
+        ),
+        migrations.AddField(
+            model_name="owner",
+            name="last_failure_at",
+            field=models.DateTimeField(
+                blank=True,
+                default=None,
+                help_text="when the last sync failed",
+                null=True,
+            ),
+        ),
+    ]
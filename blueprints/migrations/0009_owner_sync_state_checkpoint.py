@@ -0,0 +1,22 @@
+# Generated by Django 3.1.14 on 2026-10-18 15:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("blueprints", "0008_owner_sync_failures"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="ownersyncstate",
+            name="checkpoint",
+            field=models.JSONField(
+                blank=True,
+                default=dict,
+                help_text="Progress of an interrupted sync, which the next sync resumes from",
+            ),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 3.1.14 on 2026-10-18 15:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("blueprints", "0009_owner_sync_state_checkpoint"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="blueprint",
+            name="generation",
+            field=models.PositiveIntegerField(
+                default=0,
+                editable=False,
+                help_text="Generation of the owner's blueprints this blueprint was added in",
+            ),
+        ),
+        migrations.AddField(
+            model_name="blueprint",
+            name="last_generation",
+            field=models.PositiveIntegerField(
+                db_index=True,
+                default=0,
+                editable=False,
+                help_text="Latest generation of the owner's blueprints containing this blueprint",
+            ),
+        ),
+        migrations.AddField(
+            model_name="owner",
+            name="blueprints_generation",
+            field=models.PositiveIntegerField(
+                default=0,
+                editable=False,
+                help_text="generation of blueprints currently published for this owner",
+            ),
+        ),
+    ]
@@ -1,9 +1,14 @@
-from typing import Tuple
+import datetime as dt
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
 
 from django.contrib.auth.models import User
-from django.db import models
+from django.core.cache import cache
+from django.db import models, transaction
+from django.db.models import F
+from django.utils.timezone import now
 from django.utils.translation import gettext_lazy as _
-from esi.errors import TokenExpiredError, TokenInvalidError
+from esi.errors import TokenError, TokenExpiredError, TokenInvalidError
 from esi.models import Token
 from eveuniverse.models import EveEntity, EveSolarSystem, EveType
 
@@ -11,13 +16,36 @@ from allianceauth.authentication.models import CharacterOwnership
 from allianceauth.eveonline.evelinks import dotlan
 from allianceauth.eveonline.models import EveCharacter, EveCorporationInfo
 from allianceauth.services.hooks import get_extension_logger
+from app_utils.helpers import chunks
 from app_utils.logging import LoggerAddTag, make_logger_prefix
 
 from . import __title__
+from .app_settings import (
+    BLUEPRINTS_BULK_METHODS_BATCH_SIZE,
+    BLUEPRINTS_OWNER_BACKOFF_BASE_MINUTES,
+    BLUEPRINTS_OWNER_BACKOFF_MAX_HOURS,
+    BLUEPRINTS_SYNC_CHUNK_SIZE,
+    BLUEPRINTS_TASKS_TIME_LIMIT,
+)
 from .constants import EVE_LOCATION_FLAGS
-from .decorators import fetch_token_for_owner
-from .managers import BlueprintManager, LocationManager, RequestManager
+from .decorators import (
+    fetch_token_for_owner,
+    record_failed_sync_runs,
+    record_sync_run,
+    with_token_context,
+)
+from .helpers import hash_index, hash_payload, parse_expires
+from .helpers.esi_fetch import esi_fetch, esi_fetch_pages
+from .managers import (
+    BlueprintManager,
+    IndustryJobManager,
+    LocationManager,
+    OwnerSyncStateManager,
+    RequestManager,
+    SyncResult,
+)
 from .providers import esi
+from .resolvers import EveCharacterResolver, EveTypeResolver, LocationResolver
 from .validators import validate_material_efficiency, validate_time_efficiency
 
 NAMES_MAX_LENGTH = 100
@@ -25,6 +53,25 @@ NAMES_MAX_LENGTH = 100
 logger = LoggerAddTag(get_extension_logger(__name__), __title__)
 
 
+class _AssetEntry(NamedTuple):
+    """Compact entry of an asset from ESI as needed for syncing locations"""
+
+    location_id: int
+    type_id: int
+
+
+class _BlueprintEntry(NamedTuple):
+    """Compact entry of a blueprint from ESI as needed for syncing blueprints"""
+
+    location_id: int
+    location_flag: str
+    type_id: int
+    runs: Optional[int]
+    material_efficiency: int
+    time_efficiency: int
+    quantity: int
+
+
 class General(models.Model):
     """Meta model for app permissions"""
 
@@ -91,6 +138,15 @@ class Owner(models.Model):
         default=True,
         help_text=("whether this owner is currently included in the sync process"),
     )
+    blueprints_generation = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        help_text="generation of blueprints currently published for this owner",
+    )
+
+    # tokens and permission checks memoized within token_context()
+    _token_context = None
+    _permissions = None
 
     class Meta:
         default_permissions = ()
@@ -98,6 +154,36 @@ class Owner(models.Model):
     def __str__(self):
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        obj = super().from_db(db, field_names, values)
+        obj._loaded_character_id = obj.__dict__.get("character_id")
+        return obj
+
+    def save(self, *args, **kwargs):
+        character_changed = (
+            hasattr(self, "_loaded_character_id")
+            and self.character_id != self._loaded_character_id
+        )
+        super().save(*args, **kwargs)
+        self._loaded_character_id = self.character_id
+        # a new character might be able to sync this owner again
+        if character_changed:
+            self.reset_sync_failures()
+
+    def record_sync_failure(self, sections: Iterable[str], error: int):
+        """records a failed sync of the given sections,
+        which delays their next scheduled syncs
+        """
+        for section in sections:
+            self.sync_state(section).record_failure(error)
+
+    def reset_sync_failures(self):
+        """resets the failures of all sections of this owner"""
+        OwnerSyncState.objects.filter(
+            owner=self, consecutive_failures__gt=0
+        ).reset_failures()
+
     @property
     def name(self) -> str:
         try:
@@ -108,245 +194,729 @@ class Owner(models.Model):
         except AttributeError:
             return ""
 
-    def update_locations_esi(self):
+    def esi_scopes(self) -> List[str]:
+        """returns the ESI scopes needed to sync all sections of this owner"""
         if self.corporation:
-            assets = self._fetch_corporate_assets()
-            token = self.token(
-                [
-                    "esi-universe.read_structures.v1",
-                    "esi-assets.read_corporation_assets.v1",
-                ]
-            )[0]
-        else:
-            assets = self._fetch_personal_assets()
-            token = self.token(
-                ["esi-universe.read_structures.v1", "esi-assets.read_assets.v1"]
-            )[0]
-
-        asset_ids = []
-        asset_locations = {}
-        assets_by_id = {}
-        for asset in assets:
-            asset_ids.append(asset["item_id"])
-            assets_by_id[asset["item_id"]] = asset
-        for asset in assets:
-            if asset["location_id"] in asset_ids:
-                location_id = asset["location_id"]
-                if asset_locations.get(location_id):
-                    asset_locations[location_id].append(asset["item_id"])
-                else:
-                    asset_locations[location_id] = [asset["item_id"]]
-        for location in list(asset_locations.keys()):
-            if not Location.objects.filter(id=location).count() > 0:
-                parent_location = assets_by_id[location]["location_id"]
-                Location.objects.create(
-                    id=location,
-                    parent=self._fetch_location(parent_location, token=token),
-                    eve_type=EveType.objects.filter(
-                        id=assets_by_id[location]["type_id"]
-                    ).first(),
+            return [
+                "esi-universe.read_structures.v1",
+                "esi-corporations.read_blueprints.v1",
+                "esi-assets.read_corporation_assets.v1",
+                "esi-industry.read_corporation_jobs.v1",
+            ]
+        return [
+            "esi-universe.read_structures.v1",
+            "esi-characters.read_blueprints.v1",
+            "esi-assets.read_assets.v1",
+            "esi-industry.read_character_jobs.v1",
+        ]
+
+    @with_token_context
+    def sync_esi(
+        self,
+        sections: Iterable[str] = None,
+        force_update: bool = False,
+        update_async: bool = True,
+    ) -> dict:
+        """syncs sections of this owner from ESI in one run
+
+        The token is resolved once and locations and types are shared
+        between all stages. Blueprints are synced before industry jobs
+        and are included when they have never been synced for this owner,
+        so jobs can be matched with their blueprints.
+
+        Only one sync of an owner runs at a time,
+        so concurrent syncs do not discard each other's staged rows.
+
+        Args:
+        - sections: sections to sync, all sections if not given
+        - force_update: update sections even if their payload is unchanged
+        - update_async: whether structures and retired blueprints are updated
+          by background tasks or within this sync
+
+        Returns the results of the synced sections
+        or None if another sync of this owner is running
+        """
+        if not self.is_active:
+            return {}
+
+        with self.sync_lock() as is_locked:
+            if not is_locked:
+                logger.info("%s: Skipping sync, because it is already running", self)
+                return None
+            return self._sync_sections(
+                sections=sections,
+                force_update=force_update,
+                update_async=update_async,
+            )
+
+    @contextmanager
+    def sync_lock(self) -> Iterator[bool]:
+        """locks syncing this owner across all workers for the duration of the context
+
+        Yields True if the lock was acquired or False if it is held by another sync
+        """
+        key = f"BLUEPRINTS_OWNER_SYNC_LOCK_{self.pk}"
+        is_locked = cache.add(key, True, timeout=BLUEPRINTS_TASKS_TIME_LIMIT)
+        try:
+            yield is_locked
+        finally:
+            if is_locked:
+                cache.delete(key)
+
+    def _sync_sections(
+        self, sections: Optional[Iterable[str]], force_update: bool, update_async: bool
+    ) -> dict:
+        """syncs sections of this owner from ESI, see sync_esi()"""
+        sections = set(sections) if sections else set(OwnerSyncState.Section.values)
+        if (
+            OwnerSyncState.Section.INDUSTRY_JOBS in sections
+            and not self.sync_states.filter(
+                section=OwnerSyncState.Section.BLUEPRINTS
+            ).exists()
+        ):
+            sections.add(OwnerSyncState.Section.BLUEPRINTS)
+
+        try:
+            token = self.sync_token()
+        except TokenError:
+            record_failed_sync_runs(
+                self,
+                sections=sorted(sections),
+                error=self.token(self.esi_scopes())[1] or self.ERROR_TOKEN_INVALID,
+            )
+            raise
+
+        location_resolver = LocationResolver(token, update_async=update_async)
+        eve_type_resolver = EveTypeResolver()
+        results = dict()
+        if OwnerSyncState.Section.BLUEPRINTS in sections:
+            results[OwnerSyncState.Section.BLUEPRINTS] = self.update_blueprints_esi(
+                token=token,
+                location_resolver=location_resolver,
+                eve_type_resolver=eve_type_resolver,
+                force_update=force_update,
+                update_async=update_async,
+            )
+        if OwnerSyncState.Section.INDUSTRY_JOBS in sections:
+            results[
+                OwnerSyncState.Section.INDUSTRY_JOBS
+            ] = self.update_industry_jobs_esi(
+                token=token,
+                location_resolver=location_resolver,
+                force_update=force_update,
+            )
+        if OwnerSyncState.Section.LOCATIONS in sections:
+            results[OwnerSyncState.Section.LOCATIONS] = self.update_locations_esi(
+                token=token,
+                location_resolver=location_resolver,
+                eve_type_resolver=eve_type_resolver,
+                force_update=force_update,
+            )
+        return results
+
+    @with_token_context
+    def update_outdated_locations_esi(self) -> int:
+        """updates stale and empty locations of this owner from ESI
+
+        Syncs with an unchanged payload do not look at locations,
+        so the locations of blueprints, industry jobs and their containers
+        are refreshed separately.
+
+        Returns the number of outdated locations
+        """
+        if not self.is_active:
+            return 0
+
+        location_ids = set(
+            Blueprint.objects.filter(owner=self)
+            .current()
+            .values_list("location_id", flat=True)
+        )
+        location_ids |= set(self.jobs.values_list("location_id", flat=True))
+        parent_ids = location_ids
+        while parent_ids:
+            parent_ids = (
+                set(
+                    Location.objects.filter(
+                        id__in=parent_ids, parent__isnull=False
+                    ).values_list("parent_id", flat=True)
                 )
-            else:
-                parent_location = assets_by_id[location]["location_id"]
-                location_obj = Location.objects.filter(id=location).first()
-                location_obj.parent = self._fetch_location(parent_location, token=token)
-                location_obj.save()
+                - location_ids
+            )
+            location_ids |= parent_ids
 
-    def update_blueprints_esi(self):
-        """updates all blueprints from ESI"""
+        outdated_ids = list(
+            Location.objects.outdated()
+            .filter(id__in=location_ids)
+            .values_list("id", flat=True)
+        )
+        if outdated_ids:
+            logger.info("%s: Updating %d outdated locations", self, len(outdated_ids))
+            Location.objects.bulk_get_or_create_esi_async(
+                ids=outdated_ids, token=self.sync_token()
+            )
+        return len(outdated_ids)
+
+    @with_token_context
+    @record_sync_run("locations")
+    def update_locations_esi(
+        self,
+        token: Token = None,
+        location_resolver: LocationResolver = None,
+        eve_type_resolver: EveTypeResolver = None,
+        force_update: bool = False,
+    ):
+        """updates the locations of all containers from ESI
+
+        Args:
+        - token: token already resolved for this owner with all sync scopes,
+          will be resolved once for all fetches of this sync if not given
+        - location_resolver: resolver to share locations with other syncs of this run
+        - eve_type_resolver: resolver to share types with other syncs of this run
+        - force_update: update locations even if the assets are unchanged
+
+        Returns counts of created and updated containers or None if unchanged
+        """
+        if token is None:
+            token = self.sync_token()
 
-        if self.is_active:
-            blueprint_ids_to_remove = list(
-                Blueprint.objects.filter(owner=self).values_list("item_id", flat=True)
+        add_prefix = self._logger_prefix()
+        sync_state = self.sync_state(OwnerSyncState.Section.LOCATIONS)
+        etags = {} if force_update else dict(sync_state.etags)
+        response_headers = {}
+        if self.corporation:
+            asset_pages = self._fetch_corporate_assets(
+                token=token, etags=etags, response_headers=response_headers
+            )
+        else:
+            asset_pages = self._fetch_personal_assets(
+                token=token, etags=etags, response_headers=response_headers
             )
-            if self.corporation:
-                blueprints = self._fetch_corporate_blueprints()
-                token = self.token(
-                    [
-                        "esi-universe.read_structures.v1",
-                        "esi-corporations.read_blueprints.v1",
-                    ]
-                )[0]
-            else:
-                blueprints = self._fetch_personal_blueprints()
-                token = self.token(
-                    [
-                        "esi-universe.read_structures.v1",
-                        "esi-characters.read_blueprints.v1",
-                    ]
-                )[0]
-
-            for blueprint in blueprints:
-                runs = blueprint["runs"]
-                if runs < 1:
-                    runs = None
-                quantity = blueprint["quantity"]
-                if quantity < 0:
-                    quantity = 1
-                original = Blueprint.objects.filter(
-                    owner=self, item_id=blueprint["item_id"]
-                ).first()
-                if original is not None:
-                    # We've seen this blueprint coming from ESI, so we know it shouldn't be deleted
-                    blueprint_ids_to_remove.remove(original.item_id)
-                    original.location = self._fetch_location(
-                        blueprint["location_id"],
-                        token=token,
-                    )
-                    original.location_flag = blueprint["location_flag"]
-                    original.eve_type = EveType.objects.get_or_create_esi(
-                        id=blueprint["type_id"]
-                    )[0]
-                    original.runs = runs
-                    original.material_efficiency = blueprint["material_efficiency"]
-                    original.time_efficiency = blueprint["time_efficiency"]
-                    original.quantity = quantity
-                    original.save()
-                else:
-                    Blueprint.objects.create(
-                        owner=self,
-                        location=self._fetch_location(
-                            blueprint["location_id"],
-                            token=token,
-                        ),
-                        location_flag=blueprint["location_flag"],
-                        eve_type=EveType.objects.get_or_create_esi(
-                            id=blueprint["type_id"]
-                        )[0],
-                        item_id=blueprint["item_id"],
-                        runs=runs,
-                        material_efficiency=blueprint["material_efficiency"],
-                        time_efficiency=blueprint["time_efficiency"],
-                        quantity=quantity,
-                    )
-            Blueprint.objects.filter(pk__in=blueprint_ids_to_remove).delete()
 
-    def update_industry_jobs_esi(self):
-        """updates all blueprints from ESI"""
+        sync_state.expires_at = parse_expires(response_headers)
+        if asset_pages is None:
+            logger.info(add_prefix("Assets have not been modified since last sync"))
+            sync_state.save()
+            return
+
+        assets = self._index_assets(asset_pages)
+        content_hash = hash_index(assets)
+        if not force_update and content_hash == sync_state.content_hash:
+            logger.info(add_prefix("Assets are unchanged since last sync"))
+            sync_state.etags = etags
+            sync_state.save()
+            return
+
+        if not location_resolver:
+            location_resolver = LocationResolver(token)
+        if not eve_type_resolver:
+            eve_type_resolver = EveTypeResolver()
+
+        containers = {
+            asset.location_id
+            for asset in assets.values()
+            if asset.location_id in assets
+        }
+        location_resolver.resolve(
+            assets[container].location_id
+            for container in containers
+            if assets[container].location_id not in containers
+        )
+        eve_type_resolver.resolve(assets[container].type_id for container in containers)
+        container_locations = {}
+        for container in containers:
+            parent_id = assets[container].location_id
+            if parent_id not in containers:
+                # containers within containers are not known to ESI
+                parent = location_resolver.get(parent_id)
+                parent_id = parent.id if parent else None
+            eve_type = eve_type_resolver.get(assets[container].type_id)
+            container_locations[container] = (
+                parent_id,
+                eve_type.id if eve_type else None,
+            )
 
-        if self.is_active:
-            job_ids_to_remove = list(
-                IndustryJob.objects.filter(owner=self).values_list("id", flat=True)
+        result = self._sync_in_chunks(
+            sync_state=sync_state,
+            content_hash=content_hash,
+            keys=self._containers_by_depth(container_locations),
+            sync_chunk=lambda ids: Location.objects.bulk_update_or_create_containers(
+                {id: container_locations[id] for id in ids}
+            ),
+        )
+        logger.info(
+            add_prefix("Synced locations of containers: %d created, %d updated"),
+            result.created,
+            result.updated,
+        )
+        sync_state.content_hash = content_hash
+        sync_state.etags = etags
+        sync_state.checkpoint = {}
+        sync_state.save()
+        return result
+
+    @with_token_context
+    @record_sync_run("blueprints")
+    def update_blueprints_esi(
+        self,
+        token: Token = None,
+        location_resolver: LocationResolver = None,
+        eve_type_resolver: EveTypeResolver = None,
+        force_update: bool = False,
+        update_async: bool = True,
+    ) -> Optional[SyncResult]:
+        """updates all blueprints from ESI
+
+        Args:
+        - token: token already resolved for this owner with all sync scopes,
+          will be resolved once for all fetches of this sync if not given
+        - location_resolver: resolver to share locations with other syncs of this run
+        - eve_type_resolver: resolver to share types with other syncs of this run
+        - force_update: update blueprints even if the payload is unchanged
+        - update_async: whether structures and retired blueprints are updated
+          by background tasks or within this sync
+
+        Returns counts of created, updated, deleted and unchanged blueprints
+        or None if the owner is not active
+        """
+
+        if not self.is_active:
+            return None
+
+        if token is None:
+            token = self.sync_token()
+
+        add_prefix = self._logger_prefix()
+        sync_state = self.sync_state(OwnerSyncState.Section.BLUEPRINTS)
+        etags = {} if force_update else dict(sync_state.etags)
+        response_headers = {}
+        if self.corporation:
+            blueprint_pages = self._fetch_corporate_blueprints(
+                token=token, etags=etags, response_headers=response_headers
+            )
+        else:
+            blueprint_pages = self._fetch_personal_blueprints(
+                token=token, etags=etags, response_headers=response_headers
+            )
+
+        sync_state.expires_at = parse_expires(response_headers)
+        if blueprint_pages is None:
+            logger.info(add_prefix("Blueprints have not been modified since last sync"))
+            sync_state.save()
+            return SyncResult(
+                unchanged=Blueprint.objects.filter(owner=self).current().count()
             )
+
+        blueprints = self._index_blueprints(blueprint_pages)
+        content_hash = hash_index(blueprints)
+        if not force_update and content_hash == sync_state.content_hash:
+            logger.info(add_prefix("Blueprints are unchanged since last sync"))
+            sync_state.etags = etags
+            sync_state.save()
+            return SyncResult(unchanged=len(blueprints))
+
+        # blueprints of the new generation are staged and published at once
+        generation = self.blueprints_generation + 1
+        owner_blueprints = Blueprint.objects.filter(owner=self)
+        checkpoint = sync_state.checkpoint
+        if not checkpoint or checkpoint.get("content_hash") != content_hash:
+            self._discard_staged_blueprints(generation)
+
+        if not location_resolver:
+            location_resolver = LocationResolver(token, update_async=update_async)
+        if not eve_type_resolver:
+            eve_type_resolver = EveTypeResolver()
+
+        location_resolver.resolve(
+            blueprint.location_id for blueprint in blueprints.values()
+        )
+        eve_type_resolver.resolve(
+            blueprint.type_id for blueprint in blueprints.values()
+        )
+
+        def new_blueprints(item_ids: List[int]) -> List[Blueprint]:
+            # objects are only built for one chunk at a time to limit memory
+            return [
+                Blueprint(
+                    owner=self,
+                    location=location_resolver.get(blueprints[item_id].location_id),
+                    location_flag=blueprints[item_id].location_flag,
+                    eve_type=eve_type_resolver.get(blueprints[item_id].type_id),
+                    item_id=item_id,
+                    runs=blueprints[item_id].runs,
+                    material_efficiency=blueprints[item_id].material_efficiency,
+                    time_efficiency=blueprints[item_id].time_efficiency,
+                    quantity=blueprints[item_id].quantity,
+                    generation=generation,
+                    last_generation=generation,
+                )
+                for item_id in item_ids
+            ]
+
+        def sync_chunk(item_ids: List[int]) -> SyncResult:
+            # only new blueprints are created here, while existing rows are
+            # kept unchanged until the generation is published
+            chunk_result = owner_blueprints.bulk_upsert(
+                new_blueprints(item_ids), fields=[]
+            )
+            for ids in chunks(item_ids, BLUEPRINTS_BULK_METHODS_BATCH_SIZE):
+                owner_blueprints.filter(item_id__in=ids).update(
+                    last_generation=generation
+                )
+            return chunk_result
+
+        item_ids = sorted(blueprints.keys())
+        staged = self._sync_in_chunks(
+            sync_state=sync_state,
+            content_hash=content_hash,
+            keys=item_ids,
+            sync_chunk=sync_chunk,
+        )
+        deleted = (
+            owner_blueprints.current().filter(last_generation__lt=generation).count()
+        )
+        with transaction.atomic():
+            # changes of existing blueprints are applied together with publishing
+            existing_ids = list(
+                owner_blueprints.filter(
+                    last_generation=generation, generation__lt=generation
+                )
+                .order_by("item_id")
+                .values_list("item_id", flat=True)
+            )
+            updated = unchanged = 0
+            for ids in chunks(existing_ids, BLUEPRINTS_SYNC_CHUNK_SIZE):
+                chunk_result = owner_blueprints.bulk_upsert(
+                    new_blueprints(ids), fields=Blueprint.SYNC_FIELDS
+                )
+                updated += chunk_result.updated
+                unchanged += chunk_result.unchanged
+            Owner.objects.filter(pk=self.pk).update(blueprints_generation=generation)
+            sync_state.content_hash = content_hash
+            sync_state.etags = etags
+            sync_state.checkpoint = {}
+            sync_state.save()
+            transaction.on_commit(
+                self._delete_retired_blueprints_async
+                if update_async
+                else self._delete_retired_blueprints
+            )
+
+        self.blueprints_generation = generation
+        result = SyncResult(
+            created=staged.created,
+            updated=updated,
+            deleted=deleted,
+            unchanged=unchanged,
+        )
+        logger.info(
+            add_prefix(
+                "Synced blueprints: %d created, %d updated, %d deleted, %d unchanged"
+            ),
+            *result,
+        )
+        return result
+
+    @with_token_context
+    @record_sync_run("industry_jobs")
+    def update_industry_jobs_esi(
+        self,
+        token: Token = None,
+        location_resolver: LocationResolver = None,
+        force_update: bool = False,
+    ):
+        """updates all industry jobs from ESI
+
+        Args:
+        - token: token already resolved for this owner with all sync scopes,
+          will be resolved once for all fetches of this sync if not given
+        - location_resolver: resolver to share locations with other syncs of this run
+        - force_update: update jobs even if the payload is unchanged
+
+        Returns counts of created, updated, deleted and unchanged jobs
+        or None if unchanged or the owner is not active
+        """
+
+        if self.is_active:
+            if token is None:
+                token = self.sync_token()
+
+            add_prefix = self._logger_prefix()
+            sync_state = self.sync_state(OwnerSyncState.Section.INDUSTRY_JOBS)
+            etags = {} if force_update else dict(sync_state.etags)
+            response_headers = {}
             if self.corporation:
-                jobs = self._fetch_corporate_industry_jobs()
-                token = self.token(
-                    [
-                        "esi-universe.read_structures.v1",
-                        "esi-industry.read_corporation_jobs.v1",
-                    ]
-                )[0]
+                jobs = self._fetch_corporate_industry_jobs(
+                    token=token, etags=etags, response_headers=response_headers
+                )
             else:
-                jobs = self._fetch_personal_industry_jobs()
-                token = self.token(
-                    [
-                        "esi-universe.read_structures.v1",
-                        "esi-industry.read_character_jobs.v1",
-                    ]
-                )[0]
+                jobs = self._fetch_personal_industry_jobs(
+                    token=token, etags=etags, response_headers=response_headers
+                )
 
+            sync_state.expires_at = parse_expires(response_headers)
+            if jobs is None:
+                logger.info(
+                    add_prefix("Industry jobs have not been modified since last sync")
+                )
+                sync_state.save()
+                return
+
+            content_hash = hash_payload(jobs, sort_key="job_id")
+            if not force_update and content_hash == sync_state.content_hash:
+                logger.info(add_prefix("Industry jobs are unchanged since last sync"))
+                sync_state.etags = etags
+                sync_state.save()
+                return
+
+            has_unmatched_jobs = False
+            if not location_resolver:
+                location_resolver = LocationResolver(token)
+
+            location_resolver.resolve(job["output_location_id"] for job in jobs)
+            # staged and retired blueprints are deleted by later syncs
+            blueprints = (
+                Blueprint.objects.all()
+                .current()
+                .only("item_id", "owner_id")
+                .in_bulk({job["blueprint_id"] for job in jobs})
+            )
+            existing_job_ids = set(
+                IndustryJob.objects.filter(owner=self).values_list("id", flat=True)
+            )
+            new_jobs = []
             for job in jobs:
-
-                original = IndustryJob.objects.filter(
-                    owner=self, id=job["job_id"]
-                ).first()
-                blueprint = Blueprint.objects.filter(pk=job["blueprint_id"]).first()
-                if blueprint is not None:
-                    if original is not None:
-                        # We've seen this job coming from ESI, so we know it shouldn't be deleted
-                        job_ids_to_remove.remove(original.id)
-                        original.status = job["status"]
-                        original.save()
-                    else:
-                        # Reject personal listings of corporate jobs and visa-versa
-                        if blueprint.owner == self:
-                            installer = EveCharacter.objects.get_character_by_id(
-                                job["installer_id"]
-                            )
-                            if not installer:
-                                installer = EveCharacter.objects.create_character(
-                                    job["installer_id"]
-                                )
-                            IndustryJob.objects.create(
-                                id=job["job_id"],
-                                activity=job["activity_id"],
-                                owner=self,
-                                location=self._fetch_location(
-                                    job["output_location_id"],
-                                    token=token,
-                                ),
-                                blueprint=Blueprint.objects.get(pk=job["blueprint_id"]),
-                                installer=installer,
-                                runs=job["runs"],
-                                start_date=job["start_date"],
-                                end_date=job["end_date"],
-                                status=job["status"],
-                            )
-                else:
+                blueprint = blueprints.get(job["blueprint_id"])
+                if blueprint is None:
                     blueprint_id = job["blueprint_id"]
                     logger.warn(f"Unmatchable blueprint ID: {blueprint_id}")
-            IndustryJob.objects.filter(pk__in=job_ids_to_remove).delete()
+                    has_unmatched_jobs = True
+                elif job["job_id"] in existing_job_ids:
+                    # We've seen this job coming from ESI, so we know it shouldn't be deleted
+                    new_jobs.append(
+                        IndustryJob(id=job["job_id"], owner=self, status=job["status"])
+                    )
+                # Reject personal listings of corporate jobs and visa-versa
+                elif blueprint.owner_id == self.pk:
+                    new_jobs.append(
+                        IndustryJob(
+                            id=job["job_id"],
+                            activity=job["activity_id"],
+                            owner=self,
+                            location=location_resolver.get(job["output_location_id"]),
+                            blueprint=blueprint,
+                            installer_id=job["installer_id"],
+                            runs=job["runs"],
+                            start_date=job["start_date"],
+                            end_date=job["end_date"],
+                            status=job["status"],
+                        )
+                    )
+
+            # unknown installers are created together before any job is written
+            installer_resolver = EveCharacterResolver()
+            installer_resolver.resolve(
+                job.installer_id for job in new_jobs if job.id not in existing_job_ids
+            )
+            jobs_to_sync = []
+            for job in new_jobs:
+                if job.id not in existing_job_ids:
+                    installer = installer_resolver.get(job.installer_id)
+                    if not installer:
+                        logger.warning(
+                            add_prefix("Unknown installer for job %d"), job.id
+                        )
+                        continue
+                    job.installer = installer
+                jobs_to_sync.append(job)
+
+            result = IndustryJob.objects.filter(owner=self).bulk_sync(
+                jobs_to_sync, fields=IndustryJob.SYNC_FIELDS
+            )
+            logger.info(
+                add_prefix(
+                    "Synced industry jobs: "
+                    "%d created, %d updated, %d deleted, %d unchanged"
+                ),
+                *result,
+            )
+
+            # unmatched jobs need to be synced again once their blueprints exist
+            if has_unmatched_jobs:
+                sync_state.content_hash = ""
+                sync_state.etags = {}
+            else:
+                sync_state.content_hash = content_hash
+                sync_state.etags = etags
+            sync_state.save()
+            return result
 
     @fetch_token_for_owner(["esi-assets.read_corporation_assets.v1"])
-    def _fetch_corporate_assets(self, token) -> list:
-        return esi.client.Assets.get_corporations_corporation_id_assets(
-            corporation_id=self.corporation.corporation_id,
-            token=token.valid_access_token(),
-        ).results()
+    def _fetch_corporate_assets(
+        self, token, etags: dict = None, response_headers: dict = None
+    ) -> Optional[Iterator[list]]:
+        return esi_fetch_pages(
+            "Assets.get_corporations_corporation_id_assets",
+            args={"corporation_id": self.corporation.corporation_id},
+            token=token,
+            esi_client=esi.client,
+            etags=etags,
+            response_headers=response_headers,
+        )
 
     @fetch_token_for_owner(["esi-assets.read_assets.v1"])
-    def _fetch_personal_assets(self, token) -> list:
-        return esi.client.Assets.get_characters_character_id_assets(
-            character_id=self.character.character.character_id,
-            token=token.valid_access_token(),
-        ).results()
+    def _fetch_personal_assets(
+        self, token, etags: dict = None, response_headers: dict = None
+    ) -> Optional[Iterator[list]]:
+        return esi_fetch_pages(
+            "Assets.get_characters_character_id_assets",
+            args={"character_id": self.character.character.character_id},
+            token=token,
+            esi_client=esi.client,
+            etags=etags,
+            response_headers=response_headers,
+        )
 
     @fetch_token_for_owner(["esi-corporations.read_blueprints.v1"])
-    def _fetch_corporate_blueprints(self, token) -> list:
-
-        corporation_id = self.corporation.corporation_id
-
-        blueprints = esi.client.Corporation.get_corporations_corporation_id_blueprints(
-            corporation_id=corporation_id,
-            token=token.valid_access_token(),
-        ).results()
-        return blueprints
+    def _fetch_corporate_blueprints(
+        self, token, etags: dict = None, response_headers: dict = None
+    ) -> Optional[Iterator[list]]:
+        return esi_fetch_pages(
+            "Corporation.get_corporations_corporation_id_blueprints",
+            args={"corporation_id": self.corporation.corporation_id},
+            token=token,
+            esi_client=esi.client,
+            etags=etags,
+            response_headers=response_headers,
+        )
 
     @fetch_token_for_owner(["esi-characters.read_blueprints.v1"])
-    def _fetch_personal_blueprints(self, token) -> list:
+    def _fetch_personal_blueprints(
+        self, token, etags: dict = None, response_headers: dict = None
+    ) -> Optional[Iterator[list]]:
+        return esi_fetch_pages(
+            "Character.get_characters_character_id_blueprints",
+            args={"character_id": self.character.character.character_id},
+            token=token,
+            esi_client=esi.client,
+            etags=etags,
+            response_headers=response_headers,
+        )
+
+    @fetch_token_for_owner(["esi-industry.read_corporation_jobs.v1"])
+    def _fetch_corporate_industry_jobs(
+        self, token, etags: dict = None, response_headers: dict = None
+    ) -> Optional[list]:
+        return esi_fetch(
+            "Industry.get_corporations_corporation_id_industry_jobs",
+            args={"corporation_id": self.corporation.corporation_id},
+            has_pages=True,
+            token=token,
+            esi_client=esi.client,
+            etags=etags,
+            response_headers=response_headers,
+        )
 
-        character_id = self.character.character.character_id
+    @fetch_token_for_owner(["esi-industry.read_character_jobs.v1"])
+    def _fetch_personal_industry_jobs(
+        self, token, etags: dict = None, response_headers: dict = None
+    ) -> Optional[list]:
+        return esi_fetch(
+            "Industry.get_characters_character_id_industry_jobs",
+            args={"character_id": self.character.character.character_id},
+            has_pages=True,
+            token=token,
+            esi_client=esi.client,
+            etags=etags,
+            response_headers=response_headers,
+        )
 
-        blueprints = esi.client.Character.get_characters_character_id_blueprints(
-            character_id=character_id,
-            token=token.valid_access_token(),
-        ).results()
+    @staticmethod
+    def _index_assets(asset_pages: Iterator[list]) -> Dict[int, _AssetEntry]:
+        """returns compact index of assets by item ID, consuming the pages one by one"""
+        assets = {}
+        for page in asset_pages:
+            for asset in page:
+                assets[asset["item_id"]] = _AssetEntry(
+                    location_id=asset["location_id"], type_id=asset["type_id"]
+                )
+        return assets
+
+    @staticmethod
+    def _index_blueprints(
+        blueprint_pages: Iterator[list],
+    ) -> Dict[int, _BlueprintEntry]:
+        """returns compact index of blueprints by item ID,
+        consuming the pages one by one
+        """
+        blueprints = {}
+        for page in blueprint_pages:
+            for blueprint in page:
+                runs = blueprint["runs"]
+                quantity = blueprint["quantity"]
+                blueprints[blueprint["item_id"]] = _BlueprintEntry(
+                    location_id=blueprint["location_id"],
+                    location_flag=blueprint["location_flag"],
+                    type_id=blueprint["type_id"],
+                    runs=runs if runs >= 1 else None,
+                    material_efficiency=blueprint["material_efficiency"],
+                    time_efficiency=blueprint["time_efficiency"],
+                    quantity=quantity if quantity >= 0 else 1,
+                )
         return blueprints
 
-    @fetch_token_for_owner(["esi-industry.read_corporation_jobs.v1"])
-    def _fetch_corporate_industry_jobs(self, token) -> list:
+    @contextmanager
+    def token_context(self):
+        """resolves tokens and checks permissions of this owner only once
+        for the duration of the context, e.g. one sync.
+
+        Tokens resolved for more scopes are reused for fewer scopes.
+        """
+        is_outermost = self._token_context is None
+        if is_outermost:
+            self._token_context = dict()
+            self._permissions = dict()
+        try:
+            yield
+        finally:
+            if is_outermost:
+                self._token_context = None
+                self._permissions = None
+
+    def sync_token(self) -> Token:
+        """returns a valid token for syncing all sections of the owner
+        or raises TokenError
+        """
+        token, error = self.token(self.esi_scopes())
+        if error:
+            raise TokenError
+        return token
 
-        corporation_id = self.corporation.corporation_id
+    def token(self, scopes=None) -> Tuple[Token, int]:
+        """returns a valid Token for the owner"""
+        if self._token_context is None:
+            return self._resolve_token(scopes)
 
-        jobs = esi.client.Industry.get_corporations_corporation_id_industry_jobs(
-            corporation_id=corporation_id,
-            token=token.valid_access_token(),
-        ).results()
-        return jobs
+        if isinstance(scopes, str):
+            scopes = scopes.split()
+        scopes = frozenset(scopes or [])
+        for known_scopes, (token, error) in self._token_context.items():
+            if not error and scopes.issubset(known_scopes):
+                return token, error
 
-    @fetch_token_for_owner(["esi-industry.read_character_jobs.v1"])
-    def _fetch_personal_industry_jobs(self, token) -> list:
+        self._token_context[scopes] = self._resolve_token(list(scopes))
+        return self._token_context[scopes]
 
-        character_id = self.character.character.character_id
+    def _has_perm(self, perm: str) -> bool:
+        """returns True if the user of the character has a permission"""
+        if self._token_context is None:
+            return self.character.user.has_perm(perm)
 
-        jobs = esi.client.Industry.get_characters_character_id_industry_jobs(
-            character_id=character_id,
-            token=token.valid_access_token(),
-        ).results()
-        return jobs
+        if perm not in self._permissions:
+            self._permissions[perm] = self.character.user.has_perm(perm)
+        return self._permissions[perm]
 
-    def token(self, scopes=None) -> Tuple[Token, int]:
-        """returns a valid Token for the owner"""
+    def _resolve_token(self, scopes=None) -> Tuple[Token, int]:
         token = None
         error = None
         add_prefix = self._logger_prefix()
@@ -357,7 +927,7 @@ class Owner(models.Model):
             error = self.ERROR_NO_CHARACTER
 
         # abort if character does not have sufficient permissions
-        elif self.corporation and not self.character.user.has_perm(
+        elif self.corporation and not self._has_perm(
             "blueprints.add_corporate_blueprint_owner"
         ):
             logger.error(
@@ -368,9 +938,7 @@ class Owner(models.Model):
             error = self.ERROR_INSUFFICIENT_PERMISSIONS
 
         # abort if character does not have sufficient permissions
-        elif not self.character.user.has_perm(
-            "blueprints.add_personal_blueprint_owner"
-        ):
+        elif not self._has_perm("blueprints.add_personal_blueprint_owner"):
             logger.error(
                 add_prefix(
                     "This character does not have sufficient permission to sync personal blueprints"
@@ -403,8 +971,91 @@ class Owner(models.Model):
 
         return token, error
 
-    def _fetch_location(self, location_id, token) -> "Location":
-        return Location.objects.get_or_create_esi_async(id=location_id, token=token)[0]
+    def sync_state(self, section: str) -> "OwnerSyncState":
+        """returns the sync state of this owner for a section"""
+        return OwnerSyncState.objects.get_or_create(owner=self, section=section)[0]
+
+    def _sync_in_chunks(
+        self,
+        sync_state: "OwnerSyncState",
+        content_hash: str,
+        keys: List[int],
+        sync_chunk: Callable[[List[int]], SyncResult],
+    ) -> SyncResult:
+        """syncs rows in chunks, each committed together with a checkpoint
+
+        Resumes after the last committed chunk of an interrupted sync,
+        if the ESI payload has not changed since.
+
+        Args:
+        - sync_state: sync state to store the checkpoint in
+        - content_hash: hash of the ESI payload being synced
+        - keys: keys of all rows to sync in a stable order
+        - sync_chunk: function syncing the rows for a chunk of keys
+
+        Returns combined counts of all chunks incl. the ones of an interrupted sync
+        """
+        checkpoint = sync_state.checkpoint
+        if checkpoint and checkpoint.get("content_hash") == content_hash:
+            done = checkpoint["done"]
+            result = SyncResult(*checkpoint["result"])
+            logger.info(
+                self._logger_prefix()("Resuming interrupted sync after %d of %d rows"),
+                done,
+                len(keys),
+            )
+        else:
+            done = 0
+            result = SyncResult()
+
+        for chunk in chunks(keys[done:], BLUEPRINTS_SYNC_CHUNK_SIZE):
+            with transaction.atomic():
+                result = SyncResult(*map(sum, zip(result, sync_chunk(chunk))))
+                done += len(chunk)
+                sync_state.checkpoint = {
+                    "content_hash": content_hash,
+                    "done": done,
+                    "result": list(result),
+                }
+                sync_state.save(update_fields=["checkpoint", "updated_at"])
+
+        return result
+
+    def _discard_staged_blueprints(self, generation: int):
+        """discards blueprints staged for a generation by an abandoned sync"""
+        owner_blueprints = Blueprint.objects.filter(owner=self)
+        owner_blueprints.filter(generation__gte=generation).delete()
+        owner_blueprints.filter(last_generation__gte=generation).update(
+            last_generation=self.blueprints_generation
+        )
+
+    def _delete_retired_blueprints(self):
+        """deletes blueprints no longer published for this owner"""
+        deleted = Blueprint.objects.filter(owner=self).retired().delete_in_batches()
+        logger.info("%s: Deleted %d retired blueprints", self, deleted)
+
+    def _delete_retired_blueprints_async(self):
+        """deletes blueprints no longer published for this owner in the background"""
+        from .tasks import delete_retired_blueprints
+
+        delete_retired_blueprints.delay(owner_pk=self.pk)
+
+    @staticmethod
+    def _containers_by_depth(
+        containers: Dict[int, Tuple[Optional[int], Optional[int]]]
+    ) -> List[int]:
+        """returns IDs of containers ordered by nesting depth,
+        so parents are always synced before the containers within them
+        """
+        depths = {}
+
+        def depth(id: int) -> int:
+            if id not in depths:
+                parent_id = containers[id][0]
+                depths[id] = depth(parent_id) + 1 if parent_id in containers else 0
+            return depths[id]
+
+        return sorted(containers.keys(), key=lambda id: (depth(id), id))
 
     def _logger_prefix(self):
         """returns standard logger prefix function"""
@@ -414,6 +1065,144 @@ class Owner(models.Model):
             return make_logger_prefix(self.character.character.character_name)
 
 
+class OwnerSyncState(models.Model):
+    """State of syncing a section of an owner with ESI"""
+
+    class Section(models.TextChoices):
+        BLUEPRINTS = "blueprints", _("Blueprints")
+        INDUSTRY_JOBS = "industry_jobs", _("Industry Jobs")
+        LOCATIONS = "locations", _("Locations")
+
+    owner = models.ForeignKey(
+        Owner,
+        on_delete=models.CASCADE,
+        related_name="sync_states",
+    )
+    section = models.CharField(max_length=16, choices=Section.choices)
+    content_hash = models.CharField(
+        max_length=32,
+        default="",
+        blank=True,
+        help_text="Hash of the ESI payload from the last completed sync",
+    )
+    etags = models.JSONField(
+        default=dict,
+        blank=True,
+        help_text="ETags by page of the ESI responses from the last completed sync",
+    )
+    expires_at = models.DateTimeField(
+        null=True,
+        default=None,
+        blank=True,
+        help_text="When the ESI cache for this section expires after the last sync",
+    )
+    checkpoint = models.JSONField(
+        default=dict,
+        blank=True,
+        help_text="Progress of an interrupted sync, which the next sync resumes from",
+    )
+    last_error = models.PositiveSmallIntegerField(
+        choices=Owner.ERRORS_LIST,
+        default=Owner.ERROR_NONE,
+        help_text="error of the last failed sync of this section",
+    )
+    consecutive_failures = models.PositiveIntegerField(
+        default=0,
+        help_text=(
+            "number of syncs of this section that failed in a row "
+            "since its last successful sync"
+        ),
+    )
+    last_failure_at = models.DateTimeField(
+        null=True,
+        default=None,
+        blank=True,
+        help_text="when the last sync of this section failed",
+    )
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = OwnerSyncStateManager()
+
+    class Meta:
+        default_permissions = ()
+        constraints = [
+            models.UniqueConstraint(
+                fields=["owner", "section"], name="functional_pk_ownersyncstate"
+            )
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.owner}: {self.get_section_display()}"
+
+    def record_failure(self, error: int):
+        """records a failed sync of this section, which delays its next scheduled sync"""
+        self.last_error = error
+        self.consecutive_failures += 1
+        self.last_failure_at = now()
+        OwnerSyncState.objects.filter(pk=self.pk).update(
+            last_error=error,
+            consecutive_failures=F("consecutive_failures") + 1,
+            last_failure_at=self.last_failure_at,
+        )
+
+    def reset_failures(self):
+        """resets the failures of this section, e.g. after a successful sync"""
+        self.last_error = Owner.ERROR_NONE
+        self.consecutive_failures = 0
+        self.last_failure_at = None
+        OwnerSyncState.objects.filter(pk=self.pk).reset_failures()
+
+    def backoff_until(self) -> Optional[dt.datetime]:
+        """returns until when scheduled syncs of this section are skipped
+        because of consecutive failures or None
+        """
+        if not self.consecutive_failures or not self.last_failure_at:
+            return None
+
+        minutes = min(
+            BLUEPRINTS_OWNER_BACKOFF_BASE_MINUTES
+            * 2 ** min(self.consecutive_failures - 1, 16),
+            BLUEPRINTS_OWNER_BACKOFF_MAX_HOURS * 60,
+        )
+        return self.last_failure_at + dt.timedelta(minutes=minutes)
+
+
+class SyncRun(models.Model):
+    """Metrics of syncing a section of an owner with ESI once"""
+
+    owner = models.ForeignKey(
+        Owner,
+        on_delete=models.CASCADE,
+        related_name="sync_runs",
+    )
+    section = models.CharField(
+        max_length=16, choices=OwnerSyncState.Section.choices, db_index=True
+    )
+    started_at = models.DateTimeField(db_index=True)
+    duration = models.FloatField(help_text="Wall time of the sync in seconds")
+    esi_calls = models.PositiveIntegerField(
+        default=0, help_text="Number of requests to ESI"
+    )
+    esi_bytes = models.PositiveBigIntegerField(
+        default=0, help_text="Total size of the ESI responses in bytes"
+    )
+    db_queries = models.PositiveIntegerField(
+        default=0, help_text="Number of database queries"
+    )
+    rows_created = models.PositiveIntegerField(default=0)
+    rows_updated = models.PositiveIntegerField(default=0)
+    rows_deleted = models.PositiveIntegerField(default=0)
+    error = models.PositiveSmallIntegerField(
+        choices=Owner.ERRORS_LIST, default=Owner.ERROR_NONE
+    )
+
+    class Meta:
+        default_permissions = ()
+
+    def __str__(self) -> str:
+        return f"{self.owner}: {self.get_section_display()} at {self.started_at}"
+
+
 class Blueprint(models.Model):
 
     item_id = models.PositiveBigIntegerField(
@@ -453,6 +1242,28 @@ class Blueprint(models.Model):
         help_text="Time efficiency of the blueprint",
         validators=[validate_time_efficiency],
     )
+    generation = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        help_text="Generation of the owner's blueprints this blueprint was added in",
+    )
+    last_generation = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        db_index=True,
+        help_text="Latest generation of the owner's blueprints containing this blueprint",
+    )
+
+    # fields updated from ESI when syncing blueprints
+    SYNC_FIELDS = [
+        "location",
+        "location_flag",
+        "eve_type",
+        "runs",
+        "material_efficiency",
+        "time_efficiency",
+        "quantity",
+    ]
 
     objects = BlueprintManager()
 
@@ -528,6 +1339,11 @@ class IndustryJob(models.Model):
         max_length=10,
     )
 
+    objects = IndustryJobManager()
+
+    # fields updated for existing jobs when syncing with ESI
+    SYNC_FIELDS = ["status"]
+
 
 class Location(models.Model):
     """An Eve Online location: Station or Upwell Structure or Solar System"""
@@ -0,0 +1,222 @@
+"""Lookups of related objects in bulk for the sync of an owner"""
+
+from typing import Dict, Iterable, Set
+
+from esi.models import Token
+from eveuniverse.models import EveType
+
+from allianceauth.eveonline.models import (
+    EveAllianceInfo,
+    EveCharacter,
+    EveCorporationInfo,
+)
+from allianceauth.services.hooks import get_extension_logger
+from app_utils.helpers import chunks
+from app_utils.logging import LoggerAddTag
+
+from . import __title__
+from .constants import ESI_MAX_IDS_PER_REQUEST
+from .helpers.esi_fetch import esi_request_slot
+from .providers import esi
+
+logger = LoggerAddTag(get_extension_logger(__name__), __title__)
+
+
+class LocationResolver:
+    """Resolves location IDs to location objects during one sync run.
+
+    Locations are looked up in bulk and cached,
+    so each location is checked and each structure is updated
+    at most once per run, even when the resolver is shared
+    between the sync of blueprints, industry jobs and assets.
+
+    Structures are updated by background tasks,
+    unless update_async is False, e.g. when there is no task queue.
+    """
+
+    def __init__(self, token: Token, update_async: bool = True) -> None:
+        self.token = token
+        self.update_async = update_async
+        self._locations = dict()
+
+    def resolve(self, ids: Iterable[int]):
+        """looks up all given location IDs, which are not yet known, in bulk"""
+        from .models import Location
+
+        new_ids = set(map(int, ids)).difference(self._locations.keys())
+        if new_ids:
+            if self.update_async:
+                locations = Location.objects.bulk_get_or_create_esi_async(
+                    ids=new_ids, token=self.token
+                )
+            else:
+                locations = Location.objects.bulk_get_or_create_esi(
+                    ids=new_ids, token=self.token
+                )
+            self._locations.update(locations)
+
+    def get(self, id: int):
+        """returns the location object for an ID. Will look it up if needed."""
+        id = int(id)
+        if id not in self._locations:
+            self.resolve([id])
+        return self._locations[id]
+
+
+class EveTypeResolver:
+    """Resolves type IDs to EveType objects during one sync run.
+
+    All known types are loaded with one query
+    and each missing type is fetched from ESI only once.
+    """
+
+    def __init__(self) -> None:
+        self._eve_types = dict()
+
+    def resolve(self, ids: Iterable[int]):
+        """looks up all given type IDs, which are not yet known, in bulk"""
+        new_ids = set(map(int, ids)).difference(self._eve_types.keys())
+        if new_ids:
+            eve_types = EveType.objects.in_bulk(new_ids)
+            for id in new_ids.difference(eve_types.keys()):
+                with esi_request_slot():
+                    eve_types[id], _ = EveType.objects.get_or_create_esi(id=id)
+            self._eve_types.update(eve_types)
+
+    def get(self, id: int) -> EveType:
+        """returns the EveType object for an ID. Will look it up if needed."""
+        id = int(id)
+        if id not in self._eve_types:
+            self.resolve([id])
+        return self._eve_types[id]
+
+
+class EveCharacterResolver:
+    """Resolves character IDs to EveCharacter objects during one sync run.
+
+    All known characters are loaded with one query
+    and all missing characters are created together from bulk ESI requests.
+    """
+
+    def __init__(self) -> None:
+        self._characters = dict()
+
+    def resolve(self, ids: Iterable[int]):
+        """looks up all given character IDs, which are not yet known, in bulk"""
+        new_ids = set(map(int, ids)).difference(self._characters.keys())
+        if new_ids:
+            characters = {
+                character.character_id: character
+                for character in EveCharacter.objects.filter(character_id__in=new_ids)
+            }
+            missing_ids = new_ids.difference(characters.keys())
+            if missing_ids:
+                characters.update(self._create_characters_esi(missing_ids))
+            self._characters.update(characters)
+
+    def get(self, id: int) -> EveCharacter:
+        """returns the EveCharacter object for an ID. Will look it up if needed.
+
+        Returns None if the character is not known to ESI.
+        """
+        id = int(id)
+        if id not in self._characters:
+            self.resolve([id])
+        return self._characters.get(id)
+
+    @classmethod
+    def _create_characters_esi(cls, ids: Set[int]) -> Dict[int, EveCharacter]:
+        """creates EveCharacter objects for all given IDs in bulk from ESI"""
+        affiliations = dict()
+        for chunk in chunks(sorted(ids), ESI_MAX_IDS_PER_REQUEST):
+            with esi_request_slot():
+                chunk_affiliations = esi.client.Character.post_characters_affiliation(
+                    characters=chunk
+                ).results()
+            for affiliation in chunk_affiliations:
+                if affiliation["character_id"] in ids:
+                    affiliations[affiliation["character_id"]] = affiliation
+        missing_ids = ids.difference(affiliations.keys())
+        if missing_ids:
+            logger.warning("Unknown characters: %s", sorted(missing_ids))
+
+        corporation_ids = {obj["corporation_id"] for obj in affiliations.values()}
+        alliance_ids = {
+            obj["alliance_id"]
+            for obj in affiliations.values()
+            if obj.get("alliance_id")
+        }
+        names = cls._fetch_names_esi(
+            set(affiliations.keys()) | corporation_ids | alliance_ids
+        )
+        corporation_tickers = cls._corporation_tickers(corporation_ids)
+        alliance_tickers = cls._alliance_tickers(alliance_ids)
+        EveCharacter.objects.bulk_create(
+            [
+                EveCharacter(
+                    character_id=character_id,
+                    character_name=names.get(character_id, ""),
+                    corporation_id=obj["corporation_id"],
+                    corporation_name=names.get(obj["corporation_id"], ""),
+                    corporation_ticker=corporation_tickers.get(
+                        obj["corporation_id"], ""
+                    ),
+                    alliance_id=obj.get("alliance_id"),
+                    alliance_name=names.get(obj.get("alliance_id"), ""),
+                    alliance_ticker=alliance_tickers.get(obj.get("alliance_id"), ""),
+                )
+                for character_id, obj in affiliations.items()
+            ],
+            ignore_conflicts=True,
+        )
+        return {
+            character.character_id: character
+            for character in EveCharacter.objects.filter(
+                character_id__in=affiliations.keys()
+            )
+        }
+
+    @staticmethod
+    def _fetch_names_esi(ids: Set[int]) -> Dict[int, str]:
+        """returns the names of all given entity IDs from ESI"""
+        names = dict()
+        for chunk in chunks(sorted(ids), ESI_MAX_IDS_PER_REQUEST):
+            with esi_request_slot():
+                entities = esi.client.Universe.post_universe_names(ids=chunk).results()
+            for entity in entities:
+                names[entity["id"]] = entity["name"]
+        return names
+
+    @staticmethod
+    def _corporation_tickers(ids: Set[int]) -> Dict[int, str]:
+        """returns the tickers of all given corporations,
+        which are only fetched from ESI if not known locally
+        """
+        tickers = dict(
+            EveCorporationInfo.objects.filter(corporation_id__in=ids).values_list(
+                "corporation_id", "corporation_ticker"
+            )
+        )
+        for id in ids.difference(tickers.keys()):
+            with esi_request_slot():
+                tickers[id] = esi.client.Corporation.get_corporations_corporation_id(
+                    corporation_id=id
+                ).results()["ticker"]
+        return tickers
+
+    @staticmethod
+    def _alliance_tickers(ids: Set[int]) -> Dict[int, str]:
+        """returns the tickers of all given alliances,
+        which are only fetched from ESI if not known locally
+        """
+        tickers = dict(
+            EveAllianceInfo.objects.filter(alliance_id__in=ids).values_list(
+                "alliance_id", "alliance_ticker"
+            )
+        )
+        for id in ids.difference(tickers.keys()):
+            with esi_request_slot():
+                tickers[id] = esi.client.Alliance.get_alliances_alliance_id(
+                    alliance_id=id
+                ).results()["ticker"]
+        return tickers
@@ -0,0 +1,51 @@
+from django.db.models.signals import m2m_changed, post_init, post_save
+from django.dispatch import receiver
+from esi.models import Token
+
+from .models import OwnerSyncState
+
+
+def _reset_sync_failures_of_character(character_id: int) -> None:
+    OwnerSyncState.objects.filter(
+        owner__character__character__character_id=character_id,
+        consecutive_failures__gt=0,
+    ).reset_failures()
+
+
+def _loaded_refresh_token(token: Token):
+    """returns the refresh token of a token or None if it was not loaded"""
+    # reading the field directly would load a deferred refresh token from the DB
+    return token.__dict__.get("refresh_token")
+
+
+@receiver(post_init, sender=Token)
+def remember_refresh_token(sender, instance, **kwargs):
+    """remembers the refresh token of a token when it is loaded,
+    so a new refresh token can be detected on save without querying the token again
+    """
+    instance._blueprints_refresh_token = _loaded_refresh_token(instance)
+
+
+@receiver(post_save, sender=Token)
+def reset_sync_failures_of_owners(sender, instance, created, **kwargs):
+    """gives owners another chance to sync after their character got a new token
+    or a new refresh token, e.g. after the user added it again
+
+    Refreshing an access token keeps the refresh token and is not a change.
+    """
+    refresh_token = _loaded_refresh_token(instance)
+    previous_refresh_token = getattr(instance, "_blueprints_refresh_token", None)
+    instance._blueprints_refresh_token = refresh_token
+    if created or (
+        previous_refresh_token is not None and previous_refresh_token != refresh_token
+    ):
+        _reset_sync_failures_of_character(instance.character_id)
+
+
+@receiver(m2m_changed, sender=Token.scopes.through)
+def reset_sync_failures_of_owners_on_new_scopes(
+    sender, instance, action, reverse, **kwargs
+):
+    """gives owners another chance to sync after the scopes of a token changed"""
+    if action in ("post_add", "post_remove") and not reverse:
+        _reset_sync_failures_of_character(instance.character_id)
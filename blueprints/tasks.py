@@ -1,21 +1,44 @@
 import random
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Iterable, List, Optional, Set
 
 from bravado.exception import HTTPBadGateway, HTTPGatewayTimeout, HTTPServiceUnavailable
-from celery import shared_task
+from celery import shared_task, states
 
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import OuterRef, Subquery
+from django.utils.timezone import now
 from esi.models import Token
 
 from allianceauth.services.hooks import get_extension_logger
 from allianceauth.services.tasks import QueueOnce
+from app_utils.helpers import chunks
 from app_utils.logging import LoggerAddTag
 
 from . import __title__
-from .app_settings import BLUEPRINTS_TASKS_TIME_LIMIT
-from .helpers import EsiErrorLimitExceeded, EsiOffline
-from .models import Location, Owner
+from .app_settings import (
+    BLUEPRINTS_BATCH_SYNC_WORKERS,
+    BLUEPRINTS_ESI_ERROR_LIMIT_THRESHOLD,
+    BLUEPRINTS_HEAVY_SYNC_DURATION_SECONDS,
+    BLUEPRINTS_HEAVY_SYNC_ESI_BYTES,
+    BLUEPRINTS_HEAVY_SYNC_PRIORITY,
+    BLUEPRINTS_HEAVY_SYNC_QUEUE,
+    BLUEPRINTS_TASKS_TIME_LIMIT,
+    BLUEPRINTS_UPDATE_BATCH_SIZE,
+    BLUEPRINTS_UPDATE_SPREAD_SECONDS,
+)
+from .helpers import EsiErrorLimitExceeded, EsiStatusException, esi_status
+from .helpers.esi_fetch import limit_page_workers
+from .managers import SyncResult
+from .models import Blueprint, Location, Owner, OwnerSyncState, SyncRun
 
 DEFAULT_TASK_PRIORITY = 6
 
+# structures updated by one task are not fetched again by others for this long
+STRUCTURE_UPDATE_CLAIM_SECONDS = 600
+
 
 logger = LoggerAddTag(get_extension_logger(__name__), __title__)
 
@@ -52,7 +75,7 @@ TASK_ESI_KWARGS = {
 )
 def update_blueprints_for_owner(self, owner_pk):
     """fetches all blueprints for owner from ESI"""
-    return _get_owner(owner_pk).update_blueprints_esi()
+    return _sync_owner_section(owner_pk, OwnerSyncState.Section.BLUEPRINTS)
 
 
 @shared_task(
@@ -67,7 +90,7 @@ def update_blueprints_for_owner(self, owner_pk):
 )
 def update_industry_jobs_for_owner(self, owner_pk):
     """fetches all industry jobs for owner from ESI"""
-    return _get_owner(owner_pk).update_industry_jobs_esi()
+    return _sync_owner_section(owner_pk, OwnerSyncState.Section.INDUSTRY_JOBS)
 
 
 @shared_task(
@@ -82,34 +105,401 @@ def update_industry_jobs_for_owner(self, owner_pk):
 )
 def update_locations_for_owner(self, owner_pk):
     """fetches all blueprints for owner from ESI"""
-    return _get_owner(owner_pk).update_locations_esi()
+    return _sync_owner_section(owner_pk, OwnerSyncState.Section.LOCATIONS)
 
 
-@shared_task(**TASK_DEFAULT_KWARGS)
-def update_all_blueprints():
-    for owner in Owner.objects.all():
-        update_blueprints_for_owner.apply_async(
-            kwargs={"owner_pk": owner.pk},
+def _sync_owner_section(owner_pk: int, section: str):
+    """syncs one section of an owner, unless another sync of it is running,
+    since concurrent syncs would discard each other's staged rows
+
+    Returns the result of the section or None if it was not synced
+    """
+    results = _get_owner(owner_pk).sync_esi(sections=[section])
+    return results.get(section) if results else None
+
+
+@shared_task(
+    **{
+        **TASK_ESI_KWARGS,
+        **{
+            "base": QueueOnce,
+            "once": {"keys": ["owner_pk"], "graceful": True},
+            "max_retries": None,
+        },
+    }
+)
+def sync_owner(self, owner_pk, sections: List[str] = None, force_update=False):
+    """syncs sections of an owner from ESI in one pipeline,
+    which shares the token, locations and types between its stages.
+
+    Args:
+    - owner_pk: primary key of the owner
+    - sections: sections to sync, all sections if not given
+    - force_update: update sections even if their payload is unchanged
+    """
+    owner = _get_owner(owner_pk)
+    # sections of syncs rejected while this task was queued are synced with it
+    pending_sections = _pop_pending_sections(owner_pk)
+    if sections and pending_sections:
+        sections = sorted(set(sections) | pending_sections)
+    result = owner.sync_esi(sections=sections, force_update=force_update)
+    if result is None and pending_sections:
+        _add_pending_sections(owner_pk, pending_sections)
+    return result
+
+
+def _pending_sections_key(owner_pk: int) -> str:
+    return f"BLUEPRINTS_OWNER_PENDING_SECTIONS_{owner_pk}"
+
+
+def _add_pending_sections(owner_pk: int, sections: Iterable[str]) -> None:
+    """adds sections to be synced by the next sync_owner task of an owner"""
+    key = _pending_sections_key(owner_pk)
+    cache.set(
+        key,
+        sorted(set(cache.get(key, [])) | set(sections)),
+        timeout=BLUEPRINTS_UPDATE_SPREAD_SECONDS + BLUEPRINTS_TASKS_TIME_LIMIT,
+    )
+
+
+def _pop_pending_sections(owner_pk: int) -> Set[str]:
+    """removes and returns the pending sections of an owner"""
+    key = _pending_sections_key(owner_pk)
+    sections = cache.get(key)
+    if sections is None:
+        return set()
+    cache.delete(key)
+    return set(sections)
+
+
+@shared_task(
+    **{
+        **TASK_ESI_KWARGS,
+        **{
+            "base": QueueOnce,
+            # the attempt is part of the key, so a batch can queue itself again
+            "once": {"keys": ["owner_pks", "sections", "requeued"], "graceful": True},
+            "max_retries": None,
+        },
+    }
+)
+def sync_owners(
+    self,
+    owner_pks: List[int],
+    sections: List[str] = None,
+    force_update=False,
+    requeued: int = 0,
+) -> dict:
+    """syncs a batch of owners from ESI in one task
+
+    Owners are synced concurrently in threads, so their ESI requests overlap.
+    The number of threads is limited by the remaining ESI error limit.
+    Each owner is synced in one thread, so its DB writes stay serialized.
+    A failed owner does not stop the syncs of the other owners.
+    Owners which failed because ESI was unavailable are queued again
+    in a new batch for when ESI is expected to be available again.
+    They are reported as failed if that batch could not be queued.
+
+    Args:
+    - owner_pks: primary keys of the owners
+    - sections: sections to sync, all sections if not given
+    - force_update: update sections even if their payload is unchanged
+    - requeued: how often these owners have been queued again
+
+    Returns the primary keys of synced, failed and queued again owners
+    """
+    label = f"Batch of {len(owner_pks)} owners"
+    try:
+        esi_status().raise_for_status()
+    except EsiStatusException as ex:
+        raise _retry_when_esi_unavailable(self, ex, label) from ex
+
+    owners = Owner.objects.in_bulk(owner_pks)
+    missing_pks = set(owner_pks) - set(owners.keys())
+    if missing_pks:
+        logger.warning("%s: Skipping unknown owners: %s", label, sorted(missing_pks))
+
+    max_workers = _batch_sync_workers(len(owners))
+    sync_owner_in_batch = partial(
+        _sync_owner_in_batch,
+        sections=sections,
+        force_update=force_update,
+        in_thread=max_workers > 1,
+    )
+    if max_workers > 1:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            outcomes = list(executor.map(sync_owner_in_batch, owners.values()))
+    else:
+        outcomes = [sync_owner_in_batch(owner) for owner in owners.values()]
+
+    result = {"synced": [], "failed": [], "requeued": []}
+    countdown = 0
+    for owner_pk, error in zip(owners.keys(), outcomes):
+        if error is None:
+            result["synced"].append(owner_pk)
+        elif isinstance(error, EsiStatusException) or (
+            isinstance(error, TASK_ESI_KWARGS["autoretry_for"])
+            and requeued < TASK_ESI_KWARGS["retry_kwargs"]["max_retries"]
+        ):
+            result["requeued"].append(owner_pk)
+            countdown = max(countdown, _esi_retry_countdown(error))
+        else:
+            result["failed"].append(owner_pk)
+
+    if result["requeued"]:
+        queued = sync_owners.apply_async(
+            kwargs={
+                "owner_pks": result["requeued"],
+                "sections": sections,
+                "force_update": force_update,
+                "requeued": requeued + 1,
+            },
+            countdown=countdown,
             priority=DEFAULT_TASK_PRIORITY,
         )
+        if getattr(queued, "state", None) == states.REJECTED:
+            logger.warning(
+                "%s: Could not queue %d owners again, "
+                "because the same batch is already queued",
+                label,
+                len(result["requeued"]),
+            )
+            result["failed"] += result["requeued"]
+            result["requeued"] = []
+
+    logger.info(
+        "%s: Synced %d owners with %d threads, %d failed, %d queued again",
+        label,
+        len(result["synced"]),
+        max_workers,
+        len(result["failed"]),
+        len(result["requeued"]),
+    )
+    return result
+
+
+def _sync_owner_in_batch(
+    owner: Owner,
+    sections: List[str] = None,
+    force_update: bool = False,
+    in_thread: bool = False,
+) -> Optional[Exception]:
+    """syncs an owner of a batch sync and returns the error if it failed
+
+    Owners synced concurrently fetch their pages sequentially,
+    so all requests of a batch stay within the ESI error limit.
+    """
+    try:
+        with limit_page_workers(1 if in_thread else None):
+            owner.sync_esi(sections=sections, force_update=force_update)
+    except (EsiStatusException, *TASK_ESI_KWARGS["autoretry_for"]) as ex:
+        logger.warning("%s: ESI unavailable for owner in batch: %s", owner, ex)
+        return ex
+    except Exception as ex:
+        logger.exception("%s: Failed to sync owner in batch", owner)
+        return ex
+    finally:
+        if in_thread:
+            # each thread has its own DB connection, which is not closed by celery
+            connection.close()
+    return None
+
+
+def _batch_sync_workers(num_owners: int) -> int:
+    """returns the number of threads for syncing owners in a batch,
+    so concurrent failures of all threads stay within the ESI error limit
+    """
+    workers = min(BLUEPRINTS_BATCH_SYNC_WORKERS, num_owners)
+    remain = esi_status().error_limit_remain
+    if remain is not None:
+        workers = min(workers, remain - BLUEPRINTS_ESI_ERROR_LIMIT_THRESHOLD)
+    return max(1, workers)
+
+
+@shared_task(
+    **{
+        **TASK_DEFAULT_KWARGS,
+        **{
+            "base": QueueOnce,
+            "once": {"keys": ["owner_pk"], "graceful": True},
+        },
+    }
+)
+def delete_retired_blueprints(owner_pk):
+    """deletes blueprints of an owner, which are no longer part of
+    its currently published generation of blueprints
+    """
+    deleted = Blueprint.objects.filter(owner_id=owner_pk).retired().delete_in_batches()
+    logger.info("Deleted %d retired blueprints of owner %s", deleted, owner_pk)
+
+
+@shared_task(
+    **{
+        **TASK_ESI_KWARGS,
+        **{
+            "base": QueueOnce,
+            "once": {"keys": ["owner_pk"], "graceful": True},
+            "max_retries": None,
+        },
+    }
+)
+def update_outdated_locations_for_owner(self, owner_pk):
+    """updates stale and empty locations of an owner from ESI"""
+    return _get_owner(owner_pk).update_outdated_locations_esi()
+
+
+@shared_task(**TASK_DEFAULT_KWARGS)
+def update_all_outdated_locations():
+    """queues updates of stale and empty locations for all active owners,
+    since syncs with an unchanged payload do not refresh locations
+    """
+    owner_pks = list(
+        Owner.objects.filter(is_active=True).order_by("pk").values_list("pk", flat=True)
+    )
+    for owner_pk in owner_pks:
+        update_outdated_locations_for_owner.apply_async(
+            kwargs={"owner_pk": owner_pk}, priority=DEFAULT_TASK_PRIORITY
+        )
+    return len(owner_pks)
+
+
+@shared_task(**TASK_DEFAULT_KWARGS)
+def update_all_blueprints():
+    return _update_owners_with_expired_cache(OwnerSyncState.Section.BLUEPRINTS)
 
 
 @shared_task(**TASK_DEFAULT_KWARGS)
 def update_all_industry_jobs():
-    for owner in Owner.objects.all():
-        update_industry_jobs_for_owner.apply_async(
-            kwargs={"owner_pk": owner.pk},
-            priority=DEFAULT_TASK_PRIORITY,
-        )
+    return _update_owners_with_expired_cache(OwnerSyncState.Section.INDUSTRY_JOBS)
 
 
 @shared_task(**TASK_DEFAULT_KWARGS)
 def update_all_locations():
-    for owner in Owner.objects.all():
-        update_locations_for_owner.apply_async(
-            kwargs={"owner_pk": owner.pk},
-            priority=DEFAULT_TASK_PRIORITY,
+    return _update_owners_with_expired_cache(OwnerSyncState.Section.LOCATIONS)
+
+
+def _update_owners_with_expired_cache(section: str) -> dict:
+    """queues the sync of a section for all active owners whose ESI cache for it
+    has expired or is expiring within the spread window.
+
+    Updates are spread evenly across the window and never start
+    before the cache of the owner has expired.
+    Owners are queued in batches of BLUEPRINTS_UPDATE_BATCH_SIZE per task,
+    except for heavy owners, which are queued on their own.
+    Owners whose last syncs of the section failed are skipped
+    until their backoff has passed.
+    When a heavy owner is already queued, the section is merged
+    into its queued sync instead.
+
+    Returns a summary with the number of queued, merged, skipped
+    and deduplicated owners
+    """
+    current_time = now()
+    expires_at_by_owner = dict(
+        OwnerSyncState.objects.filter(section=section).values_list(
+            "owner_id", "expires_at"
+        )
+    )
+    backed_off_owners = {
+        sync_state.owner_id
+        for sync_state in OwnerSyncState.objects.filter(
+            owner__is_active=True, section=section, consecutive_failures__gt=0
+        ).only("owner_id", "consecutive_failures", "last_failure_at")
+        if sync_state.backoff_until() and sync_state.backoff_until() > current_time
+    }
+    summary = {
+        "queued": 0,
+        "tasks": 0,
+        "merged": 0,
+        "deduplicated": 0,
+        "skipped_inactive": Owner.objects.filter(is_active=False).count(),
+        "skipped_backoff": len(backed_off_owners),
+        "skipped_not_due": 0,
+    }
+
+    # runs which were not modified or unchanged are too light to classify an owner
+    last_runs = SyncRun.objects.filter(
+        owner=OuterRef("pk"), section=section, error=Owner.ERROR_NONE, esi_bytes__gt=0
+    ).order_by("-started_at")
+    owners = (
+        Owner.objects.filter(is_active=True)
+        .annotate(
+            last_duration=Subquery(last_runs.values("duration")[:1]),
+            last_esi_bytes=Subquery(last_runs.values("esi_bytes")[:1]),
+        )
+        .order_by("pk")
+    )
+    due_owners = []
+    for owner_pk, last_duration, last_esi_bytes in owners.values_list(
+        "pk", "last_duration", "last_esi_bytes"
+    ):
+        if owner_pk in backed_off_owners:
+            continue
+        expires_at = expires_at_by_owner.get(owner_pk)
+        delay = (expires_at - current_time).total_seconds() if expires_at else 0
+        if delay <= BLUEPRINTS_UPDATE_SPREAD_SECONDS:
+            is_heavy = _is_heavy_sync(last_duration, last_esi_bytes)
+            due_owners.append((owner_pk, delay, is_heavy))
+        else:
+            summary["skipped_not_due"] += 1
+
+    owners_by_routing = {False: [], True: []}
+    for num, (owner_pk, delay, is_heavy) in enumerate(due_owners):
+        slot = num * BLUEPRINTS_UPDATE_SPREAD_SECONDS / len(due_owners)
+        owners_by_routing[is_heavy].append((max(slot, delay), delay, owner_pk))
+
+    for countdown, _, owner_pk in owners_by_routing[True]:
+        result = sync_owner.apply_async(
+            kwargs={"owner_pk": owner_pk, "sections": [section]},
+            countdown=int(countdown),
+            **_sync_routing(True),
+        )
+        if getattr(result, "state", None) == states.REJECTED:
+            # the queued sync of this owner may be for another section
+            _add_pending_sections(owner_pk, [section])
+            summary["merged"] += 1
+        else:
+            _add_to_summary(summary, result, 1)
+
+    for batch in chunks(sorted(owners_by_routing[False]), BLUEPRINTS_UPDATE_BATCH_SIZE):
+        # a batch starts with its earliest slot, but not before all caches expired
+        countdown = max(batch[0][0], max(delay for _, delay, _ in batch))
+        result = sync_owners.apply_async(
+            kwargs={
+                "owner_pks": [owner_pk for _, _, owner_pk in batch],
+                "sections": [section],
+                "requeued": 0,
+            },
+            countdown=int(countdown),
+            **_sync_routing(False),
         )
+        _add_to_summary(summary, result, len(batch))
+
+    logger.info(
+        "Queued sync of %s for %d owners with expired cache in %d tasks. "
+        "Skipped %d inactive owners, %d owners with failed syncs "
+        "and %d owners with valid cache. %d owners were already queued "
+        "and %d heavy owners were merged into their queued sync.",
+        section,
+        summary["queued"],
+        summary["tasks"],
+        summary["skipped_inactive"],
+        summary["skipped_backoff"],
+        summary["skipped_not_due"],
+        summary["deduplicated"],
+        summary["merged"],
+    )
+    return summary
+
+
+def _add_to_summary(summary: dict, result, num_owners: int) -> None:
+    """adds the owners of a queued task to the summary of a fan-out"""
+    if getattr(result, "state", None) == states.REJECTED:
+        # rejected by QueueOnce, because the same task is already queued
+        summary["deduplicated"] += num_owners
+    else:
+        summary["queued"] += num_owners
+        summary["tasks"] += 1
 
 
 @shared_task(
@@ -126,28 +516,113 @@ def update_structure_esi(self, id: int, token_pk: int):
     """Updates a structure object from ESI
     and retries later if the ESI error limit has already been reached
     """
+    token = _get_token(token_pk, f"Location #{id}")
+    try:
+        Location.objects.structure_update_or_create_esi(id, token)
+    except EsiStatusException as ex:
+        raise _retry_when_esi_unavailable(self, ex, f"Location #{id}") from ex
+
+
+@shared_task(**{**TASK_ESI_KWARGS, **{"max_retries": None}})
+def update_structures_esi(self, ids: List[int], token_pk: int):
+    """Updates a batch of structure objects from ESI
+    and retries later if the ESI error limit has already been reached
+
+    Structures already claimed by another task are skipped,
+    so structures shared by several owners are only fetched once.
+    """
+    token = _get_token(token_pk, f"{len(ids)} locations")
+    claimed_ids = _claim_structures(ids)
+    if not claimed_ids:
+        logger.info("Skipped %d locations already updated by other tasks", len(ids))
+        return SyncResult()._asdict()
+
+    try:
+        result = Location.objects.structures_update_or_create_esi(claimed_ids, token)
+    except Exception as ex:
+        # structures are claimed again when the batch is retried
+        cache.delete_many(_structure_claim_keys(claimed_ids))
+        if isinstance(ex, EsiStatusException):
+            raise _retry_when_esi_unavailable(self, ex, f"{len(ids)} locations") from ex
+        raise
+
+    logger.info(
+        "Updated %d locations: %d created, %d updated, %d skipped",
+        len(claimed_ids),
+        result.created,
+        result.updated,
+        len(ids) - len(claimed_ids),
+    )
+    return result._asdict()
+
+
+def _structure_claim_keys(ids: List[int]) -> List[str]:
+    return [f"BLUEPRINTS_STRUCTURE_UPDATE_CLAIM_{id}" for id in ids]
+
+
+def _claim_structures(ids: List[int]) -> List[int]:
+    """claims structures for an update and returns the IDs of the claimed ones"""
+    return [
+        id
+        for id, key in zip(ids, _structure_claim_keys(ids))
+        if cache.add(key, True, timeout=STRUCTURE_UPDATE_CLAIM_SECONDS)
+    ]
+
+
+def _get_token(token_pk: int, label: str) -> Token:
+    """returns the token or raises exception"""
     try:
-        token = Token.objects.get(pk=token_pk)
+        return Token.objects.get(pk=token_pk)
     except Token.DoesNotExist as ex:
         raise Token.DoesNotExist(
-            f"Location #{id}: Requested token with pk {token_pk} does not exist"
+            f"{label}: Requested token with pk {token_pk} does not exist"
         ) from ex
 
-    try:
-        Location.objects.structure_update_or_create_esi(id, token)
-    except EsiOffline as ex:
-        logger.warning(
-            "Location #%s: ESI appears to be offline. Trying again in 30 minutes.", id
-        )
-        raise self.retry(countdown=30 * 60 + int(random.uniform(1, 20))) from ex
-    except EsiErrorLimitExceeded as ex:
+
+def _retry_when_esi_unavailable(task, ex: EsiStatusException, label: str):
+    """returns a retry of the task for when ESI is offline
+    or when the ESI error limit has been reached
+    """
+    if isinstance(ex, EsiErrorLimitExceeded):
         logger.warning(
-            "Location #%s: ESI error limit threshold reached. "
-            "Trying again in %s seconds",
-            id,
+            "%s: ESI error limit threshold reached. Trying again in %s seconds",
+            label,
             ex.retry_in,
         )
-        raise self.retry(countdown=ex.retry_in) from ex
+        return task.retry(countdown=ex.retry_in)
+
+    logger.warning("%s: ESI appears to be offline. Trying again in 30 minutes.", label)
+    return task.retry(countdown=_esi_retry_countdown(ex))
+
+
+def _esi_retry_countdown(ex: Exception) -> int:
+    """returns the seconds until ESI is expected to be available again after an error"""
+    if isinstance(ex, EsiErrorLimitExceeded):
+        return int(ex.retry_in)
+    if isinstance(ex, EsiStatusException):
+        return 30 * 60 + int(random.uniform(1, 20))
+    return TASK_ESI_KWARGS["retry_backoff"]
+
+
+def _is_heavy_sync(duration: Optional[float], esi_bytes: Optional[int]) -> bool:
+    """returns True if the last sync of an owner that downloaded data was heavy"""
+    return bool(
+        (duration and duration >= BLUEPRINTS_HEAVY_SYNC_DURATION_SECONDS)
+        or (esi_bytes and esi_bytes >= BLUEPRINTS_HEAVY_SYNC_ESI_BYTES)
+    )
+
+
+def _sync_routing(is_heavy: bool) -> dict:
+    """returns the routing options for a sync task,
+    so heavy syncs do not delay the syncs of small owners
+    """
+    if not is_heavy:
+        return {"priority": DEFAULT_TASK_PRIORITY}
+
+    options = {"priority": BLUEPRINTS_HEAVY_SYNC_PRIORITY}
+    if BLUEPRINTS_HEAVY_SYNC_QUEUE:
+        options["queue"] = BLUEPRINTS_HEAVY_SYNC_QUEUE
+    return options
 
 
 def _get_owner(owner_pk: int) -> Owner:
@@ -0,0 +1,100 @@
+from io import StringIO
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+
+from ..managers import SyncResult
+from ..models import Owner, OwnerSyncState
+from . import create_owner
+from .testdata.load_entities import load_entities
+
+COMMAND_PATH = "blueprints.management.commands.blueprints_sync_owners"
+
+
+@patch(COMMAND_PATH + ".Owner.sync_esi")
+class TestBlueprintsSyncOwners(TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        super().setUpClass()
+        load_entities()
+
+    def setUp(self) -> None:
+        self.owner_1 = create_owner(character_id=1101, corporation_id=2101)
+        self.owner_2 = create_owner(character_id=1001, corporation_id=None)
+
+    def test_should_sync_all_active_owners_and_print_row_counts(self, mock_sync_esi):
+        # given
+        Owner.objects.filter(pk=self.owner_2.pk).update(is_active=False)
+        mock_sync_esi.return_value = {
+            OwnerSyncState.Section.BLUEPRINTS: SyncResult(created=2, unchanged=3),
+            OwnerSyncState.Section.INDUSTRY_JOBS: None,
+        }
+        out = StringIO()
+        # when
+        call_command("blueprints_sync_owners", "--processes", "1", stdout=out)
+        # then
+        self.assertEqual(mock_sync_esi.call_count, 1)
+        output = out.getvalue()
+        self.assertIn("Lexcorp: synced in", output)
+        self.assertIn(
+            "blueprints: 2 created, 0 updated, 0 deleted, 3 unchanged; "
+            "industry_jobs: not modified",
+            output,
+        )
+
+    def test_should_sync_selected_sections_of_selected_owners(self, mock_sync_esi):
+        # given
+        mock_sync_esi.return_value = {}
+        # when
+        call_command(
+            "blueprints_sync_owners",
+            str(self.owner_2.pk),
+            "--processes",
+            "1",
+            "--section",
+            "locations",
+            "--force-update",
+            stdout=StringIO(),
+        )
+        # then
+        mock_sync_esi.assert_called_once_with(
+            sections=["locations"], force_update=True, update_async=False
+        )
+
+    def test_should_fail_after_syncing_remaining_owners(self, mock_sync_esi):
+        # given
+        mock_sync_esi.side_effect = [RuntimeError("boom"), {}]
+        out = StringIO()
+        # when
+        with self.assertRaises(CommandError) as cm:
+            call_command("blueprints_sync_owners", "--processes", "1", stdout=out)
+        # then
+        self.assertEqual(mock_sync_esi.call_count, 2)
+        self.assertIn("Failed to sync 1 of 2 owners", str(cm.exception))
+        self.assertIn("failed after", out.getvalue())
+        self.assertIn("RuntimeError: boom", out.getvalue())
+
+    def test_should_report_owner_deleted_during_run_as_failed(self, mock_sync_esi):
+        # given
+        def sync_esi(**kwargs):
+            Owner.objects.filter(pk=self.owner_2.pk).delete()
+            return {}
+
+        mock_sync_esi.side_effect = sync_esi
+        out = StringIO()
+        # when
+        with self.assertRaises(CommandError) as cm:
+            call_command("blueprints_sync_owners", "--processes", "1", stdout=out)
+        # then
+        self.assertIn("Failed to sync 1 of 2 owners", str(cm.exception))
+        self.assertIn(f"Owner #{self.owner_2.pk}: failed after", out.getvalue())
+        self.assertIn("DoesNotExist", out.getvalue())
+
+    def test_should_reject_unknown_owners(self, mock_sync_esi):
+        # when
+        with self.assertRaises(CommandError):
+            call_command("blueprints_sync_owners", "999", stdout=StringIO())
+        # then
+        self.assertFalse(mock_sync_esi.called)
@@ -1,12 +1,23 @@
+from unittest.mock import patch
+
 from django.test import TestCase
+from django.utils.timezone import now
 from esi.errors import TokenError
 from esi.models import Token
 
+from app_utils.testing import NoSocketsTestCase
+
 from ..decorators import fetch_token_for_owner
+from ..models import Owner, OwnerSyncState
 from . import create_owner, scope_names_set
+from .testdata.esi_client_stub import esi_client_stub
 from .testdata.load_entities import load_entities
+from .testdata.load_eveuniverse import load_eveuniverse
+from .testdata.load_locations import load_locations
 
 DUMMY_URL = "http://www.example.com"
+MANAGERS_PATH = "blueprints.managers"
+MODELS_PATH = "blueprints.models"
 
 
 class TestFetchToken(TestCase):
@@ -33,3 +44,134 @@ class TestFetchToken(TestCase):
 
         with self.assertRaises(TokenError):
             dummy(self.owner)
+
+
+@patch(MODELS_PATH + ".esi")
+@patch(MANAGERS_PATH + ".esi")
+@patch("eveuniverse.managers.esi")
+class TestSyncRunDecorators(NoSocketsTestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        super().setUpClass()
+        load_entities()
+        load_eveuniverse()
+        load_locations()
+
+    def setUp(self) -> None:
+        self.owner = create_owner(character_id=1101, corporation_id=2101)
+
+    def test_should_resolve_token_once_per_sync(
+        self, mock_eveuniverse_managers, mock_esi_managers, mock_esi_models
+    ):
+        # given
+        mock_eveuniverse_managers.client = esi_client_stub
+        mock_esi_managers.client = esi_client_stub
+        mock_esi_models.client = esi_client_stub
+        # when
+        with patch.object(
+            Owner, "_resolve_token", wraps=self.owner._resolve_token
+        ) as spy:
+            self.owner.update_blueprints_esi()
+        # then
+        self.assertEqual(spy.call_count, 1)
+        self.assertIsNone(self.owner._token_context)
+
+    def test_should_record_sync_run_of_blueprints(
+        self, mock_eveuniverse_managers, mock_esi_managers, mock_esi_models
+    ):
+        # given
+        mock_eveuniverse_managers.client = esi_client_stub
+        mock_esi_managers.client = esi_client_stub
+        mock_esi_models.client = esi_client_stub
+        # when
+        self.owner.update_blueprints_esi()
+        # then
+        run = self.owner.sync_runs.get()
+        self.assertEqual(run.section, OwnerSyncState.Section.BLUEPRINTS)
+        self.assertEqual(run.rows_created, 1)
+        self.assertEqual(run.esi_calls, 1)
+        self.assertGreater(run.db_queries, 0)
+        self.assertGreaterEqual(run.duration, 0)
+        self.assertEqual(run.error, Owner.ERROR_NONE)
+
+    def test_should_record_error_of_failed_sync_run(
+        self, mock_eveuniverse_managers, mock_esi_managers, mock_esi_models
+    ):
+        # given
+        self.owner.character = None
+        self.owner.save()
+        # when
+        with self.assertRaises(TokenError):
+            self.owner.update_industry_jobs_esi()
+        # then
+        run = self.owner.sync_runs.get()
+        self.assertEqual(run.section, OwnerSyncState.Section.INDUSTRY_JOBS)
+        self.assertEqual(run.error, Owner.ERROR_NO_CHARACTER)
+
+    def test_should_count_consecutive_failures(
+        self, mock_eveuniverse_managers, mock_esi_managers, mock_esi_models
+    ):
+        # given
+        self.owner.character = None
+        self.owner.save()
+        # when
+        for _ in range(2):
+            with self.assertRaises(TokenError):
+                self.owner.update_blueprints_esi()
+        # then
+        sync_state = self.owner.sync_state(OwnerSyncState.Section.BLUEPRINTS)
+        self.assertEqual(sync_state.consecutive_failures, 2)
+        self.assertEqual(sync_state.last_error, Owner.ERROR_NO_CHARACTER)
+        self.assertIsNotNone(sync_state.backoff_until())
+
+    def test_should_reset_failures_after_successful_sync(
+        self, mock_eveuniverse_managers, mock_esi_managers, mock_esi_models
+    ):
+        # given
+        mock_eveuniverse_managers.client = esi_client_stub
+        mock_esi_managers.client = esi_client_stub
+        mock_esi_models.client = esi_client_stub
+        self._fail_section(OwnerSyncState.Section.BLUEPRINTS)
+        # when
+        self.owner.update_blueprints_esi()
+        # then
+        sync_state = self.owner.sync_state(OwnerSyncState.Section.BLUEPRINTS)
+        self.assertEqual(sync_state.consecutive_failures, 0)
+        self.assertIsNone(sync_state.backoff_until())
+
+    def test_should_keep_failures_of_other_sections_after_successful_sync(
+        self, mock_eveuniverse_managers, mock_esi_managers, mock_esi_models
+    ):
+        # given
+        mock_eveuniverse_managers.client = esi_client_stub
+        mock_esi_managers.client = esi_client_stub
+        mock_esi_models.client = esi_client_stub
+        self._fail_section(OwnerSyncState.Section.BLUEPRINTS)
+        # when
+        self.owner.update_industry_jobs_esi()
+        # then
+        sync_state = self.owner.sync_state(OwnerSyncState.Section.BLUEPRINTS)
+        self.assertEqual(sync_state.consecutive_failures, 2)
+
+    def test_should_record_error_of_sync_failing_to_fetch_token(
+        self, mock_eveuniverse_managers, mock_esi_managers, mock_esi_models
+    ):
+        # given
+        self.owner.character = None
+        self.owner.save()
+        # when
+        with self.assertRaises(TokenError):
+            self.owner.sync_esi(sections=[OwnerSyncState.Section.BLUEPRINTS])
+        # then
+        run = self.owner.sync_runs.get()
+        self.assertEqual(run.section, OwnerSyncState.Section.BLUEPRINTS)
+        self.assertEqual(run.error, Owner.ERROR_NO_CHARACTER)
+        sync_state = self.owner.sync_state(OwnerSyncState.Section.BLUEPRINTS)
+        self.assertEqual(sync_state.consecutive_failures, 1)
+
+    def _fail_section(self, section):
+        OwnerSyncState.objects.update_or_create(
+            owner=self.owner,
+            section=section,
+            defaults={"consecutive_failures": 2, "last_failure_at": now()},
+        )
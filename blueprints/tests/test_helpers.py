@@ -0,0 +1,437 @@
+import datetime as dt
+import threading
+from unittest.mock import patch
+
+from bravado.exception import HTTPNotModified
+
+from django.core.cache import cache
+from django.test import override_settings
+
+from app_utils.testing import NoSocketsTestCase
+
+from ..helpers import (
+    ESI_ERROR_BUDGET_CACHE_KEY,
+    ESI_STATUS_CACHE_KEY,
+    EsiErrorLimitExceeded,
+    EsiStatus,
+    esi_status,
+    hash_index,
+    parse_expires,
+    reserve_esi_error_budget,
+    update_esi_status_from_headers,
+)
+from ..helpers.esi_fetch import (
+    esi_fetch,
+    esi_fetch_pages,
+    limit_concurrent_esi_requests,
+    limit_page_workers,
+)
+from ..helpers.sync_metrics import collect_sync_metrics
+from .testdata.esi_test_tools.main import BravadoOperationStub, BravadoResponseStub
+
+ESI_FETCH_PATH = "blueprints.helpers.esi_fetch"
+HELPERS_PATH = "blueprints.helpers"
+LOCMEM_CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+}
+
+
+class EsiPagesStub:
+    """ESI stub for a paged endpoint with ETags per page"""
+
+    def __init__(
+        self, pages: dict, error_limit_remain: int = 100, lowercase_headers=False
+    ) -> None:
+        self.pages = pages
+        self.error_limit_remain = error_limit_remain
+        self.lowercase_headers = lowercase_headers
+        self.calls = []
+        self.Alpha = self
+
+    def get_items(self, page, _request_options=None, **kwargs):
+        etag = f'"{page}-{len(self.pages[page])}"'
+        headers = {
+            "x-pages": len(self.pages),
+            "ETag": etag,
+            "Expires": "Sun, 18 Oct 2026 12:05:00 GMT",
+            "x-esi-error-limit-remain": self.error_limit_remain,
+            "x-esi-error-limit-reset": 60,
+        }
+        if self.lowercase_headers:
+            headers = {key.lower(): value for key, value in headers.items()}
+        if_none_match = (_request_options or {}).get("headers", {}).get("If-None-Match")
+        self.calls.append((page, if_none_match))
+        if if_none_match == etag:
+            raise HTTPNotModified(
+                response=BravadoResponseStub(304, "Not Modified", headers=headers)
+            )
+        return BravadoOperationStub(self.pages[page], headers=headers)
+
+
+class TestEsiFetchWithEtags(NoSocketsTestCase):
+    def test_should_return_all_pages_and_store_etags(self):
+        # given
+        esi_client = EsiPagesStub({1: [1, 2], 2: [3]})
+        etags = {}
+        # when
+        result = esi_fetch(
+            "Alpha.get_items", has_pages=True, esi_client=esi_client, etags=etags
+        )
+        # then
+        self.assertEqual(result, [1, 2, 3])
+        self.assertEqual(etags, {"1": '"1-2"', "2": '"2-1"'})
+
+    def test_should_return_none_when_no_page_was_modified(self):
+        # given
+        esi_client = EsiPagesStub({1: [1, 2], 2: [3]})
+        etags = {"1": '"1-2"', "2": '"2-1"'}
+        # when
+        result = esi_fetch(
+            "Alpha.get_items", has_pages=True, esi_client=esi_client, etags=etags
+        )
+        # then
+        self.assertIsNone(result)
+        self.assertEqual(etags, {"1": '"1-2"', "2": '"2-1"'})
+
+    def test_should_refetch_unmodified_pages_when_other_page_changed(self):
+        # given
+        esi_client = EsiPagesStub({1: [1, 2], 2: [3, 4]})
+        etags = {"1": '"1-2"', "2": '"2-1"'}
+        # when
+        result = esi_fetch(
+            "Alpha.get_items", has_pages=True, esi_client=esi_client, etags=etags
+        )
+        # then
+        self.assertEqual(result, [1, 2, 3, 4])
+        self.assertEqual(etags, {"1": '"1-2"', "2": '"2-2"'})
+        self.assertEqual(esi_client.calls[-1], (1, None))
+
+    def test_should_detect_removed_pages(self):
+        # given
+        esi_client = EsiPagesStub({1: [1, 2]})
+        etags = {"1": '"1-2"', "2": '"2-1"'}
+        # when
+        result = esi_fetch(
+            "Alpha.get_items", has_pages=True, esi_client=esi_client, etags=etags
+        )
+        # then
+        self.assertEqual(result, [1, 2])
+        self.assertEqual(etags, {"1": '"1-2"'})
+
+    def test_should_return_headers_of_first_page(self):
+        # given
+        esi_client = EsiPagesStub({1: [1, 2], 2: [3]})
+        response_headers = {}
+        # when
+        esi_fetch(
+            "Alpha.get_items",
+            has_pages=True,
+            esi_client=esi_client,
+            etags={"1": '"1-2"', "2": '"2-1"'},
+            response_headers=response_headers,
+        )
+        # then
+        self.assertEqual(response_headers["Expires"], "Sun, 18 Oct 2026 12:05:00 GMT")
+
+    def test_should_handle_lowercase_header_names(self):
+        # given
+        esi_client = EsiPagesStub({1: [1, 2], 2: [3]}, lowercase_headers=True)
+        etags = {"1": '"1-2"', "2": '"2-1"'}
+        response_headers = {}
+        # when
+        result = esi_fetch(
+            "Alpha.get_items",
+            has_pages=True,
+            esi_client=esi_client,
+            etags=etags,
+            response_headers=response_headers,
+        )
+        # then
+        self.assertIsNone(result)
+        self.assertEqual(etags, {"1": '"1-2"', "2": '"2-1"'})
+        self.assertEqual(
+            parse_expires(response_headers),
+            dt.datetime(2026, 10, 18, 12, 5, tzinfo=dt.timezone.utc),
+        )
+
+
+@patch(ESI_FETCH_PATH + ".BLUEPRINTS_ESI_ERROR_LIMIT_THRESHOLD", 25)
+class TestEsiFetchConcurrentPages(NoSocketsTestCase):
+    def test_should_return_concurrently_fetched_pages_in_order(self):
+        # given
+        esi_client = EsiPagesStub({page: [page] for page in range(1, 11)})
+        # when
+        result = esi_fetch(
+            "Alpha.get_items",
+            args={},
+            has_pages=True,
+            esi_client=esi_client,
+            max_workers=4,
+        )
+        # then
+        self.assertEqual(result, list(range(1, 11)))
+        self.assertEqual(len(esi_client.calls), 10)
+
+    def test_should_record_esi_calls_of_all_threads(self):
+        # given
+        esi_client = EsiPagesStub({page: [page] for page in range(1, 6)})
+        # when
+        with collect_sync_metrics() as metrics:
+            esi_fetch(
+                "Alpha.get_items", has_pages=True, esi_client=esi_client, max_workers=4
+            )
+        # then
+        self.assertEqual(metrics.esi_calls, 5)
+
+    @patch(ESI_FETCH_PATH + ".ThreadPoolExecutor")
+    def test_should_fetch_sequentially_when_error_limit_is_low(self, mock_executor):
+        # given
+        esi_client = EsiPagesStub({1: [1], 2: [2], 3: [3]}, error_limit_remain=27)
+        # when
+        result = esi_fetch(
+            "Alpha.get_items", has_pages=True, esi_client=esi_client, max_workers=4
+        )
+        # then
+        self.assertEqual(result, [1, 2, 3])
+        self.assertFalse(mock_executor.called)
+
+    @patch(ESI_FETCH_PATH + ".ThreadPoolExecutor")
+    def test_should_fetch_sequentially_when_page_workers_are_limited(
+        self, mock_executor
+    ):
+        # given
+        esi_client = EsiPagesStub({1: [1], 2: [2], 3: [3]})
+        # when
+        with limit_page_workers(1):
+            result = esi_fetch(
+                "Alpha.get_items", has_pages=True, esi_client=esi_client, max_workers=4
+            )
+        # then
+        self.assertEqual(result, [1, 2, 3])
+        self.assertFalse(mock_executor.called)
+
+    def test_should_not_share_page_args_between_threads(self):
+        # given
+        esi_client = EsiPagesStub({page: [page] for page in range(1, 6)})
+        args = {"corporation_id": 2001}
+        # when
+        esi_fetch(
+            "Alpha.get_items",
+            args=args,
+            has_pages=True,
+            esi_client=esi_client,
+            max_workers=4,
+        )
+        # then
+        self.assertEqual(sorted(page for page, _ in esi_client.calls), [1, 2, 3, 4, 5])
+        self.assertEqual(args["page"], 1)
+
+    def test_should_limit_concurrent_requests_to_given_slots(self):
+        # given
+        class CountingSlots:
+            def __init__(self, slots: int) -> None:
+                self._semaphore = threading.BoundedSemaphore(slots)
+                self._lock = threading.Lock()
+                self.active = 0
+                self.max_active = 0
+                self.acquired = 0
+
+            def __enter__(self):
+                self._semaphore.acquire()
+                with self._lock:
+                    self.active += 1
+                    self.acquired += 1
+                    self.max_active = max(self.max_active, self.active)
+
+            def __exit__(self, *args):
+                with self._lock:
+                    self.active -= 1
+                self._semaphore.release()
+
+        esi_client = EsiPagesStub({page: [page] for page in range(1, 11)})
+        slots = CountingSlots(2)
+        limit_concurrent_esi_requests(slots)
+        self.addCleanup(limit_concurrent_esi_requests, None)
+        # when
+        result = esi_fetch(
+            "Alpha.get_items", has_pages=True, esi_client=esi_client, max_workers=4
+        )
+        # then
+        self.assertEqual(result, list(range(1, 11)))
+        self.assertEqual(slots.acquired, 10)
+        self.assertLessEqual(slots.max_active, 2)
+
+
+class TestEsiFetchPages(NoSocketsTestCase):
+    def test_should_fetch_pages_lazily_in_batches(self):
+        # given
+        esi_client = EsiPagesStub({page: [page] for page in range(1, 7)})
+        # when
+        pages = esi_fetch_pages("Alpha.get_items", esi_client=esi_client, max_workers=2)
+        first_pages = [next(pages), next(pages)]
+        # then
+        self.assertEqual(first_pages, [[1], [2]])
+        self.assertEqual(len(esi_client.calls), 2)
+        self.assertEqual(list(pages), [[3], [4], [5], [6]])
+        self.assertEqual(len(esi_client.calls), 6)
+
+    def test_should_update_etags_once_all_pages_are_consumed(self):
+        # given
+        esi_client = EsiPagesStub({1: [1], 2: [2]})
+        etags = {"1": '"1-1"', "2": '"2-2"'}
+        # when
+        pages = esi_fetch_pages("Alpha.get_items", esi_client=esi_client, etags=etags)
+        # then
+        self.assertEqual(etags, {"1": '"1-1"', "2": '"2-2"'})
+        self.assertEqual(list(pages), [[1], [2]])
+        self.assertEqual(etags, {"1": '"1-1"', "2": '"2-1"'})
+
+    def test_should_return_none_when_no_page_was_modified(self):
+        # given
+        esi_client = EsiPagesStub({1: [1], 2: [2]})
+        # when
+        pages = esi_fetch_pages(
+            "Alpha.get_items",
+            esi_client=esi_client,
+            etags={"1": '"1-1"', "2": '"2-1"'},
+        )
+        # then
+        self.assertIsNone(pages)
+
+
+class TestHashIndex(NoSocketsTestCase):
+    def test_should_ignore_order_of_entries(self):
+        self.assertEqual(
+            hash_index({1: (10, 20), 2: (30, 40)}),
+            hash_index({2: (30, 40), 1: (10, 20)}),
+        )
+
+    def test_should_detect_changed_entries(self):
+        self.assertNotEqual(
+            hash_index({1: (10, 20), 2: (30, 40)}),
+            hash_index({1: (10, 20), 2: (30, 41)}),
+        )
+
+
+class TestParseExpires(NoSocketsTestCase):
+    def test_should_parse_expires_header(self):
+        self.assertEqual(
+            parse_expires({"Expires": "Sun, 18 Oct 2026 12:05:00 GMT"}),
+            dt.datetime(2026, 10, 18, 12, 5, tzinfo=dt.timezone.utc),
+        )
+
+    def test_should_parse_lowercase_expires_header(self):
+        self.assertEqual(
+            parse_expires({"expires": "Sun, 18 Oct 2026 12:05:00 GMT"}),
+            dt.datetime(2026, 10, 18, 12, 5, tzinfo=dt.timezone.utc),
+        )
+
+    def test_should_return_none_when_missing_or_invalid(self):
+        self.assertIsNone(parse_expires({}))
+        self.assertIsNone(parse_expires({"Expires": "invalid"}))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+@patch(HELPERS_PATH + ".fetch_esi_status")
+class TestEsiStatus(NoSocketsTestCase):
+    def setUp(self) -> None:
+        cache.delete(ESI_STATUS_CACHE_KEY)
+
+    def test_should_fetch_status_once_and_share_it(self, mock_fetch_esi_status):
+        # given
+        mock_fetch_esi_status.return_value = EsiStatus(True, 95, 40)
+        # when
+        first = esi_status()
+        second = esi_status()
+        # then
+        self.assertEqual(mock_fetch_esi_status.call_count, 1)
+        self.assertTrue(first.is_online)
+        self.assertEqual(second.error_limit_remain, 95)
+        self.assertLessEqual(second.error_limit_reset, 40)
+
+    def test_should_use_status_from_response_headers(self, mock_fetch_esi_status):
+        # given
+        headers = {"x-esi-error-limit-remain": "12", "x-esi-error-limit-reset": "30"}
+        # when
+        update_esi_status_from_headers(headers)
+        status = esi_status()
+        # then
+        self.assertFalse(mock_fetch_esi_status.called)
+        self.assertEqual(status.error_limit_remain, 12)
+        self.assertTrue(status.is_error_limit_exceeded)
+
+    def test_should_count_down_error_limit_reset(self, mock_fetch_esi_status):
+        # given
+        update_esi_status_from_headers(
+            {"X-Esi-Error-Limit-Remain": "80", "X-Esi-Error-Limit-Reset": "30"}
+        )
+        # when
+        with patch(HELPERS_PATH + ".time") as mock_time:
+            mock_time.return_value = cache.get(ESI_STATUS_CACHE_KEY)[2] - 10
+            status = esi_status()
+        # then
+        self.assertEqual(status.error_limit_reset, 10)
+
+    def test_should_ignore_headers_without_error_limit(self, mock_fetch_esi_status):
+        # when
+        result = update_esi_status_from_headers({"x-pages": 1})
+        # then
+        self.assertIsNone(result)
+        self.assertIsNone(cache.get(ESI_STATUS_CACHE_KEY))
+
+    def test_should_update_status_from_esi_fetch(self, mock_fetch_esi_status):
+        # given
+        esi_client = EsiPagesStub({1: [1]}, error_limit_remain=70)
+        # when
+        esi_fetch("Alpha.get_items", has_pages=True, esi_client=esi_client)
+        # then
+        self.assertEqual(esi_status().error_limit_remain, 70)
+        self.assertFalse(mock_fetch_esi_status.called)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+@patch(HELPERS_PATH + ".BLUEPRINTS_ESI_ERROR_LIMIT_THRESHOLD", 25)
+class TestReserveEsiErrorBudget(NoSocketsTestCase):
+    def setUp(self) -> None:
+        cache.delete(ESI_ERROR_BUDGET_CACHE_KEY)
+        update_esi_status_from_headers(
+            {"X-Esi-Error-Limit-Remain": "27", "X-Esi-Error-Limit-Reset": "30"}
+        )
+
+    def test_should_allow_reservations_within_budget(self):
+        # when
+        with reserve_esi_error_budget():
+            with reserve_esi_error_budget():
+                reserved = cache.get(ESI_ERROR_BUDGET_CACHE_KEY)
+        # then
+        self.assertEqual(reserved, 2)
+        self.assertEqual(cache.get(ESI_ERROR_BUDGET_CACHE_KEY), 0)
+
+    def test_should_defer_callers_over_budget(self):
+        # given
+        with reserve_esi_error_budget(slots=2):
+            # when/then
+            with self.assertRaises(EsiErrorLimitExceeded) as cm:
+                with reserve_esi_error_budget():
+                    pass
+        self.assertGreaterEqual(cm.exception.retry_in, 30)
+        self.assertEqual(cache.get(ESI_ERROR_BUDGET_CACHE_KEY), 0)
+
+    def test_should_release_slots_when_request_fails(self):
+        # when
+        with self.assertRaises(OSError):
+            with reserve_esi_error_budget():
+                raise OSError
+        # then
+        self.assertEqual(cache.get(ESI_ERROR_BUDGET_CACHE_KEY), 0)
+
+    def test_should_use_budget_from_latest_headers(self):
+        # given
+        update_esi_status_from_headers(
+            {"X-Esi-Error-Limit-Remain": "100", "X-Esi-Error-Limit-Reset": "50"}
+        )
+        # when
+        with reserve_esi_error_budget(slots=10):
+            reserved = cache.get(ESI_ERROR_BUDGET_CACHE_KEY)
+        # then
+        self.assertEqual(reserved, 10)
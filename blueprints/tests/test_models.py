@@ -1,23 +1,36 @@
 import datetime as dt
 from unittest.mock import patch
 
+from bravado.exception import HTTPForbidden, HTTPNotFound
+
+from django.core.cache import cache
+from django.test import override_settings
 from django.utils.dateparse import parse_datetime
 from django.utils.timezone import now
+from esi.errors import TokenError
+from esi.models import Token
 from eveuniverse.models import EveType
 
 from allianceauth.eveonline.models import EveCharacter, EveCorporationInfo
 from allianceauth.tests.auth_utils import AuthUtils
 from app_utils.testing import NoSocketsTestCase
 
-from ..models import Blueprint, Location, Owner, Request
+from ..helpers import EsiErrorLimitExceeded, hash_payload
+from ..managers import SyncResult
+from ..models import Blueprint, IndustryJob, Location, Owner, OwnerSyncState, Request
+from ..resolvers import EveCharacterResolver, EveTypeResolver, LocationResolver
 from . import add_character_to_user, create_owner, create_user_from_evecharacter
 from .testdata.esi_client_stub import esi_client_stub
+from .testdata.esi_test_tools.main import BravadoResponseStub
 from .testdata.load_entities import load_entities
 from .testdata.load_eveuniverse import load_eveuniverse
 from .testdata.load_locations import load_locations
 
 MANAGERS_PATH = "blueprints.managers"
 MODELS_PATH = "blueprints.models"
+LOCMEM_CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+}
 
 
 @patch(MODELS_PATH + ".esi")
@@ -64,6 +77,20 @@ class TestCorporateOwner(NoSocketsTestCase):
         # then
         self.assertEqual(result, "")
 
+    def test_should_memoize_token_and_permissions_within_context(
+        self, mock_eveuniverse_managers, mock_esi_managers, mock_esi_models
+    ):
+        # when
+        with self.owner.token_context():
+            token, _ = self.owner.token(self.owner.esi_scopes())
+            with self.assertNumQueries(0):
+                other_token, error = self.owner.token(
+                    ["esi-corporations.read_blueprints.v1"]
+                )
+        # then
+        self.assertEqual(token, other_token)
+        self.assertFalse(error)
+
     def test_update_locations_esi(
         self, mock_eveuniverse_managers, mock_esi_managers, mock_esi_models
     ):
@@ -78,6 +105,250 @@ class TestCorporateOwner(NoSocketsTestCase):
             Location.objects.get(id=60003760),
         )
 
+    def test_should_link_containers_within_containers(
+        self, mock_eveuniverse_managers, mock_esi_managers, mock_esi_models
+    ):
+        # given
+        mock_eveuniverse_managers.client = esi_client_stub
+        mock_esi_managers.client = esi_client_stub
+        mock_esi_models.client = esi_client_stub
+        # when
+        self.owner.update_locations_esi()
+        # then
+        obj = Location.objects.get(id=1100000000003)
+        self.assertEqual(obj.parent_id, 1100000000001)
+        self.assertEqual(obj.eve_type_id, 23)
+
+    def test_should_update_existing_containers_in_bulk(
+        self, mock_eveuniverse_managers, mock_esi_managers, mock_esi_models
+    ):
+        # given
+        mock_eveuniverse_managers.client = esi_client_stub
+        mock_esi_managers.client = esi_client_stub
+        mock_esi_models.client = esi_client_stub
+        self.owner.update_locations_esi()
+        Location.objects.filter(id=1100000000003).update(parent=None)
+        locations_count = Location.objects.count()
+        # when
+        self.owner.update_locations_esi(force_update=True)
+        # then
+        self.assertEqual(Location.objects.count(), locations_count)
+        self.assertEqual(
+            Location.objects.get(id=1100000000003).parent_id, 1100000000001
+        )
+
+    def test_should_resume_interrupted_locations_sync_from_checkpoint(
+        self, mock_eveuniverse_managers, mock_esi_managers, mock_esi_models
+    ):
+        # given
+        mock_eveuniverse_managers.client = esi_client_stub
+        mock_esi_managers.client = esi_client_stub
+        mock_esi_models.client = esi_client_stub
+        original = Location.objects.bulk_update_or_create_containers
+        synced_chunks = []
+
+        def interrupt_after_first_chunk(containers):
+            if synced_chunks:
+                raise RuntimeError("worker restarted")
+            synced_chunks.append(list(containers.keys()))
+            return original(containers)
+
+        with patch(MODELS_PATH + ".BLUEPRINTS_SYNC_CHUNK_SIZE", 1), patch.object(
+            Location.objects,
+            "bulk_update_or_create_containers",
+            side_effect=interrupt_after_first_chunk,
+        ):
+            with self.assertRaises(RuntimeError):
+                self.owner.update_locations_esi()
+        sync_state = self.owner.sync_state(OwnerSyncState.Section.LOCATIONS)
+        self.assertEqual(sync_state.checkpoint["done"], 1)
+        self.assertEqual(synced_chunks, [[1100000000001]])
+        # when
+        with patch(MODELS_PATH + ".BLUEPRINTS_SYNC_CHUNK_SIZE", 1), patch.object(
+            Location.objects, "bulk_update_or_create_containers", wraps=original
+        ) as spy:
+            self.owner.update_locations_esi()
+        # then
+        self.assertNotIn(
+            1100000000001,
+            [id for call in spy.call_args_list for id in call[0][0].keys()],
+        )
+        obj = Location.objects.get(id=1100000000003)
+        self.assertEqual(obj.parent_id, 1100000000001)
+        sync_state.refresh_from_db()
+        self.assertEqual(sync_state.checkpoint, {})
+        self.assertTrue(sync_state.content_hash)
+
+    def test_should_resume_blueprints_sync_only_for_unchanged_payload(
+        self, mock_eveuniverse_managers, mock_esi_managers, mock_esi_models
+    ):
+        # given
+        mock_eveuniverse_managers.client = esi_client_stub
+        mock_esi_managers.client = esi_client_stub
+        mock_esi_models.client = esi_client_stub
+        OwnerSyncState.objects.create(
+            owner=self.owner,
+            section=OwnerSyncState.Section.BLUEPRINTS,
+            checkpoint={"content_hash": "outdated", "done": 1, "result": [1, 0, 0, 0]},
+        )
+        # when
+        result = self.owner.update_blueprints_esi()
+        # then
+        self.assertEqual(result, SyncResult(created=1))
+        self.assertTrue(self.owner.blueprint_set.filter(item_id=1027222693618).exists())
+        sync_state = self.owner.sync_state(OwnerSyncState.Section.BLUEPRINTS)
+        self.assertEqual(sync_state.checkpoint, {})
+
+    def test_should_skip_committed_chunks_when_resuming_blueprints_sync(
+        self, mock_eveuniverse_managers, mock_esi_managers, mock_esi_models
+    ):
+        # given
+        mock_eveuniverse_managers.client = esi_client_stub
+        mock_esi_managers.client = esi_client_stub
+        mock_esi_models.client = esi_client_stub
+        self.owner.update_blueprints_esi()
+        Owner.objects.filter(pk=self.owner.pk).update(blueprints_generation=0)
+        self.owner.refresh_from_db()
+        sync_state = self.owner.sync_state(OwnerSyncState.Section.BLUEPRINTS)
+        sync_state.checkpoint = {
+            "content_hash": sync_state.content_hash,
+            "done": 1,
+            "result": [1, 0, 0, 0],
+        }
+        sync_state.content_hash = ""
+        sync_state.etags = {}
+        sync_state.save()
+        Blueprint.objects.filter(item_id=1027222693618).update(material_efficiency=0)
+        # when
+        result = self.owner.update_blueprints_esi()
+        # then
+        self.assertEqual(result, SyncResult(created=1))
+        obj = Blueprint.objects.all().current().get(item_id=1027222693618)
+        self.assertEqual(obj.material_efficiency, 0)
+        sync_state.refresh_from_db()
+        self.assertEqual(sync_state.checkpoint, {})
+
+    @patch(MODELS_PATH + ".transaction.on_commit")
+    def test_should_publish_new_generation_and_retire_obsolete_blueprints(
+        self,
+        mock_on_commit,
+        mock_eveuniverse_managers,
+        mock_esi_managers,
+        mock_esi_models,
+    ):
+        # given
+        mock_eveuniverse_managers.client = esi_client_stub
+        mock_esi_managers.client = esi_client_stub
+        mock_esi_models.client = esi_client_stub
+        Blueprint.objects.create(
+            location=Location.objects.get(id=60003760),
+            eve_type=EveType.objects.get(id=33519),
+            owner=self.owner,
+            location_flag="AssetSafety",
+            material_efficiency=10,
+            time_efficiency=20,
+            item_id=1,
+        )
+        # when
+        result = self.owner.update_blueprints_esi()
+        # then
+        self.assertEqual(result, SyncResult(created=1, deleted=1))
+        self.owner.refresh_from_db()
+        self.assertEqual(self.owner.blueprints_generation, 1)
+        self.assertSetEqual(
+            set(Blueprint.objects.all().current().values_list("item_id", flat=True)),
+            {1027222693618},
+        )
+        self.assertSetEqual(
+            set(Blueprint.objects.all().retired().values_list("item_id", flat=True)),
+            {1},
+        )
+        mock_on_commit.assert_called_once_with(
+            self.owner._delete_retired_blueprints_async
+        )
+
+    @patch(MODELS_PATH + ".transaction.on_commit")
+    def test_should_delete_retired_blueprints_right_away_when_synchronous(
+        self,
+        mock_on_commit,
+        mock_eveuniverse_managers,
+        mock_esi_managers,
+        mock_esi_models,
+    ):
+        # given
+        mock_eveuniverse_managers.client = esi_client_stub
+        mock_esi_managers.client = esi_client_stub
+        mock_esi_models.client = esi_client_stub
+        mock_on_commit.side_effect = lambda func: func()
+        Blueprint.objects.create(
+            location=Location.objects.get(id=60003760),
+            eve_type=EveType.objects.get(id=33519),
+            owner=self.owner,
+            location_flag="AssetSafety",
+            material_efficiency=10,
+            time_efficiency=20,
+            item_id=1,
+        )
+        # when
+        self.owner.update_blueprints_esi(update_async=False)
+        # then
+        self.assertFalse(Blueprint.objects.filter(item_id=1).exists())
+
+    def test_should_keep_existing_blueprints_unchanged_until_published(
+        self, mock_eveuniverse_managers, mock_esi_managers, mock_esi_models
+    ):
+        # given
+        mock_eveuniverse_managers.client = esi_client_stub
+        mock_esi_managers.client = esi_client_stub
+        mock_esi_models.client = esi_client_stub
+        self.owner.update_blueprints_esi()
+        Blueprint.objects.filter(item_id=1027222693618).update(material_efficiency=0)
+        # when
+        with patch(
+            MODELS_PATH + ".transaction.on_commit", side_effect=RuntimeError
+        ), self.assertRaises(RuntimeError):
+            self.owner.update_blueprints_esi(force_update=True)
+        # then
+        obj = Blueprint.objects.all().current().get(item_id=1027222693618)
+        self.assertEqual(obj.material_efficiency, 0)
+        self.owner.refresh_from_db()
+        self.assertEqual(self.owner.blueprints_generation, 1)
+        # when
+        result = self.owner.update_blueprints_esi(force_update=True)
+        # then
+        self.assertEqual(result, SyncResult(updated=1))
+        obj = Blueprint.objects.all().current().get(item_id=1027222693618)
+        self.assertNotEqual(obj.material_efficiency, 0)
+
+    def test_should_discard_blueprints_staged_by_abandoned_sync(
+        self, mock_eveuniverse_managers, mock_esi_managers, mock_esi_models
+    ):
+        # given
+        mock_eveuniverse_managers.client = esi_client_stub
+        mock_esi_managers.client = esi_client_stub
+        mock_esi_models.client = esi_client_stub
+        Blueprint.objects.create(
+            location=Location.objects.get(id=60003760),
+            eve_type=EveType.objects.get(id=33519),
+            owner=self.owner,
+            location_flag="AssetSafety",
+            material_efficiency=10,
+            time_efficiency=20,
+            item_id=1,
+            generation=1,
+            last_generation=1,
+        )
+        OwnerSyncState.objects.create(
+            owner=self.owner,
+            section=OwnerSyncState.Section.BLUEPRINTS,
+            checkpoint={"content_hash": "outdated", "done": 1, "result": [1, 0, 0, 0]},
+        )
+        self.assertFalse(Blueprint.objects.all().current().filter(item_id=1).exists())
+        # when
+        self.owner.update_blueprints_esi()
+        # then
+        self.assertFalse(Blueprint.objects.filter(item_id=1).exists())
+
     def test_update_blueprints_esi(
         self, mock_eveuniverse_managers, mock_esi_managers, mock_esi_models
     ):
@@ -87,6 +358,333 @@ class TestCorporateOwner(NoSocketsTestCase):
         self.owner.update_blueprints_esi()
         self.assertEquals(Blueprint.objects.filter(eve_type_id=33519).count(), 1)
 
+    def test_should_sync_blueprints_in_bulk(
+        self, mock_eveuniverse_managers, mock_esi_managers, mock_esi_models
+    ):
+        # given
+        mock_eveuniverse_managers.client = esi_client_stub
+        mock_esi_managers.client = esi_client_stub
+        mock_esi_models.client = esi_client_stub
+        Blueprint.objects.create(
+            location=Location.objects.get(id=1000000000001),
+            eve_type=EveType.objects.get(id=33519),
+            owner=self.owner,
+            location_flag="CorpSAG4",
+            material_efficiency=0,
+            time_efficiency=20,
+            runs=2,
+            item_id=1027222693618,
+        )
+        Blueprint.objects.create(
+            location=Location.objects.get(id=60003760),
+            eve_type=EveType.objects.get(id=33519),
+            owner=self.owner,
+            location_flag="AssetSafety",
+            material_efficiency=10,
+            time_efficiency=20,
+            item_id=1,
+        )
+        # when
+        result = self.owner.update_blueprints_esi()
+        # then
+        self.assertEqual(result, SyncResult(created=0, updated=1, deleted=1))
+        self.assertSetEqual(
+            set(
+                Blueprint.objects.filter(owner=self.owner)
+                .current()
+                .values_list("item_id", flat=True)
+            ),
+            {1027222693618},
+        )
+        obj = Blueprint.objects.get(item_id=1027222693618)
+        self.assertEqual(obj.material_efficiency, 10)
+        self.assertEqual(obj.quantity, 1)
+
+    def test_should_record_error_of_failed_sync_run(
+        self, mock_eveuniverse_managers, mock_esi_managers, mock_esi_models
+    ):
+        # given
+        self.owner.character = None
+        self.owner.save()
+        # when
+        with self.assertRaises(TokenError):
+            self.owner.update_industry_jobs_esi()
+        # then
+        run = self.owner.sync_runs.get()
+        self.assertEqual(run.section, OwnerSyncState.Section.INDUSTRY_JOBS)
+        self.assertEqual(run.error, Owner.ERROR_NO_CHARACTER)
+
+    def test_should_reset_failures_after_successful_sync(
+        self, mock_eveuniverse_managers, mock_esi_managers, mock_esi_models
+    ):
+        # given
+        mock_eveuniverse_managers.client = esi_client_stub
+        mock_esi_managers.client = esi_client_stub
+        mock_esi_models.client = esi_client_stub
+        self._fail_section(OwnerSyncState.Section.BLUEPRINTS)
+        # when
+        self.owner.update_blueprints_esi()
+        # then
+        sync_state = self.owner.sync_state(OwnerSyncState.Section.BLUEPRINTS)
+        self.assertEqual(sync_state.consecutive_failures, 0)
+        self.assertIsNone(sync_state.backoff_until())
+
+    def test_should_reset_failures_when_character_changes(
+        self, mock_eveuniverse_managers, mock_esi_managers, mock_esi_models
+    ):
+        # given
+        self._fail_section(OwnerSyncState.Section.BLUEPRINTS)
+        owner = Owner.objects.get(pk=self.owner.pk)
+        _, character_ownership = create_user_from_evecharacter(1102)
+        # when
+        owner.character = character_ownership
+        owner.save()
+        # then
+        sync_state = owner.sync_state(OwnerSyncState.Section.BLUEPRINTS)
+        self.assertEqual(sync_state.consecutive_failures, 0)
+
+    def test_should_keep_failures_when_access_token_is_refreshed(
+        self, mock_eveuniverse_managers, mock_esi_managers, mock_esi_models
+    ):
+        # given
+        self._fail_section(OwnerSyncState.Section.BLUEPRINTS)
+        token = self.owner.sync_token()
+        # when
+        token.access_token = "new-access-token"
+        token.save()
+        # then
+        sync_state = self.owner.sync_state(OwnerSyncState.Section.BLUEPRINTS)
+        self.assertEqual(sync_state.consecutive_failures, 2)
+
+    def test_should_not_query_token_again_when_saving_it(
+        self, mock_eveuniverse_managers, mock_esi_managers, mock_esi_models
+    ):
+        # given
+        token = Token.objects.get(pk=self.owner.sync_token().pk)
+        token.access_token = "new-access-token"
+        # when/then
+        with self.assertNumQueries(1):
+            token.save(update_fields=["access_token"])
+
+    def test_should_reset_failures_when_refresh_token_changes(
+        self, mock_eveuniverse_managers, mock_esi_managers, mock_esi_models
+    ):
+        # given
+        self._fail_section(OwnerSyncState.Section.BLUEPRINTS)
+        token = self.owner.sync_token()
+        # when
+        token.refresh_token = "new-refresh-token"
+        token.save()
+        # then
+        sync_state = self.owner.sync_state(OwnerSyncState.Section.BLUEPRINTS)
+        self.assertEqual(sync_state.consecutive_failures, 0)
+
+    def test_should_reset_failures_when_character_gets_new_token(
+        self, mock_eveuniverse_managers, mock_esi_managers, mock_esi_models
+    ):
+        # given
+        self._fail_section(OwnerSyncState.Section.BLUEPRINTS)
+        token = self.owner.sync_token()
+        # when
+        token.pk = None
+        token.save()
+        # then
+        sync_state = self.owner.sync_state(OwnerSyncState.Section.BLUEPRINTS)
+        self.assertEqual(sync_state.consecutive_failures, 0)
+
+    def test_should_reset_failures_when_scopes_of_token_change(
+        self, mock_eveuniverse_managers, mock_esi_managers, mock_esi_models
+    ):
+        # given
+        self._fail_section(OwnerSyncState.Section.BLUEPRINTS)
+        token = self.owner.sync_token()
+        # when
+        token.scopes.remove(token.scopes.first())
+        # then
+        sync_state = self.owner.sync_state(OwnerSyncState.Section.BLUEPRINTS)
+        self.assertEqual(sync_state.consecutive_failures, 0)
+
+    def _fail_section(self, section):
+        OwnerSyncState.objects.update_or_create(
+            owner=self.owner,
+            section=section,
+            defaults={"consecutive_failures": 2, "last_failure_at": now()},
+        )
+
+    def test_should_report_unchanged_blueprints(
+        self, mock_eveuniverse_managers, mock_esi_managers, mock_esi_models
+    ):
+        # given
+        mock_eveuniverse_managers.client = esi_client_stub
+        mock_esi_managers.client = esi_client_stub
+        mock_esi_models.client = esi_client_stub
+        self.assertEqual(self.owner.update_blueprints_esi(), SyncResult(created=1))
+        # when
+        result = self.owner.update_blueprints_esi()
+        # then
+        self.assertEqual(result, SyncResult(unchanged=1))
+
+    def test_should_skip_blueprints_sync_when_payload_is_unchanged(
+        self, mock_eveuniverse_managers, mock_esi_managers, mock_esi_models
+    ):
+        # given
+        mock_eveuniverse_managers.client = esi_client_stub
+        mock_esi_managers.client = esi_client_stub
+        mock_esi_models.client = esi_client_stub
+        self.owner.update_blueprints_esi()
+        OwnerSyncState.objects.update(etags={})
+        Blueprint.objects.filter(item_id=1027222693618).update(material_efficiency=0)
+        # when
+        result = self.owner.update_blueprints_esi()
+        # then
+        self.assertEqual(result, SyncResult(unchanged=1))
+        obj = Blueprint.objects.get(item_id=1027222693618)
+        self.assertEqual(obj.material_efficiency, 0)
+        sync_state = self.owner.sync_state(OwnerSyncState.Section.BLUEPRINTS)
+        self.assertEqual(list(sync_state.etags.keys()), ["1"])
+
+    def test_should_store_etags_after_sync(
+        self, mock_eveuniverse_managers, mock_esi_managers, mock_esi_models
+    ):
+        # given
+        mock_eveuniverse_managers.client = esi_client_stub
+        mock_esi_managers.client = esi_client_stub
+        mock_esi_models.client = esi_client_stub
+        # when
+        self.owner.update_blueprints_esi()
+        # then
+        sync_state = self.owner.sync_state(OwnerSyncState.Section.BLUEPRINTS)
+        self.assertTrue(sync_state.etags["1"])
+
+    @patch(MODELS_PATH + ".hash_payload", wraps=hash_payload)
+    def test_should_skip_blueprints_sync_when_not_modified(
+        self,
+        spy_hash_payload,
+        mock_eveuniverse_managers,
+        mock_esi_managers,
+        mock_esi_models,
+    ):
+        # given
+        mock_eveuniverse_managers.client = esi_client_stub
+        mock_esi_managers.client = esi_client_stub
+        mock_esi_models.client = esi_client_stub
+        self.owner.update_blueprints_esi()
+        spy_hash_payload.reset_mock()
+        # when
+        result = self.owner.update_blueprints_esi()
+        # then
+        self.assertEqual(result, SyncResult(unchanged=1))
+        self.assertFalse(spy_hash_payload.called)
+
+    @patch(MODELS_PATH + ".hash_payload", wraps=hash_payload)
+    def test_should_skip_jobs_sync_when_not_modified(
+        self,
+        spy_hash_payload,
+        mock_eveuniverse_managers,
+        mock_esi_managers,
+        mock_esi_models,
+    ):
+        # given
+        mock_eveuniverse_managers.client = esi_client_stub
+        mock_esi_managers.client = esi_client_stub
+        mock_esi_models.client = esi_client_stub
+        self.owner.update_blueprints_esi()
+        self.owner.update_industry_jobs_esi()
+        spy_hash_payload.reset_mock()
+        # when
+        self.owner.update_industry_jobs_esi()
+        # then
+        self.assertFalse(spy_hash_payload.called)
+        self.assertEquals(self.owner.jobs.count(), 1)
+
+    def test_should_sync_unchanged_blueprints_when_forced(
+        self, mock_eveuniverse_managers, mock_esi_managers, mock_esi_models
+    ):
+        # given
+        mock_eveuniverse_managers.client = esi_client_stub
+        mock_esi_managers.client = esi_client_stub
+        mock_esi_models.client = esi_client_stub
+        self.owner.update_blueprints_esi()
+        Blueprint.objects.filter(item_id=1027222693618).update(material_efficiency=0)
+        # when
+        result = self.owner.update_blueprints_esi(force_update=True)
+        # then
+        self.assertEqual(result, SyncResult(updated=1))
+        obj = Blueprint.objects.get(item_id=1027222693618)
+        self.assertEqual(obj.material_efficiency, 10)
+
+    def test_should_not_store_job_hash_while_blueprints_are_missing(
+        self, mock_eveuniverse_managers, mock_esi_managers, mock_esi_models
+    ):
+        # given
+        mock_eveuniverse_managers.client = esi_client_stub
+        mock_esi_managers.client = esi_client_stub
+        mock_esi_models.client = esi_client_stub
+        self.owner.update_industry_jobs_esi()
+        self.owner.update_blueprints_esi()
+        # when
+        self.owner.update_industry_jobs_esi()
+        # then
+        self.assertEquals(self.owner.jobs.count(), 1)
+        sync_state = self.owner.sync_state(OwnerSyncState.Section.INDUSTRY_JOBS)
+        self.assertTrue(sync_state.content_hash)
+        self.assertTrue(sync_state.etags)
+
+    def test_should_not_match_jobs_with_retired_blueprints(
+        self, mock_eveuniverse_managers, mock_esi_managers, mock_esi_models
+    ):
+        # given
+        mock_eveuniverse_managers.client = esi_client_stub
+        mock_esi_managers.client = esi_client_stub
+        mock_esi_models.client = esi_client_stub
+        self.owner.update_blueprints_esi()
+        Blueprint.objects.filter(owner=self.owner).update(last_generation=0)
+        # when
+        self.owner.update_industry_jobs_esi()
+        # then
+        self.assertEqual(self.owner.jobs.count(), 0)
+        sync_state = self.owner.sync_state(OwnerSyncState.Section.INDUSTRY_JOBS)
+        self.assertFalse(sync_state.content_hash)
+
+    def test_should_update_status_of_existing_jobs_and_remove_obsolete_jobs(
+        self, mock_eveuniverse_managers, mock_esi_managers, mock_esi_models
+    ):
+        # given
+        mock_eveuniverse_managers.client = esi_client_stub
+        mock_esi_managers.client = esi_client_stub
+        mock_esi_models.client = esi_client_stub
+        self.owner.update_blueprints_esi()
+        self.owner.update_industry_jobs_esi()
+        job = self.owner.jobs.get(id=100000002)
+        job.status = "paused"
+        job.save()
+        obsolete_job = IndustryJob.objects.create(
+            id=100000099,
+            activity=IndustryJob.Activity.COPYING,
+            owner=self.owner,
+            location=job.location,
+            blueprint=Blueprint.objects.create(
+                item_id=1027222693699,
+                owner=self.owner,
+                eve_type=job.blueprint.eve_type,
+                location=job.location,
+                location_flag="Hangar",
+                material_efficiency=0,
+                time_efficiency=0,
+                quantity=1,
+            ),
+            installer=job.installer,
+            runs=1,
+            start_date=job.start_date,
+            end_date=job.end_date,
+            status="active",
+        )
+        # when
+        self.owner.update_industry_jobs_esi(force_update=True)
+        # then
+        self.assertEqual(self.owner.jobs.get(id=100000002).status, "active")
+        self.assertFalse(IndustryJob.objects.filter(id=obsolete_job.id).exists())
+
     def test_should_update_industry_jobs_esi(
         self, mock_eveuniverse_managers, mock_esi_managers, mock_esi_models
     ):
@@ -226,6 +824,62 @@ class TestBlueprintQuerySet(TestBlueprintsBase):
         self.assertEqual(obj["item_id"], 2)
         self.assertEqual(obj["owner_name"], "Wayne Technologies")
 
+    def test_should_upsert_without_deleting_other_rows(self):
+        # given
+        obj = Blueprint.objects.get(item_id=1)
+        obj.runs = 5
+        new_obj = Blueprint(
+            location=obj.location,
+            eve_type=obj.eve_type,
+            owner=self.owner_1001,
+            location_flag="AssetSafety",
+            material_efficiency=0,
+            time_efficiency=0,
+            item_id=3,
+        )
+        # when
+        result = Blueprint.objects.filter(owner=self.owner_1001).bulk_upsert(
+            [obj, new_obj], fields=Blueprint.SYNC_FIELDS
+        )
+        # then
+        self.assertEqual(result, SyncResult(created=1, updated=1))
+        self.assertEqual(Blueprint.objects.get(item_id=1).runs, 5)
+        self.assertEqual(Blueprint.objects.count(), 3)
+
+    def test_should_delete_rows_of_queryset_in_batches(self):
+        # when
+        result = Blueprint.objects.filter(owner=self.owner_1001).delete_in_batches(
+            batch_size=1
+        )
+        # then
+        self.assertEqual(result, 1)
+        self.assertSetEqual(
+            set(Blueprint.objects.values_list("item_id", flat=True)), {2}
+        )
+
+    def test_should_filter_blueprints_of_current_generation(self):
+        # given
+        Owner.objects.filter(pk=self.owner_1001.pk).update(blueprints_generation=1)
+        Blueprint.objects.filter(item_id=1).update(last_generation=1)
+        obj = Blueprint.objects.get(item_id=1)
+        obj.item_id = 3
+        obj.last_generation = 0
+        obj.save()
+        obj.item_id = 4
+        obj.generation = 2
+        obj.last_generation = 2
+        obj.save()
+        # when
+        current = set(
+            Blueprint.objects.all().current().values_list("item_id", flat=True)
+        )
+        retired = set(
+            Blueprint.objects.all().retired().values_list("item_id", flat=True)
+        )
+        # then
+        self.assertSetEqual(current, {1, 2})
+        self.assertSetEqual(retired, {3})
+
 
 class TestBlueprintManagerUserHasAccess(TestBlueprintsBase):
     @classmethod
@@ -444,3 +1098,426 @@ class TestRequestManager(TestBlueprintsBase):
         result = Request.objects.open_requests_total_count(self.user_1001)
         # then
         self.assertEqual(result, 2)
+
+
+@patch(MANAGERS_PATH + ".esi")
+@patch("blueprints.tasks.update_structures_esi")
+class TestLocationManagerBulkGetOrCreateEsiAsync(TestBlueprintsBase):
+    def setUp(self) -> None:
+        self.owner = create_owner(character_id=1101, corporation_id=None)
+        self.token = self.owner.token(["esi-universe.read_structures.v1"])[0]
+
+    def test_should_return_fresh_locations_without_updates(
+        self, mock_update_structures_esi, mock_esi_managers
+    ):
+        # when
+        result = Location.objects.bulk_get_or_create_esi_async(
+            ids=[60003760, 1000000000001], token=self.token
+        )
+        # then
+        self.assertSetEqual(set(result.keys()), {60003760, 1000000000001})
+        self.assertEqual(result[1000000000001].name, "Amamake - Test Structure Alpha")
+        self.assertFalse(mock_update_structures_esi.apply_async.called)
+
+    def test_should_create_missing_structures_and_queue_them_once(
+        self, mock_update_structures_esi, mock_esi_managers
+    ):
+        # when
+        result = Location.objects.bulk_get_or_create_esi_async(
+            ids=[1000000000999, 1000000000999, 60003760], token=self.token
+        )
+        # then
+        self.assertTrue(result[1000000000999].is_empty)
+        self.assertTrue(Location.objects.filter(id=1000000000999).exists())
+        self.assertEqual(mock_update_structures_esi.apply_async.call_count, 1)
+        _, kwargs = mock_update_structures_esi.apply_async.call_args
+        self.assertEqual(kwargs["kwargs"]["ids"], [1000000000999])
+
+    @patch(MANAGERS_PATH + ".BLUEPRINTS_STRUCTURE_BATCH_SIZE", 2)
+    def test_should_queue_structures_in_batches(
+        self, mock_update_structures_esi, mock_esi_managers
+    ):
+        # when
+        Location.objects.bulk_get_or_create_esi_async(
+            ids=[1000000000997, 1000000000998, 1000000000999], token=self.token
+        )
+        # then
+        self.assertEqual(
+            [
+                call_kwargs["kwargs"]["ids"]
+                for _, call_kwargs in mock_update_structures_esi.apply_async.call_args_list
+            ],
+            [[1000000000997, 1000000000998], [1000000000999]],
+        )
+
+    def test_should_queue_stale_structures(
+        self, mock_update_structures_esi, mock_esi_managers
+    ):
+        # given
+        Location.objects.filter(id=1000000000001).update(
+            updated_at=now() - dt.timedelta(days=2)
+        )
+        # when
+        Location.objects.bulk_get_or_create_esi_async(
+            ids=[1000000000001], token=self.token
+        )
+        # then
+        self.assertEqual(mock_update_structures_esi.apply_async.call_count, 1)
+
+    def test_resolver_should_look_up_each_location_once_per_run(
+        self, mock_update_structures_esi, mock_esi_managers
+    ):
+        # given
+        resolver = LocationResolver(self.token)
+        resolver.resolve([1000000000999, 60003760])
+        # when
+        with self.assertNumQueries(0):
+            location = resolver.get(1000000000999)
+            resolver.resolve([60003760, 1000000000999])
+        # then
+        self.assertEqual(location.id, 1000000000999)
+        self.assertEqual(mock_update_structures_esi.apply_async.call_count, 1)
+
+    def test_should_update_outdated_locations_of_owner(
+        self, mock_update_structures_esi, mock_esi_managers
+    ):
+        # given
+        for item_id, location_id in ((1, 1000000000001), (2, 60003760)):
+            Blueprint.objects.create(
+                location=Location.objects.get(id=location_id),
+                eve_type=EveType.objects.get(id=33519),
+                owner=self.owner,
+                location_flag="AssetSafety",
+                material_efficiency=10,
+                time_efficiency=20,
+                item_id=item_id,
+            )
+        Location.objects.filter(id=1000000000001).update(
+            updated_at=now() - dt.timedelta(days=2)
+        )
+        # when
+        result = self.owner.update_outdated_locations_esi()
+        # then
+        self.assertEqual(result, 1)
+        _, kwargs = mock_update_structures_esi.apply_async.call_args
+        self.assertEqual(kwargs["kwargs"]["ids"], [1000000000001])
+
+    @patch(MANAGERS_PATH + ".LocationManager.structures_update_or_create_esi")
+    def test_should_update_structures_right_away_when_synchronous(
+        self,
+        mock_structures_update_or_create_esi,
+        mock_update_structures_esi,
+        mock_esi_managers,
+    ):
+        # when
+        result = Location.objects.bulk_get_or_create_esi(
+            ids=[1000000000999, 60003760], token=self.token
+        )
+        # then
+        self.assertSetEqual(set(result.keys()), {1000000000999, 60003760})
+        mock_structures_update_or_create_esi.assert_called_once_with(
+            ids=[1000000000999], token=self.token
+        )
+        self.assertFalse(mock_update_structures_esi.apply_async.called)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+@patch(MANAGERS_PATH + ".update_esi_status_from_headers")
+@patch(MANAGERS_PATH + ".reserve_esi_error_budget")
+@patch(MANAGERS_PATH + ".esi")
+class TestLocationManagerStructureUpdateOrCreateEsi(TestBlueprintsBase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.token = create_owner(character_id=1101, corporation_id=None).token(
+            ["esi-universe.read_structures.v1"]
+        )[0]
+
+    def test_should_reserve_error_budget_and_report_response_headers(
+        self,
+        mock_esi,
+        mock_reserve_esi_error_budget,
+        mock_update_esi_status_from_headers,
+    ):
+        # given
+        mock_esi.client = esi_client_stub
+        # when
+        location, _ = Location.objects.structure_update_or_create_esi(
+            id=1000000000001, token=self.token
+        )
+        # then
+        self.assertEqual(location.name, "Amamake - Test Structure Alpha")
+        self.assertTrue(mock_reserve_esi_error_budget.called)
+        self.assertTrue(mock_update_esi_status_from_headers.called)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+@patch(MANAGERS_PATH + ".BLUEPRINTS_STRUCTURE_DENIED_BASE_MINUTES", 60)
+@patch(MANAGERS_PATH + ".reserve_esi_error_budget")
+@patch(MANAGERS_PATH + ".esi")
+class TestLocationManagerStructureAccessDenied(TestBlueprintsBase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.token = create_owner(character_id=1101, corporation_id=None).token(
+            ["esi-universe.read_structures.v1"]
+        )[0]
+        self.token.access_token = "denied_access_token"
+        self.token.save()
+        self.denied_tokens = {"denied_access_token"}
+
+    def _get_structure(self, structure_id, token):
+        if token in self.denied_tokens:
+            raise HTTPForbidden(response=BravadoResponseStub(403, "Forbidden"))
+        return esi_client_stub.Universe.get_universe_structures_structure_id(
+            structure_id=structure_id, token=token
+        )
+
+    def test_should_skip_esi_for_known_denied_structure(
+        self, mock_esi, mock_reserve_esi_error_budget
+    ):
+        # given
+        mock_esi.client.Universe.get_universe_structures_structure_id.side_effect = (
+            self._get_structure
+        )
+        Location.objects.structure_update_or_create_esi(
+            id=1000000000001, token=self.token
+        )
+        # when
+        location, _ = Location.objects.structure_update_or_create_esi(
+            id=1000000000001, token=self.token
+        )
+        # then
+        self.assertEqual(
+            mock_esi.client.Universe.get_universe_structures_structure_id.call_count, 1
+        )
+        self.assertTrue(
+            Location.objects.is_structure_access_denied(1000000000001, 1101)
+        )
+
+    def test_should_try_token_of_other_owner(
+        self, mock_esi, mock_reserve_esi_error_budget
+    ):
+        # given
+        mock_esi.client.Universe.get_universe_structures_structure_id.side_effect = (
+            self._get_structure
+        )
+        create_owner(character_id=1102, corporation_id=None)
+        # when
+        location, _ = Location.objects.structure_update_or_create_esi(
+            id=1000000000001, token=self.token
+        )
+        # then
+        self.assertEqual(location.name, "Amamake - Test Structure Alpha")
+        self.assertFalse(
+            Location.objects.is_structure_access_denied(1000000000001, 1102)
+        )
+
+    def test_should_not_try_other_owners_for_structure_not_found(
+        self, mock_esi, mock_reserve_esi_error_budget
+    ):
+        # given
+        mock_esi.client.Universe.get_universe_structures_structure_id.side_effect = (
+            HTTPNotFound(response=BravadoResponseStub(404, "Not Found"))
+        )
+        create_owner(character_id=1102, corporation_id=None)
+        # when
+        location, _ = Location.objects.structure_update_or_create_esi(
+            id=1000000000001, token=self.token
+        )
+        # then
+        self.assertEqual(
+            mock_esi.client.Universe.get_universe_structures_structure_id.call_count, 1
+        )
+        self.assertFalse(
+            Location.objects.is_structure_access_denied(1000000000001, 1101)
+        )
+
+    @patch("esi.models.Token.refresh")
+    def test_should_not_refresh_expired_tokens_of_other_owners(
+        self, mock_refresh, mock_esi, mock_reserve_esi_error_budget
+    ):
+        # given
+        mock_esi.client.Universe.get_universe_structures_structure_id.side_effect = (
+            self._get_structure
+        )
+        create_owner(character_id=1102, corporation_id=None)
+        Token.objects.filter(character_id=1102).update(
+            created=now() - dt.timedelta(hours=1)
+        )
+        # when
+        Location.objects.structure_update_or_create_esi(
+            id=1000000000001, token=self.token
+        )
+        # then
+        self.assertEqual(
+            mock_esi.client.Universe.get_universe_structures_structure_id.call_count, 1
+        )
+        self.assertFalse(mock_refresh.called)
+
+    def test_should_double_denial_time_for_repeated_denials(
+        self, mock_esi, mock_reserve_esi_error_budget
+    ):
+        # given
+        Location.objects._record_structure_access_denied(1000000000001, 1101)
+        first_until = cache.get("BLUEPRINTS_STRUCTURE_DENIED_1000000000001_1101")[1]
+        # when
+        Location.objects._record_structure_access_denied(1000000000001, 1101)
+        # then
+        denials, second_until = cache.get(
+            "BLUEPRINTS_STRUCTURE_DENIED_1000000000001_1101"
+        )
+        self.assertEqual(denials, 2)
+        self.assertAlmostEqual(second_until - first_until, 3600, delta=5)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+@patch(MANAGERS_PATH + ".reserve_esi_error_budget")
+@patch(MANAGERS_PATH + ".esi")
+class TestLocationManagerStructuresUpdateOrCreateEsi(TestBlueprintsBase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.token = create_owner(character_id=1101, corporation_id=None).token(
+            ["esi-universe.read_structures.v1"]
+        )[0]
+
+    def test_should_update_and_create_structures_in_bulk(
+        self, mock_esi, mock_reserve_esi_error_budget
+    ):
+        # given
+        mock_esi.client = esi_client_stub
+        Location.objects.filter(id=1000000000002).delete()
+        Location.objects.filter(id=1000000000001).update(name="Old name")
+        # when
+        result = Location.objects.structures_update_or_create_esi(
+            ids=[1000000000001, 1000000000002, 1000000000999], token=self.token
+        )
+        # then
+        self.assertEqual(result, SyncResult(created=2, updated=1))
+        self.assertEqual(
+            Location.objects.get(id=1000000000001).name,
+            "Amamake - Test Structure Alpha",
+        )
+        obj = Location.objects.get(id=1000000000002)
+        self.assertEqual(obj.name, "Amamake - Test Structure Bravo")
+        self.assertEqual(obj.eve_type_id, 35835)
+        self.assertEqual(obj.eve_solar_system_id, 30002537)
+        self.assertEqual(obj.owner_id, 2001)
+        self.assertTrue(Location.objects.get(id=1000000000999).is_empty)
+
+    def test_should_keep_fetched_structures_when_error_limit_is_reached(
+        self, mock_esi, mock_reserve_esi_error_budget
+    ):
+        # given
+        def get_structure(structure_id, token):
+            if structure_id == 1000000000002:
+                raise EsiErrorLimitExceeded(retry_in=60)
+            return esi_client_stub.Universe.get_universe_structures_structure_id(
+                structure_id=structure_id, token=token
+            )
+
+        mock_esi.client.Universe.get_universe_structures_structure_id.side_effect = (
+            get_structure
+        )
+        Location.objects.filter(id__in=[1000000000001, 1000000000002]).delete()
+        # when
+        with patch(MANAGERS_PATH + ".BLUEPRINTS_STRUCTURE_WORKERS", 1):
+            with self.assertRaises(EsiErrorLimitExceeded):
+                Location.objects.structures_update_or_create_esi(
+                    ids=[1000000000001, 1000000000002], token=self.token
+                )
+        # then
+        self.assertTrue(Location.objects.filter(id=1000000000001).exists())
+        self.assertFalse(Location.objects.filter(id=1000000000002).exists())
+
+
+class TestLocationManagerBulkUpdateOrCreateContainers(TestBlueprintsBase):
+    def test_should_create_containers_within_new_containers(self):
+        # when
+        result = Location.objects.bulk_update_or_create_containers(
+            {1100000000001: (60003760, 20185), 1100000000003: (1100000000001, 23)}
+        )
+        # then
+        self.assertEqual(result, SyncResult(created=2))
+        obj = Location.objects.get(id=1100000000003)
+        self.assertEqual(obj.parent_id, 1100000000001)
+        self.assertEqual(obj.eve_type_id, 23)
+
+    def test_should_update_existing_containers(self):
+        # given
+        Location.objects.create(id=1100000000001)
+        # when
+        with self.assertNumQueries(4):
+            result = Location.objects.bulk_update_or_create_containers(
+                {1100000000001: (60003760, 20185)}
+            )
+        # then
+        self.assertEqual(result, SyncResult(updated=1))
+        obj = Location.objects.get(id=1100000000001)
+        self.assertEqual(obj.parent_id, 60003760)
+        self.assertEqual(obj.eve_type_id, 20185)
+
+
+class TestEveTypeResolver(TestBlueprintsBase):
+    def test_should_load_known_types_with_one_query(self):
+        # given
+        resolver = EveTypeResolver()
+        # when
+        with self.assertNumQueries(1):
+            resolver.resolve([33519, 20185, 33519])
+            eve_type = resolver.get(33519)
+        # then
+        self.assertEqual(eve_type, EveType.objects.get(id=33519))
+
+    @patch("blueprints.resolvers.EveType.objects.get_or_create_esi")
+    def test_should_fetch_missing_types_once(self, mock_get_or_create_esi):
+        # given
+        mock_get_or_create_esi.return_value = (EveType.objects.get(id=603), True)
+        resolver = EveTypeResolver()
+        # when
+        resolver.resolve([33519, 99999999])
+        resolver.resolve([99999999])
+        eve_type = resolver.get(99999999)
+        # then
+        self.assertEqual(eve_type.id, 603)
+        self.assertEqual(mock_get_or_create_esi.call_count, 1)
+        _, kwargs = mock_get_or_create_esi.call_args
+        self.assertEqual(kwargs["id"], 99999999)
+
+
+class TestEveCharacterResolver(TestBlueprintsBase):
+    def test_should_load_known_characters_with_one_query(self):
+        # given
+        resolver = EveCharacterResolver()
+        # when
+        with self.assertNumQueries(1):
+            resolver.resolve([1001, 1101, 1001])
+            character = resolver.get(1001)
+        # then
+        self.assertEqual(character, EveCharacter.objects.get(character_id=1001))
+
+    @patch("blueprints.resolvers.esi")
+    def test_should_create_missing_characters_in_bulk(self, mock_esi):
+        # given
+        mock_esi.client = esi_client_stub
+        resolver = EveCharacterResolver()
+        # when
+        resolver.resolve([1001, 1201])
+        character = resolver.get(1201)
+        # then
+        self.assertEqual(character.character_name, "Jean Grey")
+        self.assertEqual(character.corporation_id, 2201)
+        self.assertEqual(character.corporation_name, "Xavier School")
+        self.assertEqual(character.corporation_ticker, "XSC")
+        self.assertEqual(character.alliance_id, 3201)
+        self.assertEqual(character.alliance_name, "X-Men")
+        self.assertEqual(character.alliance_ticker, "XMN")
+        self.assertTrue(EveCharacter.objects.filter(character_id=1201).exists())
+
+    @patch("blueprints.resolvers.esi")
+    def test_should_return_none_for_unknown_characters(self, mock_esi):
+        # given
+        mock_esi.client = esi_client_stub
+        resolver = EveCharacterResolver()
+        # when
+        character = resolver.get(1299)
+        # then
+        self.assertIsNone(character)
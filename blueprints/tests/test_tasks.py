@@ -1,8 +1,23 @@
+import datetime as dt
 from unittest.mock import patch
 
+from celery import states
+from celery.exceptions import Retry
+from celery.result import EagerResult
+from celery_once import AlreadyQueued
+
+from django.core.cache import cache
 from django.test import TestCase, override_settings
+from django.utils.timezone import now
+from eveuniverse.models import EveType
+
+from allianceauth.services.tasks import DjangoBackend
 
 from .. import tasks
+from ..helpers import EsiErrorLimitExceeded, EsiStatus
+from ..helpers.esi_fetch import _max_workers_within_error_limit
+from ..managers import SyncResult
+from ..models import Blueprint, Location, Owner, OwnerSyncState, SyncRun
 from . import create_owner
 from .testdata.load_entities import load_entities
 from .testdata.load_eveuniverse import load_eveuniverse
@@ -27,6 +42,609 @@ class TestUpdateBlueprints(TestCase):
         self.assertTrue(mock_update_blueprints_esi.called)
 
     @patch(TASKS_PATH + ".Owner.update_blueprints_esi")
-    def test_update_all_blueprints(self, mock_update_blueprints_esi):
+    def test_should_not_update_blueprints_during_other_sync_of_owner(
+        self, mock_update_blueprints_esi
+    ):
+        # when
+        with self.owner.sync_lock():
+            result = tasks.update_blueprints_for_owner(self.owner.pk)
+        # then
+        self.assertIsNone(result)
+        self.assertFalse(mock_update_blueprints_esi.called)
+
+    @patch(TASKS_PATH + ".esi_status")
+    @patch(TASKS_PATH + ".Owner.update_blueprints_esi")
+    def test_update_all_blueprints(self, mock_update_blueprints_esi, mock_esi_status):
+        mock_esi_status.return_value = EsiStatus(True, 100, 60)
         tasks.update_all_blueprints()
         self.assertTrue(mock_update_blueprints_esi.called)
+
+
+@patch("blueprints.models.BLUEPRINTS_OWNER_BACKOFF_BASE_MINUTES", 30)
+@patch(TASKS_PATH + ".BLUEPRINTS_UPDATE_SPREAD_SECONDS", 600)
+@patch(TASKS_PATH + ".BLUEPRINTS_UPDATE_BATCH_SIZE", 1)
+@patch(TASKS_PATH + ".sync_owner")
+@patch(TASKS_PATH + ".sync_owners")
+class TestUpdateOwnersWithExpiredCache(TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        super().setUpClass()
+        load_entities()
+        cls.owner_1 = create_owner(character_id=1101, corporation_id=2101)
+        cls.owner_2 = create_owner(character_id=1102, corporation_id=None)
+
+    def _queued_countdowns(self, mock_batch_task, mock_task) -> dict:
+        countdowns = {
+            call[1]["kwargs"]["owner_pk"]: call[1]["countdown"]
+            for call in mock_task.apply_async.call_args_list
+        }
+        for call in mock_batch_task.apply_async.call_args_list:
+            for owner_pk in call[1]["kwargs"]["owner_pks"]:
+                countdowns[owner_pk] = call[1]["countdown"]
+        return countdowns
+
+    def test_should_queue_sync_of_section(self, mock_batch_task, mock_task):
+        # when
+        tasks.update_all_blueprints()
+        # then
+        _, kwargs = mock_batch_task.apply_async.call_args
+        self.assertEqual(kwargs["kwargs"]["sections"], ["blueprints"])
+
+    def test_should_spread_owners_without_expiry_across_window(
+        self, mock_batch_task, mock_task
+    ):
+        # when
+        tasks.update_all_blueprints()
+        # then
+        self.assertDictEqual(
+            self._queued_countdowns(mock_batch_task, mock_task),
+            {self.owner_1.pk: 0, self.owner_2.pk: 300},
+        )
+
+    def test_should_skip_owners_whose_cache_has_not_expired(
+        self, mock_batch_task, mock_task
+    ):
+        # given
+        self.owner_1.sync_states.create(
+            section=OwnerSyncState.Section.BLUEPRINTS,
+            expires_at=now() + dt.timedelta(hours=1),
+        )
+        # when
+        tasks.update_all_blueprints()
+        # then
+        self.assertDictEqual(
+            self._queued_countdowns(mock_batch_task, mock_task), {self.owner_2.pk: 0}
+        )
+
+    def test_should_delay_owners_until_their_cache_expires(
+        self, mock_batch_task, mock_task
+    ):
+        # given
+        self.owner_1.sync_states.create(
+            section=OwnerSyncState.Section.BLUEPRINTS,
+            expires_at=now() + dt.timedelta(seconds=500),
+        )
+        # when
+        tasks.update_all_blueprints()
+        # then
+        countdowns = self._queued_countdowns(mock_batch_task, mock_task)
+        self.assertAlmostEqual(countdowns[self.owner_1.pk], 500, delta=5)
+        self.assertEqual(countdowns[self.owner_2.pk], 300)
+
+    @patch(TASKS_PATH + ".BLUEPRINTS_HEAVY_SYNC_QUEUE", "heavy")
+    @patch(TASKS_PATH + ".BLUEPRINTS_HEAVY_SYNC_DURATION_SECONDS", 60)
+    def test_should_route_heavy_owners_to_separate_queue(
+        self, mock_batch_task, mock_task
+    ):
+        # given
+        SyncRun.objects.create(
+            owner=self.owner_1,
+            section=OwnerSyncState.Section.BLUEPRINTS,
+            started_at=now() - dt.timedelta(hours=5),
+            duration=5,
+            esi_bytes=1000,
+        )
+        SyncRun.objects.create(
+            owner=self.owner_1,
+            section=OwnerSyncState.Section.BLUEPRINTS,
+            started_at=now() - dt.timedelta(hours=3),
+            duration=90,
+            esi_bytes=1000,
+        )
+        # not modified since last run
+        SyncRun.objects.create(
+            owner=self.owner_1,
+            section=OwnerSyncState.Section.BLUEPRINTS,
+            started_at=now() - dt.timedelta(hours=1),
+            duration=1,
+            esi_bytes=0,
+        )
+        SyncRun.objects.create(
+            owner=self.owner_2,
+            section=OwnerSyncState.Section.BLUEPRINTS,
+            started_at=now() - dt.timedelta(hours=1),
+            duration=5,
+            esi_bytes=1000,
+        )
+        # when
+        tasks.update_all_blueprints()
+        # then
+        _, kwargs = mock_task.apply_async.call_args
+        self.assertEqual(kwargs["kwargs"]["owner_pk"], self.owner_1.pk)
+        self.assertEqual((kwargs["priority"], kwargs.get("queue")), (8, "heavy"))
+        _, kwargs = mock_batch_task.apply_async.call_args
+        self.assertEqual(kwargs["kwargs"]["owner_pks"], [self.owner_2.pk])
+        self.assertEqual(
+            (kwargs["priority"], kwargs.get("queue")),
+            (tasks.DEFAULT_TASK_PRIORITY, None),
+        )
+
+    @patch(TASKS_PATH + ".BLUEPRINTS_HEAVY_SYNC_DURATION_SECONDS", 60)
+    def test_should_merge_section_into_queued_sync_of_heavy_owner(
+        self, mock_batch_task, mock_task
+    ):
+        # given
+        mock_task.apply_async.return_value = EagerResult(None, None, states.REJECTED)
+        SyncRun.objects.create(
+            owner=self.owner_1,
+            section=OwnerSyncState.Section.INDUSTRY_JOBS,
+            started_at=now() - dt.timedelta(hours=1),
+            duration=90,
+            esi_bytes=1000,
+        )
+        # when
+        summary = tasks.update_all_industry_jobs()
+        # then
+        self.assertEqual(summary["merged"], 1)
+        self.assertEqual(summary["deduplicated"], 0)
+        self.assertEqual(
+            tasks._pop_pending_sections(self.owner_1.pk),
+            {OwnerSyncState.Section.INDUSTRY_JOBS},
+        )
+
+    def test_should_skip_owners_in_backoff_after_failures(
+        self, mock_batch_task, mock_task
+    ):
+        # given
+        OwnerSyncState.objects.create(
+            owner=self.owner_1,
+            section=OwnerSyncState.Section.BLUEPRINTS,
+            consecutive_failures=3,
+            last_failure_at=now() - dt.timedelta(minutes=90),
+        )
+        OwnerSyncState.objects.create(
+            owner=self.owner_2,
+            section=OwnerSyncState.Section.BLUEPRINTS,
+            consecutive_failures=1,
+            last_failure_at=now() - dt.timedelta(minutes=90),
+        )
+        OwnerSyncState.objects.create(
+            owner=self.owner_2,
+            section=OwnerSyncState.Section.INDUSTRY_JOBS,
+            consecutive_failures=3,
+            last_failure_at=now() - dt.timedelta(minutes=90),
+        )
+        # when
+        tasks.update_all_blueprints()
+        # then
+        self.assertEqual(
+            set(self._queued_countdowns(mock_batch_task, mock_task)), {self.owner_2.pk}
+        )
+
+    def test_should_queue_owners_in_batches(self, mock_batch_task, mock_task):
+        # given
+        owner_3 = create_owner(character_id=1001, corporation_id=None)
+        # when
+        with patch(TASKS_PATH + ".BLUEPRINTS_UPDATE_BATCH_SIZE", 2):
+            summary = tasks.update_all_blueprints()
+        # then
+        batches = [
+            (call[1]["kwargs"]["owner_pks"], call[1]["countdown"])
+            for call in mock_batch_task.apply_async.call_args_list
+        ]
+        self.assertEqual(
+            batches, [([self.owner_1.pk, self.owner_2.pk], 0), ([owner_3.pk], 400)]
+        )
+        self.assertFalse(mock_task.apply_async.called)
+        self.assertEqual(summary["queued"], 3)
+        self.assertEqual(summary["tasks"], 2)
+
+    def test_should_skip_inactive_owners(self, mock_batch_task, mock_task):
+        # given
+        Owner.objects.filter(pk=self.owner_1.pk).update(is_active=False)
+        # when
+        summary = tasks.update_all_blueprints()
+        # then
+        self.assertEqual(
+            set(self._queued_countdowns(mock_batch_task, mock_task)),
+            {self.owner_2.pk},
+        )
+        self.assertEqual(summary["skipped_inactive"], 1)
+        self.assertEqual(summary["queued"], 1)
+
+    def test_should_report_owners_already_queued(self, mock_batch_task, mock_task):
+        # given
+        mock_batch_task.apply_async.return_value = EagerResult(
+            None, None, states.REJECTED
+        )
+        self.owner_2.sync_states.create(
+            section=OwnerSyncState.Section.BLUEPRINTS,
+            expires_at=now() + dt.timedelta(hours=1),
+        )
+        # when
+        summary = tasks.update_all_blueprints()
+        # then
+        self.assertEqual(summary["deduplicated"], 1)
+        self.assertEqual(summary["queued"], 0)
+        self.assertEqual(summary["tasks"], 0)
+        self.assertEqual(summary["skipped_not_due"], 1)
+
+
+@override_settings(CELERY_ALWAYS_EAGER=True)
+@patch(TASKS_PATH + ".Owner.update_locations_esi")
+@patch(TASKS_PATH + ".Owner.update_industry_jobs_esi")
+@patch(TASKS_PATH + ".Owner.update_blueprints_esi")
+class TestSyncOwner(TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        super().setUpClass()
+        load_entities()
+        cls.owner = create_owner(character_id=1101, corporation_id=2101)
+
+    def test_should_sync_all_sections_with_shared_token_and_resolvers(
+        self, mock_blueprints, mock_jobs, mock_locations
+    ):
+        # when
+        tasks.sync_owner(self.owner.pk)
+        # then
+        _, blueprints_kwargs = mock_blueprints.call_args
+        _, jobs_kwargs = mock_jobs.call_args
+        _, locations_kwargs = mock_locations.call_args
+        self.assertEqual(blueprints_kwargs["token"], jobs_kwargs["token"])
+        self.assertIs(
+            blueprints_kwargs["location_resolver"], jobs_kwargs["location_resolver"]
+        )
+        self.assertIs(
+            blueprints_kwargs["eve_type_resolver"],
+            locations_kwargs["eve_type_resolver"],
+        )
+
+    def test_should_sync_blueprints_before_first_sync_of_jobs(
+        self, mock_blueprints, mock_jobs, mock_locations
+    ):
+        # given
+        calls = []
+        mock_blueprints.side_effect = lambda **kwargs: calls.append("blueprints")
+        mock_jobs.side_effect = lambda **kwargs: calls.append("industry_jobs")
+        # when
+        tasks.sync_owner(self.owner.pk, sections=["industry_jobs"])
+        # then
+        self.assertEqual(calls, ["blueprints", "industry_jobs"])
+        self.assertFalse(mock_locations.called)
+
+    def test_should_sync_only_requested_section(
+        self, mock_blueprints, mock_jobs, mock_locations
+    ):
+        # given
+        self.owner.sync_states.create(section=OwnerSyncState.Section.BLUEPRINTS)
+        # when
+        tasks.sync_owner(self.owner.pk, sections=["industry_jobs"])
+        # then
+        self.assertFalse(mock_blueprints.called)
+        self.assertTrue(mock_jobs.called)
+
+    def test_should_sync_sections_merged_into_queued_sync(
+        self, mock_blueprints, mock_jobs, mock_locations
+    ):
+        # given
+        self.owner.sync_states.create(section=OwnerSyncState.Section.BLUEPRINTS)
+        tasks._add_pending_sections(
+            self.owner.pk, [OwnerSyncState.Section.INDUSTRY_JOBS]
+        )
+        # when
+        tasks.sync_owner(self.owner.pk, sections=["blueprints"])
+        # then
+        self.assertTrue(mock_blueprints.called)
+        self.assertTrue(mock_jobs.called)
+        self.assertFalse(mock_locations.called)
+        self.assertEqual(tasks._pop_pending_sections(self.owner.pk), set())
+
+    def test_should_skip_owner_which_is_already_being_synced(
+        self, mock_blueprints, mock_jobs, mock_locations
+    ):
+        # when
+        with self.owner.sync_lock():
+            result = tasks.sync_owner(self.owner.pk)
+        # then
+        self.assertIsNone(result)
+        self.assertFalse(mock_blueprints.called)
+        # when
+        tasks.sync_owner(self.owner.pk)
+        # then
+        self.assertTrue(mock_blueprints.called)
+
+
+@patch(TASKS_PATH + ".esi_status")
+@patch(TASKS_PATH + ".Owner.sync_esi", autospec=True)
+class TestSyncOwners(TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        super().setUpClass()
+        load_entities()
+        cls.owner_1 = create_owner(character_id=1101, corporation_id=2101)
+        cls.owner_2 = create_owner(character_id=1001, corporation_id=None)
+
+    def test_should_sync_all_owners_of_batch_despite_failures(
+        self, mock_sync_esi, mock_esi_status
+    ):
+        # given
+        mock_esi_status.return_value = EsiStatus(True, 100, 60)
+        owners_synced = []
+
+        def sync_esi(owner, sections, force_update):
+            owners_synced.append(owner.pk)
+            if owner.pk == self.owner_1.pk:
+                raise RuntimeError("boom")
+
+        mock_sync_esi.side_effect = sync_esi
+        # when
+        result = tasks.sync_owners(
+            [self.owner_1.pk, self.owner_2.pk], sections=["blueprints"]
+        )
+        # then
+        self.assertSetEqual(set(owners_synced), {self.owner_1.pk, self.owner_2.pk})
+        self.assertEqual(
+            result,
+            {"synced": [self.owner_2.pk], "failed": [self.owner_1.pk], "requeued": []},
+        )
+
+    @patch(TASKS_PATH + ".sync_owners.apply_async")
+    def test_should_queue_owners_again_when_esi_is_unavailable(
+        self, mock_apply_async, mock_sync_esi, mock_esi_status
+    ):
+        # given
+        mock_esi_status.return_value = EsiStatus(True, 100, 60)
+
+        def sync_esi(owner, sections, force_update):
+            if owner.pk == self.owner_1.pk:
+                raise EsiErrorLimitExceeded(retry_in=42)
+
+        mock_sync_esi.side_effect = sync_esi
+        # when
+        result = tasks.sync_owners(
+            [self.owner_1.pk, self.owner_2.pk], sections=["blueprints"]
+        )
+        # then
+        self.assertEqual(
+            result,
+            {"synced": [self.owner_2.pk], "failed": [], "requeued": [self.owner_1.pk]},
+        )
+        _, kwargs = mock_apply_async.call_args
+        self.assertEqual(kwargs["kwargs"]["owner_pks"], [self.owner_1.pk])
+        self.assertEqual(kwargs["kwargs"]["requeued"], 1)
+        self.assertEqual(kwargs["countdown"], 42)
+
+    @patch(TASKS_PATH + ".sync_owners.apply_async")
+    def test_should_give_up_on_owners_with_recurring_connection_errors(
+        self, mock_apply_async, mock_sync_esi, mock_esi_status
+    ):
+        # given
+        mock_esi_status.return_value = EsiStatus(True, 100, 60)
+        mock_sync_esi.side_effect = OSError
+        # when
+        result = tasks.sync_owners([self.owner_1.pk], requeued=3)
+        # then
+        self.assertEqual(
+            result, {"synced": [], "failed": [self.owner_1.pk], "requeued": []}
+        )
+        self.assertFalse(mock_apply_async.called)
+
+    @patch("celery.app.task.Task.apply_async")
+    def test_should_queue_failed_batch_again_while_holding_its_lock(
+        self, mock_apply_async, mock_sync_esi, mock_esi_status
+    ):
+        # given
+        mock_esi_status.return_value = EsiStatus(True, 100, 60)
+        mock_sync_esi.side_effect = EsiErrorLimitExceeded(retry_in=42)
+        batch = {"owner_pks": [self.owner_1.pk], "sections": ["blueprints"]}
+        locks = {tasks.sync_owners.get_key(kwargs={**batch, "requeued": 0})}
+        # when
+        with patch.object(
+            DjangoBackend, "raise_or_lock", side_effect=self._lock_once(locks)
+        ):
+            result = tasks.sync_owners(**batch, requeued=0)
+        # then
+        self.assertEqual(
+            result, {"synced": [], "failed": [], "requeued": [self.owner_1.pk]}
+        )
+        _, kwargs = mock_apply_async.call_args
+        self.assertEqual(kwargs["countdown"], 42)
+
+    @patch("celery.app.task.Task.apply_async")
+    def test_should_report_owners_as_failed_when_batch_can_not_be_queued_again(
+        self, mock_apply_async, mock_sync_esi, mock_esi_status
+    ):
+        # given
+        mock_esi_status.return_value = EsiStatus(True, 100, 60)
+        mock_sync_esi.side_effect = EsiErrorLimitExceeded(retry_in=42)
+        batch = {"owner_pks": [self.owner_1.pk], "sections": ["blueprints"]}
+        locks = {
+            tasks.sync_owners.get_key(kwargs={**batch, "requeued": requeued})
+            for requeued in [0, 1]
+        }
+        # when
+        with patch.object(
+            DjangoBackend, "raise_or_lock", side_effect=self._lock_once(locks)
+        ):
+            result = tasks.sync_owners(**batch, requeued=0)
+        # then
+        self.assertEqual(
+            result, {"synced": [], "failed": [self.owner_1.pk], "requeued": []}
+        )
+        self.assertFalse(mock_apply_async.called)
+
+    @staticmethod
+    def _lock_once(locks: set):
+        """returns a lock of QueueOnce, which is already held for the given keys"""
+
+        def raise_or_lock(key, timeout):
+            if key in locks:
+                raise AlreadyQueued(timeout)
+            locks.add(key)
+
+        return raise_or_lock
+
+    @patch(TASKS_PATH + ".sync_owners.retry")
+    def test_should_retry_batch_when_error_limit_is_reached(
+        self, mock_retry, mock_sync_esi, mock_esi_status
+    ):
+        # given
+        mock_esi_status.return_value = EsiStatus(True, 10, 60)
+        mock_retry.side_effect = Retry
+        # when
+        with self.assertRaises(Retry):
+            tasks.sync_owners([self.owner_1.pk])
+        # then
+        self.assertFalse(mock_sync_esi.called)
+
+    @patch(TASKS_PATH + ".BLUEPRINTS_BATCH_SYNC_WORKERS", 2)
+    def test_should_fetch_pages_sequentially_for_owners_synced_in_threads(
+        self, mock_sync_esi, mock_esi_status
+    ):
+        # given
+        mock_esi_status.return_value = EsiStatus(True, 100, 60)
+        page_workers = []
+
+        def sync_esi(owner, sections, force_update):
+            page_workers.append(_max_workers_within_error_limit({}, 4))
+
+        mock_sync_esi.side_effect = sync_esi
+        # when
+        tasks.sync_owners([self.owner_1.pk, self.owner_2.pk], sections=["blueprints"])
+        # then
+        self.assertEqual(page_workers, [1, 1])
+
+    @patch(TASKS_PATH + ".BLUEPRINTS_BATCH_SYNC_WORKERS", 20)
+    def test_should_limit_threads_by_remaining_error_limit(
+        self, mock_sync_esi, mock_esi_status
+    ):
+        # given
+        mock_esi_status.return_value = EsiStatus(True, 30, 60)
+        # when/then
+        self.assertEqual(tasks._batch_sync_workers(50), 5)
+        self.assertEqual(tasks._batch_sync_workers(3), 3)
+
+
+@patch(TASKS_PATH + ".update_outdated_locations_for_owner")
+class TestUpdateAllOutdatedLocations(TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        super().setUpClass()
+        load_entities()
+        cls.owner_1 = create_owner(character_id=1101, corporation_id=2101)
+        cls.owner_2 = create_owner(character_id=1001, corporation_id=None)
+        Owner.objects.filter(pk=cls.owner_2.pk).update(is_active=False)
+
+    def test_should_queue_active_owners(self, mock_task):
+        # when
+        result = tasks.update_all_outdated_locations()
+        # then
+        self.assertEqual(result, 1)
+        _, kwargs = mock_task.apply_async.call_args
+        self.assertEqual(kwargs["kwargs"], {"owner_pk": self.owner_1.pk})
+
+
+@patch(TASKS_PATH + ".Location.objects.structures_update_or_create_esi")
+class TestUpdateStructuresEsi(TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        super().setUpClass()
+        load_entities()
+        cls.token = create_owner(character_id=1101, corporation_id=None).token(
+            ["esi-universe.read_structures.v1"]
+        )[0]
+
+    def setUp(self) -> None:
+        cache.clear()
+
+    def test_should_update_batch_of_structures(self, mock_update):
+        # given
+        mock_update.return_value = SyncResult(created=1, updated=1)
+        # when
+        result = tasks.update_structures_esi(
+            ids=[1000000000001, 1000000000002], token_pk=self.token.pk
+        )
+        # then
+        self.assertEqual(result["created"], 1)
+        args, _ = mock_update.call_args
+        self.assertEqual(args[0], [1000000000001, 1000000000002])
+
+    @patch(TASKS_PATH + ".update_structures_esi.retry")
+    def test_should_defer_batch_when_error_limit_is_reached(
+        self, mock_retry, mock_update
+    ):
+        # given
+        mock_update.side_effect = EsiErrorLimitExceeded(retry_in=42)
+        mock_retry.side_effect = Retry
+        # when
+        with self.assertRaises(Retry):
+            tasks.update_structures_esi(ids=[1000000000001], token_pk=self.token.pk)
+        # then
+        _, kwargs = mock_retry.call_args
+        self.assertEqual(kwargs["countdown"], 42)
+        self.assertEqual(tasks._claim_structures([1000000000001]), [1000000000001])
+
+    def test_should_skip_structures_updated_by_other_task(self, mock_update):
+        # given
+        mock_update.return_value = SyncResult(updated=1)
+        tasks.update_structures_esi(ids=[1000000000001], token_pk=self.token.pk)
+        # when
+        tasks.update_structures_esi(
+            ids=[1000000000001, 1000000000002], token_pk=self.token.pk
+        )
+        # then
+        args, _ = mock_update.call_args
+        self.assertEqual(args[0], [1000000000002])
+        self.assertEqual(mock_update.call_count, 2)
+        # when
+        result = tasks.update_structures_esi(
+            ids=[1000000000002], token_pk=self.token.pk
+        )
+        # then
+        self.assertEqual(result["updated"], 0)
+        self.assertEqual(mock_update.call_count, 2)
+
+
+class TestDeleteRetiredBlueprints(TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        super().setUpClass()
+        load_entities()
+        load_eveuniverse()
+        load_locations()
+
+    def test_should_delete_retired_blueprints_of_owner_only(self):
+        # given
+        owner = create_owner(character_id=1101, corporation_id=2101)
+        other_owner = create_owner(character_id=1001, corporation_id=None)
+        Owner.objects.filter(pk__in=[owner.pk, other_owner.pk]).update(
+            blueprints_generation=2
+        )
+        params = {
+            "location": Location.objects.get(id=60003760),
+            "eve_type": EveType.objects.get(id=33519),
+            "location_flag": "AssetSafety",
+            "material_efficiency": 10,
+            "time_efficiency": 20,
+        }
+        Blueprint.objects.create(item_id=1, owner=owner, last_generation=1, **params)
+        Blueprint.objects.create(item_id=2, owner=owner, last_generation=2, **params)
+        Blueprint.objects.create(
+            item_id=3, owner=other_owner, last_generation=1, **params
+        )
+        # when
+        tasks.delete_retired_blueprints(owner_pk=owner.pk)
+        # then
+        self.assertSetEqual(
+            set(Blueprint.objects.values_list("item_id", flat=True)), {2, 3}
+        )
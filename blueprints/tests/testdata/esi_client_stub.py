@@ -14,6 +14,7 @@ def load_test_data():
 
 
 _endpoints = [
+    EsiEndpoint("Alliance", "get_alliances_alliance_id", "alliance_id"),
     EsiEndpoint(
         "Assets",
         "get_characters_character_id_assets",
@@ -47,6 +48,7 @@ _endpoints = [
         "get_characters_character_id",
         "character_id",
     ),
+    EsiEndpoint("Character", "post_characters_affiliation"),
     EsiEndpoint(
         "Contacts",
         "get_characters_character_id_contacts",
@@ -89,6 +91,11 @@ _endpoints = [
         "character_id",
         needs_token=True,
     ),
+    EsiEndpoint(
+        "Corporation",
+        "get_corporations_corporation_id",
+        "corporation_id",
+    ),
     EsiEndpoint(
         "Corporation",
         "get_corporations_corporation_id_blueprints",
@@ -169,6 +176,7 @@ _endpoints = [
         needs_token=True,
     ),
     EsiEndpoint("Universe", "get_universe_systems_system_id", "system_id"),
+    EsiEndpoint("Universe", "post_universe_names"),
     EsiEndpoint(
         "Wallet",
         "get_characters_character_id_wallet",
@@ -2,10 +2,12 @@
 Tools for building unit tests with django-esi
 """
 
+import hashlib
+import json
 from collections import namedtuple
 from typing import Any, List
 
-from bravado.exception import HTTPInternalServerError, HTTPNotFound
+from bravado.exception import HTTPInternalServerError, HTTPNotFound, HTTPNotModified
 
 from django.utils.dateparse import parse_datetime
 
@@ -37,12 +39,23 @@ class BravadoOperationStub:
         def __init__(self, headers):
             self.headers = headers
 
-    def __init__(self, data, headers: dict = None, also_return_response: bool = False):
+    def __init__(
+        self,
+        data,
+        headers: dict = None,
+        also_return_response: bool = False,
+        not_modified: bool = False,
+    ):
         self._data = data
         self._headers = headers if headers else {"x-pages": 1}
+        self._not_modified = not_modified
         self.request_config = BravadoOperationStub.RequestConfig(also_return_response)
 
     def result(self, **kwargs):
+        if self._not_modified:
+            raise HTTPNotModified(
+                response=BravadoResponseStub(304, "Not Modified", headers=self._headers)
+            )
         if self.request_config.also_return_response:
             return [self._data, self.ResponseStub(self._headers)]
         else:
@@ -135,7 +148,19 @@ class _EsiRoute:
                 ),
             ) from None
 
-        return BravadoOperationStub(result)
+        etag = self._make_etag(result)
+        request_headers = kwargs.get("_request_options", {}).get("headers", {})
+        return BravadoOperationStub(
+            result,
+            headers={"x-pages": 1, "ETag": etag},
+            not_modified=request_headers.get("If-None-Match") == etag,
+        )
+
+    @staticmethod
+    def _make_etag(data) -> str:
+        """emulates the ETag ESI would return for the given data"""
+        content = json.dumps(data, sort_keys=True, default=str)
+        return '"{}"'.format(hashlib.md5(content.encode("utf-8")).hexdigest())
 
     @staticmethod
     def _convert_values(data) -> Any:
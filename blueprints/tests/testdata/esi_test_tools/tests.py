@@ -1,6 +1,6 @@
 from datetime import datetime
 
-from bravado.exception import HTTPNotFound
+from bravado.exception import HTTPNotFound, HTTPNotModified
 
 from django.test import TestCase
 
@@ -86,3 +86,27 @@ class TestEsiClientStub(TestCase):
         )
         results = stub.Alpha.get_details(id=1).results()
         self.assertIsInstance(results["appointment"], datetime)
+
+    def test_returns_etag(self):
+        operation = self.stub.Alpha.get_cake(cake_id=1)
+        operation.request_config.also_return_response = True
+        _, response = operation.result()
+        self.assertTrue(response.headers["ETag"])
+
+    def test_raises_not_modified_on_matching_etag(self):
+        operation = self.stub.Alpha.get_cake(cake_id=1)
+        operation.request_config.also_return_response = True
+        _, response = operation.result()
+        etag = response.headers["ETag"]
+        with self.assertRaises(HTTPNotModified):
+            self.stub.Alpha.get_cake(
+                cake_id=1, _request_options={"headers": {"If-None-Match": etag}}
+            ).result()
+
+    def test_returns_data_on_other_etag(self):
+        self.assertEqual(
+            self.stub.Alpha.get_cake(
+                cake_id=1, _request_options={"headers": {"If-None-Match": '"x"'}}
+            ).result(),
+            "cheesecake",
+        )
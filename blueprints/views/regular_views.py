@@ -96,8 +96,7 @@ def add_corporate_blueprint_owner(request, token):
 
             owner.save()
 
-        tasks.update_blueprints_for_owner.delay(owner_pk=owner.pk)
-        tasks.update_locations_for_owner.delay(owner_pk=owner.pk)
+        tasks.sync_owner.delay(owner_pk=owner.pk)
         messages_plus.info(
             request,
             format_html(
@@ -173,8 +172,7 @@ def add_personal_blueprint_owner(request, token):
 
             owner.save()
 
-        tasks.update_blueprints_for_owner.delay(owner_pk=owner.pk)
-        tasks.update_locations_for_owner.delay(owner_pk=owner.pk)
+        tasks.sync_owner.delay(owner_pk=owner.pk)
         messages_plus.info(
             request,
             format_html(